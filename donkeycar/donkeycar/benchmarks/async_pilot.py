@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+
+from donkeycar.parts.async_pilot import AsyncPilot
+from donkeycar.parts.keras import KerasLinear
+from donkeycar.vehicle import Vehicle
+
+
+class Camera:
+    def run(self):
+        return np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+
+
+class Recorder:
+    """ Collects the age of the predictions the loop sees """
+    def __init__(self):
+        self.ages = []
+
+    def run(self, age_ms=None):
+        if age_ms is not None:
+            self.ages.append(age_ms)
+
+
+def drive(kl, rate_hz, asynchronous, loops):
+    """ Drive loop with the pilot, returns the achieved rate and ages """
+    V = Vehicle()
+    recorder = Recorder()
+    V.add(Camera(), outputs=['cam/image_array'])
+    if asynchronous:
+        V.add(AsyncPilot(kl, 2), inputs=['cam/image_array'],
+              outputs=['pilot/angle', 'pilot/throttle', 'pilot/age_ms',
+                       'pilot/frame_id'], threaded=True)
+        V.add(recorder, inputs=['pilot/age_ms'])
+    else:
+        V.add(kl, inputs=['cam/image_array'],
+              outputs=['pilot/angle', 'pilot/throttle'])
+    start = time.perf_counter()
+    V.start(rate_hz=rate_hz, max_loop_count=loops)
+    return loops / (time.perf_counter() - start), recorder.ages
+
+
+def benchmark(rates=(20, 100, 400), loops=400):
+    kl = KerasLinear()
+    kl.run(Camera().run())
+    start = time.perf_counter()
+    for _ in range(20):
+        kl.run(Camera().run())
+    print(f'inference: {(time.perf_counter() - start) / 20 * 1000:.1f}ms')
+    for rate_hz in rates:
+        for asynchronous in (False, True):
+            achieved, ages = drive(kl, rate_hz, asynchronous, loops)
+            line = f'{"async" if asynchronous else "sync":5s}: ' \
+                   f'{achieved:5.1f}Hz of {rate_hz}Hz'
+            if ages:
+                line += f', prediction age median {np.median(ages):.1f}ms ' \
+                        f'max {np.max(ages):.1f}ms'
+            print(line)
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,35 @@
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from donkeycar.config import Config
+from donkeycar.pipeline.augmentations import ImageAugmentation
+from donkeycar.pipeline.batch_augmentations import BatchAugmentation
+
+
+def benchmark(batch_size=128, shape=(120, 160, 3), runs=10):
+    batch = np.random.randint(0, 255, (batch_size, ) + shape, dtype=np.uint8)
+    for augmentations in (['BRIGHTNESS'], ['BLUR'], ['CUTOUT'],
+                          ['BRIGHTNESS', 'BLUR', 'CUTOUT']):
+        cfg = Config()
+        cfg.AUGMENTATIONS = augmentations
+        per_image = ImageAugmentation(cfg, 'AUGMENTATIONS')
+        # traced into a graph like in the tf.data pipeline
+        batched = tf.function(BatchAugmentation(cfg, 'AUGMENTATIONS').run)
+        batched(batch)
+        start = time.perf_counter()
+        for _ in range(runs):
+            np.stack([per_image.run(img) for img in batch])
+        image_time = (time.perf_counter() - start) / runs
+        start = time.perf_counter()
+        for _ in range(runs):
+            batched(batch)
+        batch_time = (time.perf_counter() - start) / runs
+        print(f'{"+".join(augmentations):24s}: per image '
+              f'{image_time * 1000:7.1f}ms, batch {batch_time * 1000:7.1f}ms '
+              f'per batch of {batch_size}')
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,37 @@
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from donkeycar.parts.image_codec import get_codec
+from donkeycar.parts.tub_v2 import Tub
+
+
+def benchmark(count=300, shape=(120, 160, 3)):
+    # camera like images, random noise would be unrealistically hard to encode
+    base = np.random.randint(0, 255, shape, dtype=np.uint8)
+    images = [np.roll(base, i, axis=1) for i in range(count)]
+    for name in ('pil', 'cv2', 'raw'):
+        for workers in (0, 2, 4):
+            try:
+                codec = get_codec(name)
+            except ImportError:
+                print(f'{name:4s}: not available')
+                break
+            path = tempfile.mkdtemp()
+            tub = Tub(path, ['cam/image_array'], ['image_array'],
+                      image_codec=codec, encoder_workers=workers)
+            start = time.perf_counter()
+            for img in images:
+                tub.write_record({'cam/image_array': img})
+            loop = time.perf_counter() - start
+            tub.close()
+            total = time.perf_counter() - start
+            print(f'{name:4s} workers={workers}: {loop / count * 1000:6.2f} '
+                  f'ms per record in loop, {count / total:7.1f} records/s')
+            shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from donkeycar.config import Config
+from donkeycar.parts.image_transformations import ImageTransformations
+from donkeycar.parts.inference_engine import InferenceEngine
+from donkeycar.parts.interpreter import TfLite, keras_to_tflite
+from donkeycar.parts.keras import KerasLinear
+
+
+def create_pilots(count, tflite):
+    """ Ensemble of linear models """
+    path = tempfile.mkdtemp()
+    pilots = []
+    for i in range(count):
+        kl = KerasLinear()
+        if tflite:
+            model_path = os.path.join(path, f'model_{i}.tflite')
+            keras_to_tflite(kl.interpreter.model, model_path)
+            kl = KerasLinear(interpreter=TfLite())
+            kl.load(model_path)
+        pilots.append(kl)
+    return pilots
+
+
+def measure(run, runs):
+    run()
+    start = time.perf_counter()
+    for _ in range(runs):
+        run()
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def benchmark(count=3, runs=100):
+    cfg = Config()
+    cfg.TRANSFORMATIONS = ['BLUR']
+    cfg.BLUR_KERNEL, cfg.BLUR_KERNEL_Y, cfg.BLUR_GAUSSIAN = 5, None, True
+    img = np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+    for tflite in (False, True):
+        pilots = create_pilots(count, tflite)
+        # every model as its own part, with its own transformation
+        parts = [(ImageTransformations(cfg, 'TRANSFORMATIONS'), pilot)
+                 for pilot in pilots]
+
+        def separate():
+            return [pilot.run(transformation.run(img))
+                    for transformation, pilot in parts]
+
+        cases = {'separate parts': separate}
+        for concurrent in (False, True):
+            engine = InferenceEngine(cfg, concurrent=concurrent)
+            for i, pilot in enumerate(pilots):
+                engine.add_model(f'm{i}', pilot, [f'm{i}/angle',
+                                                  f'm{i}/throttle'])
+            cases[f'engine{" concurrent" if concurrent else ""}'] = \
+                lambda engine=engine: engine.run(img)
+        for name, run in cases.items():
+            print(f'{count} {"tflite" if tflite else "keras"} models, '
+                  f'{name:17s}: {measure(run, runs):6.2f}ms per frame')
+        stats = engine.stats()
+        print('  ' + ', '.join(f'{name} {s["mean_ms"]:.2f}ms'
+                               for name, s in stats.items()))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from donkeycar.parts.interpreter import TfLite, keras_to_tflite
+from donkeycar.parts.keras import KerasLinear
+from donkeycar.parts.model_reloader import ModelReloader, ReloadablePilot
+
+
+def create_pilot(path):
+    return KerasLinear(interpreter=TfLite()) if path.endswith('.tflite') \
+        else KerasLinear()
+
+
+def touch(path):
+    t = time.time() + 10
+    os.utime(path, (t, t))
+
+
+def drive(pilot, seconds, period=0.05, reload=None):
+    """ Loop at 20Hz, returns the longest tick in ms """
+    img = np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+    longest = 0.0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        if reload:
+            reload()
+            reload = None
+        pilot.run(img)
+        duration = time.perf_counter() - start
+        longest = max(longest, duration)
+        time.sleep(max(0.0, period - duration))
+    return longest * 1000
+
+
+def benchmark():
+    base = tempfile.mkdtemp()
+    h5_path = os.path.join(base, 'model.h5')
+    tflite_path = os.path.join(base, 'model.tflite')
+    kl = KerasLinear()
+    kl.interpreter.model.save(h5_path)
+    keras_to_tflite(kl.interpreter.model, tflite_path)
+    for path in (h5_path, tflite_path):
+        name = os.path.splitext(path)[1]
+        kl = create_pilot(path)
+        kl.load(path)
+        idle = drive(kl, 1)
+        # load in the drive loop, like the triggered callback did
+        inline = drive(kl, 2, reload=lambda: kl.load(path))
+        pilot = ReloadablePilot(kl)
+        reloader = ModelReloader(pilot, lambda: create_pilot(path),
+                                 lambda p, f: p.load(f), path,
+                                 settle_time=0.0, poll_delay=0.05)
+        thread = threading.Thread(target=reloader.update, daemon=True)
+        thread.start()
+        touch(path)
+        background = drive(pilot, 3)
+        reloader.shutdown()
+        thread.join()
+        print(f'{name:7s}: longest tick idle {idle:6.1f}ms, loading in the '
+              f'loop {inline:6.1f}ms, loading in the background '
+              f'{background:6.1f}ms, load and warm up took '
+              f'{reloader.load_ms:6.1f}ms, swapped {pilot.swaps}')
+
+
+if __name__ == "__main__":
+    benchmark()
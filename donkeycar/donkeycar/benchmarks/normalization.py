@@ -0,0 +1,55 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from donkeycar.parts.interpreter import TfLite, keras_to_tflite
+from donkeycar.parts.keras import KerasLinear
+
+
+def training_batch(batch_size=128, shape=(120, 160, 3), runs=20):
+    """ Size and normalisation time of an image batch in training """
+    batch = np.random.randint(0, 255, (batch_size, ) + shape, dtype=np.uint8)
+    cases = {'float64': lambda: batch.astype(np.float64) * (1.0 / 255.0),
+             'float32': lambda: np.multiply(batch, np.float32(1.0 / 255.0),
+                                            dtype=np.float32),
+             'uint8': lambda: batch}
+    for name, normalise in cases.items():
+        start = time.perf_counter()
+        for _ in range(runs):
+            out = normalise()
+        duration = (time.perf_counter() - start) / runs
+        print(f'batch {name:7s}: {out.nbytes / (1 << 20):6.1f}MB '
+              f'{duration * 1000:7.2f}ms')
+
+
+def drive_loop(runs=200):
+    """ Latency of KerasPilot.run with float and uint8 models """
+    img = np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+    path = tempfile.mkdtemp()
+    for uint8 in (False, True):
+        kl = KerasLinear()
+        if uint8:
+            kl.fold_normalization()
+        tflite_path = os.path.join(path, f'model_{uint8}.tflite')
+        keras_to_tflite(kl.interpreter.model, tflite_path)
+        kt = KerasLinear(interpreter=TfLite())
+        kt.load(tflite_path)
+        for name, pilot in (('keras', kl), ('tflite', kt)):
+            pilot.run(img)
+            start = time.perf_counter()
+            for _ in range(runs):
+                pilot.run(img)
+            duration = (time.perf_counter() - start) / runs
+            print(f'run {name:6s} {"uint8" if uint8 else "float32":7s}: '
+                  f'{duration * 1000:7.2f}ms')
+
+
+def benchmark():
+    training_batch()
+    drive_loop()
+
+
+if __name__ == "__main__":
+    benchmark()
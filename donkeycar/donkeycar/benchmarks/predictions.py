@@ -0,0 +1,70 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from donkeycar.config import Config
+from donkeycar.parts.interpreter import keras_to_tflite
+from donkeycar.parts.keras import KerasLinear
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.predictions import predict_records, predict_tub
+from donkeycar.pipeline.types import TubDataset
+from donkeycar.utils import get_model_by_type
+
+
+def create_tub(path, count):
+    tub = Tub(path, ['cam/image_array', 'user/angle', 'user/throttle'],
+              ['image_array', 'float', 'float'])
+    base = np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+    for i in range(count):
+        tub.write_record({'cam/image_array': np.roll(base, i, axis=1),
+                          'user/angle': 0.1, 'user/throttle': 0.2})
+    tub.close()
+
+
+def record_by_record(model, records):
+    """ How tubplot predicted before """
+    return [model.inference_from_dict(model.x_transform(r, model.normalize))
+            for r in records]
+
+
+def benchmark(count=1000):
+    base = tempfile.mkdtemp()
+    tub_path = os.path.join(base, 'tub')
+    create_tub(tub_path, count)
+    kl = KerasLinear()
+    model_paths = {'linear': os.path.join(base, 'model.h5'),
+                   'tflite_linear': os.path.join(base, 'model.tflite')}
+    kl.interpreter.model.save(model_paths['linear'])
+    keras_to_tflite(kl.interpreter.model, model_paths['tflite_linear'])
+    cfg = Config()
+    cfg.IMAGE_W, cfg.IMAGE_H, cfg.IMAGE_DEPTH = 160, 120, 3
+    for model_type, model_path in model_paths.items():
+        model = get_model_by_type(model_type, cfg)
+        model.load(model_path)
+        records = TubDataset(cfg, [tub_path]).get_records()
+        start = time.perf_counter()
+        record_by_record(model, records)
+        single = time.perf_counter() - start
+        print(f'{model_type:13s} record by record  : '
+              f'{count / single:7.0f} records/s')
+        for batch_size in (32, 256):
+            start = time.perf_counter()
+            predict_records(model, cfg, records, batch_size)
+            batched = time.perf_counter() - start
+            print(f'{model_type:13s} batches of {batch_size:4d}  : '
+                  f'{count / batched:7.0f} records/s, '
+                  f'{single / batched:4.1f}x')
+        # the first call stores the predictions in the tub, later ones
+        # like tubplot, makemovie or the ui only read them
+        predict_tub(model, cfg, tub_path, model_path, model_type)
+        start = time.perf_counter()
+        predict_tub(model, cfg, tub_path, model_path, model_type)
+        print(f'{model_type:13s} stored predictions: '
+              f'{(time.perf_counter() - start) * 1000:7.1f}ms for all '
+              f'records')
+
+
+if __name__ == "__main__":
+    benchmark()
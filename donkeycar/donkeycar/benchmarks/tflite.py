@@ -0,0 +1,106 @@
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from donkeycar.parts.interpreter import TfLite, keras_to_tflite
+from donkeycar.parts.keras import KerasLinear, KerasCategorical, \
+    KerasInferred, KerasIMU, KerasMemory, KerasBehavioral, KerasLocalizer, \
+    KerasLSTM
+from donkeycar.utils import normalize_image
+
+# pilot class and additional input of the pilot
+MODELS = {'linear': (KerasLinear, None),
+          'categorical': (KerasCategorical, None),
+          'inferred': (KerasInferred, None),
+          'imu': (KerasIMU, [0.1] * 6),
+          'memory': (KerasMemory, [0.1, 0.2] * 3),
+          'behavior': (KerasBehavioral, [1.0, 0.0]),
+          'localizer': (KerasLocalizer, None),
+          'lstm': (KerasLSTM, None)}
+
+
+def set_tensor_predict(pilot, img, other):
+    """ Prediction as before, with set_tensor and get_tensor """
+    interpreter = pilot.interpreter.interpreter
+    details = pilot.interpreter.input_details
+    arrays = [np.expand_dims(normalize_image(img), axis=0)]
+    if other is not None:
+        arrays.append(np.expand_dims(np.array(other), axis=0))
+    for arr, detail in zip(arrays, details):
+        interpreter.set_tensor(detail['index'],
+                               arr.reshape(detail['shape'])
+                               .astype(detail['dtype']))
+    interpreter.invoke()
+    outputs = [interpreter.get_tensor(d['index'])[0]
+               for d in pilot.interpreter.output_details]
+    return pilot.interpreter_to_output(outputs if len(outputs) > 1
+                                       else outputs[0])
+
+
+def representative_data(pilot, other):
+    """ Random inputs covering [0, 1] for the full integer conversion """
+    shape = pilot.get_input_shapes()[0][1:]
+    names = pilot.interpreter.model.input_names
+
+    def gen():
+        for _ in range(20):
+            inputs = [np.random.rand(1, *shape).astype(np.float32)]
+            if other is not None:
+                inputs.append(np.array([other], dtype=np.float32))
+            yield dict(zip(names, inputs))
+
+    return gen
+
+
+def measure(predict, runs):
+    """ Milliseconds and allocated kB per prediction """
+    predict()
+    start = time.perf_counter()
+    for _ in range(runs):
+        predict()
+    duration = (time.perf_counter() - start) / runs
+    tracemalloc.start()
+    predict()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration * 1000, peak / 1024
+
+
+def benchmark(runs=200):
+    path = tempfile.mkdtemp()
+    img = np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+    for model_type, (pilot_class, other) in MODELS.items():
+        km = pilot_class()
+        args = (img, other) if other is not None else (img, )
+        float_path = os.path.join(path, f'{model_type}.tflite')
+        keras_to_tflite(km.interpreter.model, float_path)
+        cases = {}
+        for threads, xnnpack in ((None, True), (1, True), (1, False)):
+            kl = pilot_class(interpreter=TfLite(threads, xnnpack))
+            kl.load(float_path)
+            name = f'{threads or "default"} thread xnnpack ' \
+                   f'{"on" if xnnpack else "off"}'
+            if threads is None and model_type != 'lstm':
+                # the lstm model keeps a sequence of frames in run()
+                cases['set_tensor'] = \
+                    lambda kl=kl: set_tensor_predict(kl, img, other)
+            cases[name] = lambda kl=kl: kl.run(*args)
+        if model_type != 'lstm':
+            # lstm cells can't be quantised to integer operations
+            int_path = os.path.join(path, f'{model_type}_int.tflite')
+            keras_to_tflite(km.interpreter.model, int_path,
+                            representative_data(km, other))
+            ki = pilot_class(interpreter=TfLite())
+            ki.load(int_path)
+            cases['full integer'] = lambda: ki.run(*args)
+        for name, predict in cases.items():
+            ms, kb = measure(predict, runs)
+            print(f'{model_type:11s} {name:26s}: {ms:6.2f}ms '
+                  f'{kb:7.1f}kB allocated')
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import donkeycar
+from donkeycar.config import Config
+from donkeycar.parts.pytorch.torch_data import TorchTubDataModule
+from donkeycar.parts.tub_v2 import Tub
+
+
+def benchmark(count=2000, batch_size=64, epochs=2):
+    cfg = Config()
+    cfg.from_pyfile(os.path.join(os.path.dirname(donkeycar.__file__),
+                                 'templates', 'cfg_complete.py'))
+    cfg.BATCH_SIZE = batch_size
+    # measure decoding in each epoch, not the image cache
+    cfg.CACHE_IMAGES = False
+    path = tempfile.mkdtemp()
+    tub = Tub(path, ['cam/image_array', 'user/angle', 'user/throttle'],
+              ['image_array', 'float', 'float'])
+    base = np.random.randint(0, 255, (cfg.IMAGE_H, cfg.IMAGE_W, 3),
+                             dtype=np.uint8)
+    for i in range(count):
+        tub.write_record({'cam/image_array': np.roll(base, i, axis=1),
+                          'user/angle': 0.0, 'user/throttle': 0.0},
+                         flush=False)
+    tub.close()
+    for workers in (0, 2, 4):
+        cfg.TORCH_NUM_WORKERS = workers
+        data_module = TorchTubDataModule(cfg, [path])
+        data_module.setup()
+        loader = data_module.train_dataloader()
+        start = time.perf_counter()
+        images = 0
+        for _ in range(epochs):
+            for x, y in loader:
+                images += len(x)
+        duration = time.perf_counter() - start
+        print(f'{workers} workers: {images / duration:8.1f} images/s')
+    shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import donkeycar
+from donkeycar.config import Config
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.training import BatchSequence
+from donkeycar.pipeline.types import TubDataset
+from donkeycar.utils import get_model_by_type
+
+
+def benchmark(count=2000, batch_size=64, batches=50):
+    cfg = Config()
+    cfg.from_pyfile(os.path.join(os.path.dirname(donkeycar.__file__),
+                                 'templates', 'cfg_complete.py'))
+    cfg.BATCH_SIZE = batch_size
+    # measure decoding in each batch, not the image cache
+    cfg.CACHE_IMAGES = False
+    path = tempfile.mkdtemp()
+    tub = Tub(path, ['cam/image_array', 'user/angle', 'user/throttle'],
+              ['image_array', 'float', 'float'])
+    base = np.random.randint(0, 255, (cfg.IMAGE_H, cfg.IMAGE_W, 3),
+                             dtype=np.uint8)
+    for i in range(count):
+        tub.write_record({'cam/image_array': np.roll(base, i, axis=1),
+                          'user/angle': 0.0, 'user/throttle': 0.0},
+                         flush=False)
+    tub.close()
+    records = TubDataset(cfg, [path]).get_records()
+    kl = get_model_by_type('linear', cfg)
+    for pipeline in BatchSequence.PIPELINES:
+        cfg.TRAIN_PIPELINE = pipeline
+        dataset = BatchSequence(kl, cfg, records, is_train=True) \
+            .create_tf_data()
+        it = iter(dataset)
+        next(it)
+        start = time.perf_counter()
+        for _ in range(batches):
+            next(it)
+        duration = time.perf_counter() - start
+        print(f'{pipeline:9s}: {batches * batch_size / duration:8.1f} '
+              f'images/s')
+    shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,66 @@
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from donkeycar.config import Config
+from donkeycar.parts.tub_index import TubIndex
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.types import TubDataset, TubRecord
+
+
+def _measure(label, load):
+    start = time.perf_counter()
+    load()
+    duration = time.perf_counter() - start
+    # second run for the memory, tracing slows it down
+    tracemalloc.start()
+    records = load()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'{label:28s}: {duration:6.3f}s {memory / (1 << 20):7.1f}MB '
+          f'{len(records)} records')
+    return records
+
+
+def benchmark(tubs=30, count=5000):
+    base = tempfile.mkdtemp()
+    paths = []
+    for t in range(tubs):
+        path = f'{base}/tub_{t}'
+        tub = Tub(path, ['cam/image_array', 'user/angle', 'user/throttle',
+                         'user/mode'],
+                  ['str', 'float', 'float', 'str'])
+        for i in range(count):
+            tub.write_record({'cam/image_array': f'{i}_cam_image_array_.jpg',
+                              'user/angle': (i % 200) / 100 - 1,
+                              'user/throttle': (i % 50) / 50,
+                              'user/mode': 'user'}, flush=False)
+        tub.close()
+        # build the indexes, so both variants start from them
+        TubIndex.load(path)
+        paths.append(path)
+    cfg = Config()
+    cfg.TRAIN_FILTER = lambda rec: rec.underlying['user/throttle'] > 0.1
+
+    def record_list():
+        """ All records as TubRecord objects with their dictionaries """
+        records = []
+        for path in paths:
+            index = TubIndex.load(path)
+            records.extend(TubRecord(cfg, path, underlying) for underlying
+                           in index.records(index.mask(cfg.TRAIN_FILTER)))
+        return records
+
+    _measure('list of TubRecords', record_list)
+    records = _measure('TubDataset.get_records',
+                       lambda: TubDataset(cfg, paths).get_records())
+    start = time.perf_counter()
+    for record in records:
+        record.underlying['user/angle']
+    print(f'access all records: {time.perf_counter() - start:.3f}s')
+    shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    benchmark()
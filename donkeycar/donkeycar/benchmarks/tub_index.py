@@ -0,0 +1,44 @@
+import shutil
+import tempfile
+import time
+
+from donkeycar.config import Config
+from donkeycar.parts.tub_index import TubIndex
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.types import TubDataset
+
+
+def benchmark(count=100_000):
+    path = tempfile.mkdtemp()
+    tub = Tub(path, ['cam/image_array', 'user/angle', 'user/throttle',
+                     'user/mode'],
+              ['str', 'float', 'float', 'str'])
+    for i in range(count):
+        tub.write_record({'cam/image_array': f'{i}_cam_image_array_.jpg',
+                          'user/angle': (i % 200) / 100 - 1,
+                          'user/throttle': (i % 50) / 50, 'user/mode': 'user'},
+                         flush=False)
+    tub.close()
+    cfg = Config()
+    cfg.TRAIN_FILTER = lambda rec: rec.underlying['user/throttle'] > 0.1
+
+    start = time.perf_counter()
+    records = [r for r in Tub(path, read_only=True)
+               if cfg.TRAIN_FILTER(type('R', (), {'underlying': r}))]
+    print(f'iterate catalogs and filter: {time.perf_counter() - start:.3f}s'
+          f' {len(records)} records')
+    for label in ('build index', 'load index'):
+        start = time.perf_counter()
+        index = TubIndex.load(path)
+        mask = index.mask(cfg.TRAIN_FILTER)
+        print(f'{label} and filter: {time.perf_counter() - start:.3f}s '
+              f'{mask.sum()} records')
+    start = time.perf_counter()
+    records = TubDataset(cfg, [path]).get_records()
+    print(f'TubDataset.get_records: {time.perf_counter() - start:.3f}s '
+          f'{len(records)} records')
+    shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    benchmark()
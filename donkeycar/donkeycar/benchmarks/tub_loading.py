@@ -0,0 +1,62 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from donkeycar.config import Config
+from donkeycar.parts.tub_index import TubIndex
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.types import TubDataset
+
+
+def drop_page_cache():
+    """ Read the tubs from disk again, only possible as root on linux """
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3')
+        return True
+    except OSError:
+        return False
+
+
+def benchmark(tubs=50, count=2000):
+    # no per tub progress messages
+    logging.getLogger('donkeycar.pipeline.types').setLevel(logging.WARNING)
+    base = tempfile.mkdtemp()
+    for t in range(1, tubs + 1):
+        tub = Tub(f'{base}/tub_{t}', ['cam/image_array', 'user/angle',
+                                      'user/throttle', 'user/mode'],
+                  ['str', 'float', 'float', 'str'], max_catalog_len=500)
+        for i in range(count):
+            tub.write_record({'cam/image_array': f'{i}_cam_image_array_.jpg',
+                              'user/angle': (i % 200) / 100 - 1,
+                              'user/throttle': (i % 50) / 50,
+                              'user/mode': 'user'}, flush=False)
+        tub.close()
+    cfg = Config()
+    for workers in (0, 4, 8, 16):
+        cfg.TUB_LOAD_WORKERS = workers
+        timings = []
+        # the first run parses the catalogs and builds the indexes, the
+        # last one reads the indexes from disk if the page cache can be
+        # dropped
+        for cold in (False, False, True):
+            if cold and not drop_page_cache():
+                timings.append(float('nan'))
+                continue
+            start = time.perf_counter()
+            records = TubDataset(cfg, [base]).get_records()
+            timings.append(time.perf_counter() - start)
+            assert len(records) == tubs * count
+        for t in range(1, tubs + 1):
+            TubIndex.invalidate(f'{base}/tub_{t}')
+        print(f'{workers:2d} workers: without index {timings[0]:6.3f}s, '
+              f'with index {timings[1]:6.3f}s, with index and cold page '
+              f'cache {timings[2]:6.3f}s')
+    shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    benchmark()
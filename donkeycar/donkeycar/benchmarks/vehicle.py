@@ -0,0 +1,55 @@
+import timeit
+
+from donkeycar.memory import Memory
+from donkeycar.vehicle import Vehicle
+
+
+class NoOp:
+    def run(self, value):
+        return value
+
+
+def legacy_update_parts(vehicle):
+    """ Drive loop body before the execution plan was introduced """
+    for entry in vehicle.parts:
+        run = True
+        if entry.get('run_condition'):
+            run_condition = entry.get('run_condition')
+            run = vehicle.mem.get([run_condition])[0]
+        if run:
+            p = entry['part']
+            vehicle.profiler.on_part_start(p)
+            inputs = vehicle.mem.get(entry['inputs'])
+            if entry.get('thread'):
+                outputs = p.run_threaded(*inputs)
+            else:
+                outputs = p.run(*inputs)
+            if outputs is not None:
+                vehicle.mem.put(entry['outputs'], outputs)
+            vehicle.profiler.on_part_finished(p)
+
+
+def create_vehicle(num_parts):
+    mem = Memory()
+    mem['run'] = True
+    mem['value/0'] = 0.0
+    v = Vehicle(mem)
+    for i in range(num_parts):
+        v.add(NoOp(), inputs=[f'value/{i}'], outputs=[f'value/{i + 1}'],
+              run_condition='run' if i % 2 else None)
+    v.compile_plan()
+    return v
+
+
+def benchmark(number=2000):
+    for num_parts in (10, 50, 200):
+        v = create_vehicle(num_parts)
+        legacy = timeit.timeit(lambda: legacy_update_parts(v), number=number)
+        v = create_vehicle(num_parts)
+        plan = timeit.timeit(v.update_parts, number=number)
+        print(f'{num_parts:4d} parts: legacy {legacy / number * 1e6:8.1f} us, '
+              f'plan {plan / number * 1e6:8.1f} us per tick')
+
+
+if __name__ == "__main__":
+    benchmark()
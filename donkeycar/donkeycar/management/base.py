@@ -6,12 +6,11 @@ import stat
 import sys
 import logging
 
-from progress.bar import IncrementalBar
 import donkeycar as dk
 from donkeycar.management.joystick_creator import CreateJoystick
 from donkeycar.management.tub import TubManager
 
-from donkeycar.utils import normalize_image, load_image, math
+from donkeycar.utils import load_image, math
 
 PACKAGE_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 TEMPLATES_PATH = os.path.join(PACKAGE_PATH, 'templates')
@@ -329,13 +328,12 @@ class ShowHistogram(BaseCommand):
         """
         import pandas as pd
         from matplotlib import pyplot as plt
-        from donkeycar.parts.tub_v2 import Tub
+        from donkeycar.parts.tub_index import TubIndex
 
         output = out or os.path.basename(tub_paths)
         path_list = tub_paths.split(",")
-        records = [record for path in path_list for record
-                   in Tub(path, read_only=True)]
-        df = pd.DataFrame(records)
+        df = pd.concat([TubIndex.load(path).dataframe() for path in
+                        path_list], ignore_index=True)
         df.drop(columns=["_index", "_timestamp_ms"], inplace=True)
         # this prints it to screen
         if record_name is not None:
@@ -364,6 +362,36 @@ class ShowHistogram(BaseCommand):
         self.show_histogram(args.tub, args.record, args.out)
 
 
+class PackTub(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='tubpack',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--tub', nargs='+', help='paths to tubs')
+        parser.add_argument('--unpack', action='store_true',
+                            help='convert packed tubs back to image files')
+        parser.add_argument('--delete', action='store_true',
+                            help='delete image files after packing or frame '
+                                 'blobs after unpacking')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        """
+        Convert tubs between one image file per record and packed frame
+        blobs, one per catalog.
+        """
+        from donkeycar.parts.frame_store import pack_tub, unpack_tub
+        args = self.parse_args(args)
+        for tub_path in args.tub or []:
+            if args.unpack:
+                count = unpack_tub(tub_path, delete_frames=args.delete)
+                print(f'Unpacked {count} images in {tub_path}')
+            else:
+                count = pack_tub(tub_path, delete_images=args.delete)
+                print(f'Packed {count} images in {tub_path}')
+
+
 class ShowCnnActivations(BaseCommand):
 
     def __init__(self):
@@ -446,6 +474,8 @@ class ShowPredictionPlots(BaseCommand):
         import matplotlib.pyplot as plt
         import pandas as pd
         from pathlib import Path
+        from donkeycar.pipeline.predictions import predict_tub, \
+            record_indexes
         from donkeycar.pipeline.types import TubDataset
 
         model_path = os.path.expanduser(model_path)
@@ -460,27 +490,27 @@ class ShowPredictionPlots(BaseCommand):
         pilot_angles = []
         pilot_throttles = []
 
-        base_path = Path(os.path.expanduser(tub_paths)).absolute().as_posix()
-        dataset = TubDataset(config=cfg, tub_paths=[base_path],
-                             seq_size=model.seq_size())
-        records = dataset.get_records()[:limit]
-        bar = IncrementalBar('Inferencing', max=len(records))
-
         output_names = list(model.output_shapes()[1].keys())
-        for tub_record in records:
-            input_dict = model.x_transform(
-                tub_record, lambda x: normalize_image(x))
-            pilot_angle, pilot_throttle = \
-                model.inference_from_dict(input_dict)
-            y_dict = model.y_transform(tub_record)
-            user_angle, user_throttle \
-                = y_dict[output_names[0]], y_dict[output_names[1]]
-            user_angles.append(user_angle)
-            user_throttles.append(user_throttle)
-            pilot_angles.append(pilot_angle)
-            pilot_throttles.append(pilot_throttle)
-            bar.next()
-        print()  # to break the line after progress bar finishes.
+        for tub_path in tub_paths.split(','):
+            remaining = limit - len(user_angles) if limit else None
+            if remaining is not None and remaining <= 0:
+                break
+            base_path = Path(os.path.expanduser(tub_path)).absolute()\
+                .as_posix()
+            dataset = TubDataset(config=cfg, tub_paths=[base_path],
+                                 seq_size=model.seq_size())
+            records = dataset.get_records()[:remaining]
+            # predictions stored by 'donkey predict' or earlier plots are
+            # reused, only the missing records are run through the model
+            predictions = predict_tub(model, cfg, base_path, model_path,
+                                      model_type, records=records)
+            pilot = predictions.lookup(record_indexes(records))
+            pilot_angles.extend(pilot['pilot/angle'])
+            pilot_throttles.extend(pilot['pilot/throttle'])
+            for tub_record in records:
+                y_dict = model.y_transform(tub_record)
+                user_angles.append(y_dict[output_names[0]])
+                user_throttles.append(y_dict[output_names[1]])
 
         angles_df = pd.DataFrame({'user_angle': user_angles,
                                   'pilot_angle': pilot_angles})
@@ -546,6 +576,9 @@ class Train(BaseCommand):
         parser.add_argument('--comment', type=str,
                             help='comment added to model database - use '
                                  'double quotes for multiple words')
+        parser.add_argument('--dataset-cache', action='store_true',
+                            help='train from the transformed images of the '
+                                 'dataset cache, see cachedata')
         parsed_args = parser.parse_args(args)
         return parsed_args
 
@@ -554,6 +587,8 @@ class Train(BaseCommand):
         args.tub = ','.join(args.tub)
         my_cfg = args.myconfig
         cfg = load_config(args.config, my_cfg)
+        if args.dataset_cache:
+            cfg.TRAIN_DATASET_CACHE = True
         framework = args.framework if args.framework \
             else getattr(cfg, 'DEFAULT_AI_FRAMEWORK', 'tensorflow')
 
@@ -592,6 +627,80 @@ class ModelDatabase(BaseCommand):
         print(tub_txt)
 
 
+class CacheDataset(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='cachedata',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--tub', nargs='+', help='tubs to cache')
+        parser.add_argument('--config', default='./config.py',
+                            help=HELP_CONFIG)
+        parser.add_argument('--myconfig', default='./myconfig.py',
+                            help='file name of myconfig file, defaults to '
+                                 'myconfig.py')
+        parser.add_argument('--force', action='store_true',
+                            help='rebuild the cache even if it is up to date')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        """
+        Apply the TRANSFORMATIONS of the config to all images of the tubs
+        and store the result in the dataset cache used by
+        'donkey train --dataset-cache'.
+        """
+        from donkeycar.pipeline.dataset_cache import DatasetCache
+        from donkeycar.pipeline.types import find_tubs
+        args = self.parse_args(args)
+        cfg = load_config(args.config, args.myconfig)
+        tub_paths = find_tubs(args.tub)
+        cache = None if args.force else DatasetCache.open(cfg, tub_paths)
+        if cache:
+            print(f'Dataset cache {cache.path} is up to date')
+        else:
+            cache = DatasetCache.build(cfg, tub_paths)
+            print(f'Cached {len(cache)} images in {cache.path}')
+
+
+class Predict(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='predict',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--tub', nargs='+', help='tubs to predict')
+        parser.add_argument('--model', required=True,
+                            help='model for predictions')
+        parser.add_argument('--type', default=None, help='model type')
+        parser.add_argument('--config', default='./config.py',
+                            help=HELP_CONFIG)
+        parser.add_argument('--myconfig', default='./myconfig.py',
+                            help='file name of myconfig file, defaults to '
+                                 'myconfig.py')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='how many records to predict per tub')
+        parser.add_argument('--force', action='store_true',
+                            help='predict all records, even if stored '
+                                 'predictions are up to date')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        """
+        Run the model over all records of the tubs in batches and store the
+        predictions in the tubs, where tubplot, makemovie and the ui find
+        them.
+        """
+        from donkeycar.pipeline.predictions import predict_tubs
+        from donkeycar.pipeline.types import find_tubs
+        args = self.parse_args(args)
+        cfg = load_config(args.config, args.myconfig)
+        tub_paths = find_tubs(args.tub)
+        predictions = predict_tubs(cfg, tub_paths, args.model, args.type,
+                                   args.limit, args.force)
+        for tub_path, prediction in predictions.items():
+            print(f'{len(prediction)} predictions in {tub_path}')
+
+
 class Gui(BaseCommand):
     def run(self, args):
         from donkeycar.management.kivy_ui import main
@@ -609,6 +718,9 @@ def execute_from_command_line():
         'tubclean': TubManager,
         'tubplot': ShowPredictionPlots,
         'tubhist': ShowHistogram,
+        'tubpack': PackTub,
+        'cachedata': CacheDataset,
+        'predict': Predict,
         'makemovie': MakeMovieShell,
         'createjs': CreateJoystick,
         'cnnactivations': ShowCnnActivations,
@@ -35,9 +35,11 @@ from kivy.uix.spinner import SpinnerOption, Spinner
 
 from donkeycar import load_config
 from donkeycar.parts.image_transformations import ImageTransformations
+from donkeycar.parts.tub_index import TubIndex
 from donkeycar.parts.tub_v2 import Tub
 from donkeycar.pipeline.augmentations import ImageAugmentation
 from donkeycar.pipeline.database import PilotDatabase
+from donkeycar.pipeline.predictions import load_predictions
 from donkeycar.pipeline.types import TubRecord
 from donkeycar.utils import get_model_by_type
 from donkeycar.pipeline.training import train
@@ -233,6 +235,8 @@ class TubLoader(BoxLayout, FileChooserBase):
     tub = ObjectProperty(None)
     len = NumericProperty(1)
     records = None
+    index = None
+    mask = None
 
     def load_action(self):
         """ Update tub from the file path"""
@@ -261,10 +265,13 @@ class TubLoader(BoxLayout, FileChooserBase):
         # Check if filter is set in tub screen
         # expression = tub_screen().ids.tub_filter.filter_expression
         train_filter = getattr(cfg, 'TRAIN_FILTER', None)
+        self.index = TubIndex.load(self.file_path)
+        # Filters on whole columns are evaluated on the index at once
+        self.mask = self.index.mask(train_filter)
 
         # Use filter, this defines the function
         def select(underlying):
-            if not train_filter:
+            if not train_filter or self.mask is not None:
                 return True
             else:
                 try:
@@ -275,8 +282,13 @@ class TubLoader(BoxLayout, FileChooserBase):
                     Logger.error(f'Filter: {err}')
                     return True
 
+        if self.index.complete:
+            underlyings = self.index.records(self.mask)
+        else:
+            self.mask = None
+            underlyings = self.tub
         self.records = [TubRecord(cfg, self.tub.base_path, record)
-                        for record in self.tub if select(record)]
+                        for record in underlyings if select(record)]
         self.len = len(self.records)
         if self.len > 0:
             tub_screen().index = 0
@@ -637,12 +649,19 @@ class DataPlot(PaddedBoxLayout):
         """ Called from TubManager when a tub is reloaded/recreated. Fills
             the DataFrame from records, and updates the dropdown menu in the
             data panel."""
-        generator = (t.underlying for t in tub_screen().ids.tub_loader.records)
-        self.df = pd.DataFrame(generator).dropna()
-        to_drop = {'cam/image_array'}
-        self.df.drop(labels=to_drop, axis=1, errors='ignore', inplace=True)
-        self.df.set_index('_index', inplace=True)
-        self.unravel_vectors()
+        tub_loader = tub_screen().ids.tub_loader
+        if tub_loader.mask is not None:
+            # vectors are already unravelled by the index
+            self.df = tub_loader.index.dataframe(tub_loader.mask).dropna()
+            self.df.set_index('_index', inplace=True)
+        else:
+            generator = (t.underlying for t in tub_loader.records)
+            self.df = pd.DataFrame(generator).dropna()
+            to_drop = {'cam/image_array'}
+            self.df.drop(labels=to_drop, axis=1, errors='ignore',
+                         inplace=True)
+            self.df.set_index('_index', inplace=True)
+            self.unravel_vectors()
         tub_screen().ids.data_panel.ids.data_spinner.values = self.df.columns
         self.plot_from_current_bars()
 
@@ -692,11 +711,15 @@ class PilotLoader(BoxLayout, FileChooserBase):
     model_type = StringProperty()
     pilot = ObjectProperty(None)
     filters = ['*.h5', '*.tflite', '*.savedmodel', '*.trt']
+    predictions = None
+    predictions_key = None
 
     def load_action(self):
         if self.file_path and self.pilot:
             try:
                 self.pilot.load(os.path.join(self.file_path))
+                # the model file might have changed, check the predictions
+                self.predictions_key = None
                 rc_handler.data['pilot_' + self.num] = self.file_path
                 rc_handler.data['model_type_' + self.num] = self.model_type
                 self.ids.pilot_spinner.text = self.model_type
@@ -706,6 +729,31 @@ class PilotLoader(BoxLayout, FileChooserBase):
             except Exception as e:
                 Logger.error(f'Failed loading {self.file_path}: {e}')
 
+    def prediction(self, record):
+        """ Output of the pilot for the record stored by 'donkey predict',
+            if the images are shown as they were predicted, otherwise None
+            and the pilot has to run on the image. """
+        tub_path = tub_screen().ids.tub_loader.file_path
+        key = (tub_path, self.file_path, self.model_type)
+        if key != self.predictions_key:
+            self.predictions_key = key
+            self.predictions = None
+            if tub_path and self.file_path:
+                predictions = load_predictions(tub_path, self.file_path)
+                if predictions is not None \
+                        and predictions.made_by(self.file_path,
+                                                self.model_type):
+                    Logger.info(f'Pilot: Using {len(predictions)} stored '
+                                f'predictions of {self.file_path}')
+                    self.predictions = predictions
+        screen = pilot_screen()
+        if self.predictions is None or not screen.config or screen.aug_list \
+                or not self.predictions.valid_for(screen.config,
+                                                  screen.trans_list,
+                                                  screen.post_trans_list):
+            return None
+        return self.predictions.get(record.underlying['_index'])
+
     def on_model_type(self, obj, model_type):
         """ Kivy method that is called if self.model_type changes. """
         if self.model_type and self.model_type != 'Model type':
@@ -729,6 +777,7 @@ class PilotLoader(BoxLayout, FileChooserBase):
 class OverlayImage(FullImage):
     """ Widget to display the image and the user/pilot data for the tub. """
     pilot = ObjectProperty()
+    pilot_loader = ObjectProperty()
     pilot_record = ObjectProperty()
     throttle_field = StringProperty('user/throttle')
 
@@ -760,12 +809,15 @@ class OverlayImage(FullImage):
         if not self.pilot:
             return img_arr
 
-        output = (0, 0)
-        try:
-            # Not each model is supported in each interpreter
-            output = self.pilot.run(aug_img_arr)
-        except Exception as e:
-            Logger.error(e)
+        output = self.pilot_loader.prediction(record) \
+            if self.pilot_loader else None
+        if output is None:
+            output = (0, 0)
+            try:
+                # Not each model is supported in each interpreter
+                output = self.pilot.run(aug_img_arr)
+            except Exception as e:
+                Logger.error(e)
 
         rgb = (0, 0, 255)
         MakeMovie.draw_line_into_image(output[0], output[1], True, img_arr, rgb)
@@ -989,6 +1041,7 @@ class TrainScreen(Screen):
             transfer = os.path.join(self.config.MODELS_PATH, transfer + '.h5')
         else:
             transfer = None
+        self.config.TRAIN_SPLIT_STRATEGY = self.ids.split_spinner.text
         try:
             history = train(self.config, tub_paths=tub_path,
                             model_type=model_type,
@@ -1030,6 +1083,8 @@ class TrainScreen(Screen):
     def on_config(self, obj, config):
         if self.config and self.ids:
             self.ids.cfg_spinner.values = self.value_list()
+            self.ids.split_spinner.text \
+                = getattr(self.config, 'TRAIN_SPLIT_STRATEGY', 'random')
             self.reload_database()
 
     def reload_database(self):
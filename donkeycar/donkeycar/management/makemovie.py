@@ -10,6 +10,7 @@ except:
     raise Exception("Please install keras-vis: pip install git+https://github.com/autorope/keras-vis.git")
 
 import donkeycar as dk
+from donkeycar.parts.frame_store import open_image
 from donkeycar.parts.tub_v2 import Tub
 from donkeycar.utils import *
 
@@ -68,11 +69,13 @@ class MakeMovie(object):
 
         self.scale = args.scale
         self.keras_part = None
+        self.predictions = None
         self.do_salient = False
         self.user = args.draw_user_input
         if args.model is not None:
             self.keras_part = get_model_by_type(args.type, cfg=self.cfg)
             self.keras_part.load(args.model)
+            self.predictions = self.predict(args.model)
             if args.salient:
                 self.do_salient = self.init_salient(self.keras_part.interpreter.model)
 
@@ -80,6 +83,19 @@ class MakeMovie(object):
         clip = mpy.VideoClip(self.make_frame, duration=((num_frames - 1) / self.cfg.DRIVE_LOOP_HZ))
         clip.write_videofile(args.out, fps=self.cfg.DRIVE_LOOP_HZ)
 
+    def predict(self, model_path):
+        '''
+        Predictions of the model for all records of the tub, computed in
+        batches up front or read from the tub if 'donkey predict' stored
+        them already. None for models which only run on single images.
+        '''
+        from donkeycar.parts.keras import KerasPilot
+        from donkeycar.pipeline.predictions import predict_tub
+        if not isinstance(self.keras_part, KerasPilot):
+            return None
+        return predict_tub(self.keras_part, self.cfg, self.tub.base_path,
+                           model_path, self.model_type)
+
     @staticmethod
     def draw_line_into_image(angle, throttle, is_left, img, color):
         import cv2
@@ -106,7 +122,7 @@ class MakeMovie(object):
         green = (0, 255, 0)
         self.draw_line_into_image(user_angle, user_throttle, False, img_drawon, green)
 
-    def draw_model_prediction(self, img, img_drawon):
+    def draw_model_prediction(self, img, img_drawon, record=None):
         """
         query the model for it's prediction, draw the predictions
         as a blue line on the image
@@ -114,6 +130,15 @@ class MakeMovie(object):
         if self.keras_part is None:
             return
 
+        blue = (0, 0, 255)
+        prediction = self.predictions.get(record['_index']) \
+            if self.predictions is not None and record is not None else None
+        if prediction is not None:
+            pilot_angle, pilot_throttle = prediction
+            self.draw_line_into_image(pilot_angle, pilot_throttle, True,
+                                      img_drawon, blue)
+            return
+
         expected = tuple(self.keras_part.get_input_shapes()[0][1:])
         actual = img.shape
 
@@ -129,7 +154,6 @@ class MakeMovie(object):
                   f"{actual}")
             return
 
-        blue = (0, 0, 255)
         pilot_angle, pilot_throttle = self.keras_part.run(img)
         self.draw_line_into_image(pilot_angle, pilot_throttle, True, img_drawon, blue)
 
@@ -142,7 +166,7 @@ class MakeMovie(object):
 
         if self.keras_part is None or type(self.keras_part) is not KerasCategorical:
             return        
-        pred_img = normalize_image(img)
+        pred_img = self.keras_part.normalize(img)
         angle_binned, _ = self.keras_part.interpreter.predict(pred_img, other_arr=None)
 
         x = 4
@@ -243,7 +267,7 @@ class MakeMovie(object):
             return None
 
         rec = self.iterator.next()
-        img_path = os.path.join(self.tub.images_base_path, rec['cam/image_array'])
+        img_path = open_image(self.tub.base_path, rec['cam/image_array'])
         image_input = img_to_arr(Image.open(img_path))
         image = image_input
         
@@ -253,7 +277,7 @@ class MakeMovie(object):
         
         if self.user: self.draw_user_input(rec, image_input, image)
         if self.keras_part is not None:
-            self.draw_model_prediction(image_input, image)
+            self.draw_model_prediction(image_input, image, rec)
             self.draw_steering_distribution(image_input, image)
 
         if self.scale != 1:
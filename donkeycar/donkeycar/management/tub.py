@@ -13,6 +13,8 @@ from stat import S_ISREG, ST_ATIME, ST_CTIME, ST_MODE, ST_MTIME
 
 import tornado.web
 
+from donkeycar.parts.frame_store import FRAME_REF_SEP, image_extension, \
+    is_frame_ref, read_frame
 from donkeycar.parts.tub_v2 import Tub
 
 
@@ -37,6 +39,8 @@ class WebServer(tornado.web.Application):
             (r"/tubs/?(?P<tub_id>[^/]+)?", TubView),
             (r"/api/tubs/?(?P<tub_id>[^/]+)?", TubApi, dict(data_path=data_path)),
             (r"/static/(.*)", tornado.web.StaticFileHandler, {"path": static_file_path}),
+            (r"/tub_data/(?P<tub_id>[^/]+)/frames/(?P<name>[^/]+)/(?P<number>\d+)",
+             TubFrame, dict(data_path=data_path)),
             (r"/tub_data/(.*)", tornado.web.StaticFileHandler, {"path": data_path}),
             ]
 
@@ -83,7 +87,12 @@ class TubApi(tornado.web.RequestHandler):
         clips = []
         for record in tub:
             index = record['_index']
-            images_relative_path = os.path.join(Tub.images(), record['cam/image_array'])
+            image = record['cam/image_array']
+            if is_frame_ref(image):
+                # served by TubFrame
+                images_relative_path = 'frames/' + image.replace(FRAME_REF_SEP, '/')
+            else:
+                images_relative_path = os.path.join(Tub.images(), image)
             record['cam/image_array'] = images_relative_path
             clips.append(record)
 
@@ -114,3 +123,22 @@ class TubApi(tornado.web.RequestHandler):
 
         frames_to_delete = [index for index in old_indexes if index not in new_indexes]
         tub.delete_records(frames_to_delete)
+
+
+class TubFrame(tornado.web.RequestHandler):
+    """ Serves the images of packed tubs """
+
+    def initialize(self, data_path):
+        path = Path(os.path.expanduser(data_path))
+        self.data_path = path.absolute()
+
+    def get(self, tub_id, name, number):
+        base_path = os.path.join(self.data_path, tub_id)
+        try:
+            frame = read_frame(base_path, name + FRAME_REF_SEP + number)
+        except (OSError, IndexError):
+            raise tornado.web.HTTPError(404)
+        content_types = {'.jpg': 'image/jpeg', '.png': 'image/png'}
+        self.set_header("Content-Type", content_types.get(
+            image_extension(frame), 'image/x-portable-anymap'))
+        self.write(bytes(frame))
@@ -5,57 +5,132 @@ Created on Sun Jun 25 11:07:48 2017
 
 @author: wroscoe
 """
+from array import array
+
 
 class Memory:
     """
     A convenience class to save key/value pairs.
+
+    Channel names are interned to integer slots the first time they are
+    seen, values are kept in a flat list indexed by slot. The vehicle
+    resolves the slots of all part inputs and outputs once and then uses
+    get_slots() / put_slots() in the drive loop, which avoids hashing the
+    channel strings on every loop. The string based API (get, put, item
+    access) is kept on top of the slots.
+
+    Channels passed in float_keys are stored in a typed array('d') instead
+    of the generic value list. They can only hold scalars, are initialised
+    to NaN and can be read as one contiguous buffer through float_buffer().
     """
-    def __init__(self, *args, **kw):
-        self.d = {}
-    
+    def __init__(self, *args, float_keys=None, **kw):
+        self._slots = {}
+        self._keys = []
+        self._values = []
+        self._floats = array('d')
+        self._written = set()
+        for key in float_keys or []:
+            self.slot(key, is_float=True)
+
+    def slot(self, key, is_float=False):
+        """
+        Return the slot of a channel, interning the channel if it is new.
+        Float slots are encoded as negative numbers, ~slot is the index
+        into the float array.
+        """
+        slot = self._slots.get(key)
+        if slot is None:
+            if is_float:
+                slot = ~len(self._floats)
+                self._floats.append(float('nan'))
+            else:
+                slot = len(self._values)
+                self._values.append(None)
+            self._slots[key] = slot
+            self._keys.append(key)
+        return slot
+
+    def slots(self, keys):
+        return [self.slot(k) for k in keys]
+
+    def get_slots(self, slots):
+        values = self._values
+        if self._floats:
+            floats = self._floats
+            return [values[s] if s >= 0 else floats[~s] for s in slots]
+        return [values[s] for s in slots]
+
+    def put_slots(self, slots, inputs):
+        if len(slots) > 1:
+            for i, slot in enumerate(slots):
+                try:
+                    self._set_slot(slot, inputs[i])
+                except IndexError as e:
+                    error = str(e) + ' issue with keys: ' + \
+                        str(self._key_of(slot))
+                    raise IndexError(error)
+        else:
+            self._set_slot(slots[0], inputs)
+
+    def _set_slot(self, slot, value):
+        if slot >= 0:
+            self._values[slot] = value
+        else:
+            self._floats[~slot] = float('nan') if value is None else value
+        self._written.add(slot)
+
+    def _key_of(self, slot):
+        for key, s in self._slots.items():
+            if s == slot:
+                return key
+
+    def float_buffer(self):
+        """ Typed array of all float channels, in order of declaration """
+        return self._floats
+
     def __setitem__(self, key, value):
         if type(key) is str:
-            self.d[key] = value
+            self._set_slot(self.slot(key), value)
         else:
             if type(key) is not tuple:
                 key = tuple(key)
                 value = tuple(key)
             for i, k in enumerate(key):
-                self.d[k] = value[i]
-        
+                self._set_slot(self.slot(k), value[i])
+
     def __getitem__(self, key):
         if type(key) is tuple:
-            return [self.d[k] for k in key]
+            return [self._get_written(k) for k in key]
         else:
-            return self.d[key]
-        
+            return self._get_written(key)
+
+    def _get_written(self, key):
+        slot = self._slots.get(key)
+        if slot is None or slot not in self._written:
+            raise KeyError(key)
+        return self.get_slots([slot])[0]
+
     def update(self, new_d):
-        self.d.update(new_d)
-        
+        for key, value in new_d.items():
+            self[key] = value
+
     def put(self, keys, inputs):
-        if len(keys) > 1:
-            for i, key in enumerate(keys):
-                try:
-                    self.d[key] = inputs[i]
-                except IndexError as e:
-                    error = str(e) + ' issue with keys: ' + str(key)
-                    raise IndexError(error)
-        
-        else:
-            self.d[keys[0]] = inputs
+        self.put_slots(self.slots(keys), inputs)
 
-            
-            
     def get(self, keys):
-        result = [self.d.get(k) for k in keys]
-        return result
-    
+        get_slot = self._slots.get
+        return [None if s is None else self.get_slots([s])[0]
+                for s in (get_slot(k) for k in keys)]
+
+    def _written_keys(self):
+        return [k for k in self._keys if self._slots[k] in self._written]
+
     def keys(self):
-        return self.d.keys()
-    
+        return self._written_keys()
+
     def values(self):
-        return self.d.values()
-    
+        return self.get_slots([self._slots[k] for k in self._written_keys()])
+
     def items(self):
-        return self.d.items()
-        
\ No newline at end of file
+        keys = self._written_keys()
+        return zip(keys, self.get_slots([self._slots[k] for k in keys]))
@@ -0,0 +1,150 @@
+"""
+Runs a pilot on its own thread, so the drive loop does not block on model
+inference.
+
+The drive loop hands every frame to the part and immediately gets the most
+recent prediction back. The inference thread always works on the newest
+frame it has been given, frames which arrived while it was busy are dropped.
+Each prediction is returned with the id of the frame it was made from and
+its age, the time in milliseconds since that frame was handed over, so
+parts further down the loop, like DriveMode, can stop the car when the
+predictions get too old. Ages are measured on the monotonic clock, so they
+stay correct when the wall clock is set, like at the first NTP sync of a Pi
+without real time clock.
+"""
+import logging
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPilot(object):
+    """
+    Threaded part wrapping a KerasPilot or FastAiPilot. Add it with
+    threaded=True and the outputs of the pilot followed by two channels for
+    the age and the frame id of the prediction, like
+
+        V.add(AsyncPilot(kl, 2), inputs=['cam/image_array'],
+              outputs=['pilot/angle', 'pilot/throttle', 'pilot/age_ms',
+                       'pilot/frame_id'],
+              run_condition='run_pilot', threaded=True)
+
+    Inputs are not copied, parts writing them must create new arrays for
+    each frame like the cameras do. Stateful pilots like KerasLSTM only see
+    the frames which are not dropped.
+    """
+
+    def __init__(self, pilot, num_outputs: int = 2,
+                 poll_delay: float = 0.1, shutdown_timeout: float = 5.0):
+        """
+        :param pilot:               pilot with a run() method
+        :param num_outputs:         number of outputs of pilot.run(),
+                                    returned as None until the first
+                                    prediction
+        :param poll_delay:          maximum time in seconds the inference
+                                    thread waits for a frame before checking
+                                    for shutdown
+        :param shutdown_timeout:    maximum time in seconds shutdown() waits
+                                    for a running inference to finish
+        """
+        self.pilot = pilot
+        self.num_outputs = num_outputs
+        self.poll_delay = poll_delay
+        self.shutdown_timeout = shutdown_timeout
+        # set while the inference loop runs
+        self.running = threading.Event()
+        self.stopped = threading.Event()
+        self.condition = threading.Condition()
+        # (frame id, time received, inputs) of the newest frame not yet
+        # picked up by the inference thread
+        self.pending: Optional[Tuple[int, float, tuple]] = None
+        # (frame id, time received, outputs) of the newest prediction
+        self.result: Optional[Tuple[int, float, tuple]] = None
+        self.frame_id = 0
+        self.dropped = 0
+        self.inferences = 0
+        self.on = True
+
+    def _outputs(self, outputs: Any) -> tuple:
+        if self.num_outputs == 1:
+            return outputs,
+        return tuple(outputs)
+
+    def update(self):
+        """ Inference loop, run on the part thread by the vehicle """
+        self.stopped.clear()
+        self.running.set()
+        try:
+            while self.on:
+                with self.condition:
+                    if self.pending is None:
+                        self.condition.wait(self.poll_delay)
+                    if self.pending is None:
+                        continue
+                    frame_id, received, inputs = self.pending
+                    self.pending = None
+                try:
+                    outputs = self._outputs(self.pilot.run(*inputs))
+                except Exception as e:
+                    # no new prediction, its age keeps growing
+                    logger.error(f'Inference of frame {frame_id} failed: '
+                                 f'{e}')
+                    continue
+                self.result = (frame_id, received, outputs)
+                self.inferences += 1
+        finally:
+            self.running.clear()
+            self.stopped.set()
+
+    def run_threaded(self, *inputs) -> tuple:
+        """
+        Hand over the newest frame and return the latest prediction.
+
+        :param inputs:  inputs of pilot.run()
+        :return:        outputs of the latest prediction, its age in
+                        milliseconds and its frame id. All are None before
+                        the first prediction.
+        """
+        with self.condition:
+            self.frame_id += 1
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = (self.frame_id, time.monotonic(), inputs)
+            self.condition.notify()
+        return self.latest()
+
+    def latest(self) -> tuple:
+        """ Outputs, age in milliseconds and frame id of the newest
+        prediction """
+        result = self.result
+        if result is None:
+            return (None,) * self.num_outputs + (None, None)
+        frame_id, received, outputs = result
+        return outputs + ((time.monotonic() - received) * 1000.0, frame_id)
+
+    def run(self, *inputs) -> tuple:
+        """ Synchronous inference, if the part is not added threaded """
+        self.frame_id += 1
+        received = time.monotonic()
+        outputs = self._outputs(self.pilot.run(*inputs))
+        self.result = (self.frame_id, received, outputs)
+        self.inferences += 1
+        return self.latest()
+
+    def shutdown(self):
+        self.on = False
+        with self.condition:
+            self.condition.notify()
+        # the pilot must not be torn down in the middle of an inference
+        if self.running.is_set() and \
+                not self.stopped.wait(self.shutdown_timeout):
+            logger.warning(f'AsyncPilot inference did not finish within '
+                           f'{self.shutdown_timeout}s, not shutting down '
+                           f'the pilot')
+            return
+        logger.info(f'AsyncPilot made {self.inferences} predictions for '
+                    f'{self.frame_id} frames, dropped {self.dropped}')
+        if hasattr(self.pilot, 'shutdown'):
+            self.pilot.shutdown()
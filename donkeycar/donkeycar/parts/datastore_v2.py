@@ -10,6 +10,10 @@ logger = logging.getLogger(__name__)
 
 NEWLINE = '\n'
 NEWLINE_STRIP = '\r\n'
+# Number of records after which line lengths and the current index are
+# written to the manifests. Records written after the last checkpoint are
+# recovered by scanning the end of the catalog when it is opened again.
+CHECKPOINT_INTERVAL = 100
 
 
 class Seekable(object):
@@ -17,7 +21,8 @@ class Seekable(object):
     A seekable file reader, writer which deals with newline delimited
     records. \n
     This reader maintains an index of line lengths, so seeking a line is a
-    O(1) operation.
+    O(1) operation. If the given line lengths do not cover the whole file,
+    the remaining lines are indexed by reading the end of the file.
     """
 
     def __init__(self, file, read_only=False, line_lengths=list()):
@@ -37,6 +42,7 @@ class Seekable(object):
             for line_length in self.line_lengths:
                 self.total_length += line_length
                 self.cumulative_lengths.append(self.total_length)
+            self._read_tail()
 
     def _read_contents(self):
         self.line_lengths.clear()
@@ -52,10 +58,35 @@ class Seekable(object):
             contents = self.file.readline()
         self.seek_end_of_file()
 
+    def _file_size(self):
+        if isinstance(self.file, mmap.mmap):
+            return self.file.size()
+        self.file.flush()
+        return os.fstat(self.file.fileno()).st_size
+
+    def _read_tail(self):
+        size = self._file_size()
+        if size < self.total_length:
+            # index does not belong to this file, rebuild it
+            logger.warning(f'Line index larger than {self.file}, '
+                           f're-reading file')
+            self._read_contents()
+            return
+        if size > self.total_length:
+            self.seek_end_of_file()
+            contents = self.file.readline()
+            while len(contents) > 0:
+                line_length = len(contents)
+                self.line_lengths.append(line_length)
+                self.total_length += line_length
+                self.cumulative_lengths.append(self.total_length)
+                contents = self.file.readline()
+        self.seek_end_of_file()
+
     def __enter__(self):
         return self
 
-    def writeline(self, contents):
+    def writeline(self, contents, flush=True):
         if self.method == 'r':
             raise RuntimeError(f'Seekable {self.file} is read-only.')
 
@@ -70,7 +101,16 @@ class Seekable(object):
         self.line_lengths.append(offset)
         self.cumulative_lengths.append(self.total_length)
         self.file.write(line)
+        if flush:
+            self.file.flush()
+
+    def flush(self, sync=False):
+        """ Flush buffered lines, with sync=True also fsync the file """
+        if self.method == 'r':
+            return
         self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
 
     def _line_start_offset(self, line_number):
         return self._offset_until(line_number - 1)
@@ -146,26 +186,40 @@ class Catalog(object):
     [ json object record ] \n
     ...
     '''
-    def __init__(self, path, read_only=False, start_index=0):
+    def __init__(self, path, read_only=False, start_index=0,
+                 checkpoint_interval=CHECKPOINT_INTERVAL):
         self.path = Path(os.path.expanduser(path))
+        self.checkpoint_interval = checkpoint_interval
         self.manifest = CatalogMetadata(self.path,
                                         read_only=read_only,
                                         start_index=start_index)
         self.seekable = Seekable(self.path.as_posix(),
                                  line_lengths=self.manifest.line_lengths(),
                                  read_only=read_only)
+        self._unsaved_records = 0
 
     def _exit_handler(self):
         self.close()
 
-    def write_record(self, record):
-        # Add record and update manifest
+    def write_record(self, record, flush=True):
+        # Add record, the manifest is only updated every checkpoint_interval
+        # records to keep writing O(1)
         contents = json.dumps(record, allow_nan=False, sort_keys=True)
-        self.seekable.writeline(contents)
-        line_lengths = self.seekable.line_lengths
-        self.manifest.update_line_lengths(line_lengths)
+        self.seekable.writeline(contents, flush=flush)
+        self._unsaved_records += 1
+        if self._unsaved_records >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.manifest.update_line_lengths(list(self.seekable.line_lengths))
+        self._unsaved_records = 0
+
+    def flush(self, sync=False):
+        self.seekable.flush(sync)
 
     def close(self):
+        if self._unsaved_records > 0:
+            self.checkpoint()
         self.manifest.close()
         self.seekable.close()
 
@@ -270,20 +324,35 @@ class Manifest(object):
             self.current_catalog = Catalog(last_known_catalog,
                                            read_only=self.read_only,
                                            start_index=self.current_index)
+            # Records written after the last checkpoint
+            self.current_index = max(
+                self.current_index,
+                self.current_catalog.manifest.start_index()
+                + self.current_catalog.seekable.lines())
         # Create a new session_id, which will be added to each record in the
         # tub, when Tub.write_record() is called.
         self.session_id = self.create_new_session()
 
-    def write_record(self, record):
-        new_catalog = self.current_index > 0 \
-                      and (self.current_index % self.max_len) == 0
-        if new_catalog:
+    def _needs_new_catalog(self):
+        return self.current_index > 0 \
+               and (self.current_index % self.max_len) == 0
+
+    def next_catalog_name(self):
+        """ Name of the catalog the next record will be written to """
+        if self._needs_new_catalog():
+            return f'catalog_{len(self.catalog_paths)}.catalog'
+        return self.catalog_paths[-1]
+
+    def write_record(self, record, flush=True):
+        if self._needs_new_catalog():
             self._add_catalog()
 
-        self.current_catalog.write_record(record)
+        self.current_catalog.write_record(record, flush=flush)
         self.current_index += 1
-        # Update metadata to keep track of the last index
-        self._update_catalog_metadata(update=True)
+        # Update metadata to keep track of the last index, in between
+        # checkpoints the index is recovered from the current catalog
+        if self.current_index % CHECKPOINT_INTERVAL == 0:
+            self._update_catalog_metadata(update=True)
         # Set session_id update status to True if this method is called at
         # least once. Then session id metadata  will be updated when the
         # session gets closed
@@ -361,6 +430,11 @@ class Manifest(object):
         self.catalog_metadata = catalog_metadata
         self.seekeable.writeline(json.dumps(catalog_metadata))
 
+    def flush(self, sync=False):
+        """ Flush records written with flush=False to disk """
+        self.current_catalog.flush(sync)
+        self.seekeable.flush(sync)
+
     def create_new_session(self):
         """ Creates a new session id and appends it to the metadata."""
         sessions = self.manifest_metadata.get('sessions', {})
@@ -384,7 +458,9 @@ class Manifest(object):
         # If records were received, write updated session_id dictionary into
         # the metadata, otherwise keep the session_id information unchanged
         if self._updated_session:
-            self.seekeable.update_line(4, json.dumps(self.manifest_metadata))
+            self.seekeable.truncate_until_end(3)
+            self.seekeable.writeline(json.dumps(self.manifest_metadata))
+            self._update_catalog_metadata(update=False)
         self.current_catalog.close()
         self.seekeable.close()
 
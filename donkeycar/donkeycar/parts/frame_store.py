@@ -0,0 +1,302 @@
+"""
+Packed storage of tub images. Instead of one file per image, the encoded
+images of a catalog are appended to a single blob next to the catalog
+(catalog_0.frames) and their offsets and lengths are appended to an index
+(catalog_0.frames_index). Records reference a frame as
+'catalog_0.frames#<frame number>'. Frames are read from memory mapped
+blobs without copying.
+
+pack_tub() and unpack_tub() convert existing tubs between the two layouts.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+from donkeycar.parts.datastore_v2 import CatalogMetadata, NEWLINE
+from donkeycar.parts.tub_index import TubIndex
+
+logger = logging.getLogger(__name__)
+
+FRAME_REF_SEP = '#'
+FRAMES_EXT = '.frames'
+INDEX_EXT = '.frames_index'
+# little endian uint64 offset and length per frame
+INDEX_ENTRY = struct.Struct('<QQ')
+IMAGE_TYPES = ('image_array', 'gray16_array')
+
+
+def is_frame_ref(value):
+    return isinstance(value, str) and FRAME_REF_SEP in value
+
+
+def frames_name(catalog_name):
+    """ Name of the frame blob belonging to a catalog file name """
+    return Path(catalog_name).stem + FRAMES_EXT
+
+
+class FrameWriter(object):
+    """ Appends encoded images to a frame blob and its index """
+    def __init__(self, blob_path):
+        self.blob_path = str(blob_path)
+        self.name = os.path.basename(self.blob_path)
+        self.blob = open(self.blob_path, 'ab')
+        self.index = open(self.blob_path[:-len(FRAMES_EXT)] + INDEX_EXT, 'ab')
+        self.offset = self.blob.tell()
+        self.count = self.index.tell() // INDEX_ENTRY.size
+
+    def append(self, data):
+        """
+        :param data:    encoded image
+        :return:        reference of the frame to be stored in the record
+        """
+        self.blob.write(data)
+        self.index.write(INDEX_ENTRY.pack(self.offset, len(data)))
+        self.offset += len(data)
+        frame = self.count
+        self.count += 1
+        return f'{self.name}{FRAME_REF_SEP}{frame}'
+
+    def flush(self, sync=False):
+        # blob first, so the index never points past the blob on disk. The
+        # tub flushes the frames of a record before its catalog line.
+        for f in (self.blob, self.index):
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    def close(self):
+        self.flush()
+        self.blob.close()
+        self.index.close()
+
+
+class FrameReader(object):
+    """ Memory mapped, read only access to a frame blob """
+    def __init__(self, blob_path):
+        self.blob_path = str(blob_path)
+        index_path = self.blob_path[:-len(FRAMES_EXT)] + INDEX_EXT
+        self.blob = self._map(self.blob_path)
+        index = self._map(index_path)
+        count = len(index) // INDEX_ENTRY.size if index is not None else 0
+        self.index = np.frombuffer(index, dtype='<u8', count=count * 2) \
+            .reshape(count, 2) if count else np.zeros((0, 2), dtype='<u8')
+
+    @staticmethod
+    def _map(path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.index)
+
+    def frame(self, number):
+        """ Encoded image as a memoryview into the blob """
+        if not 0 <= number < len(self.index):
+            raise IndexError(f'Frame {number} not in {self.blob_path}')
+        offset, length = self.index[number]
+        end = int(offset + length)
+        if self.blob is None or end > len(self.blob):
+            raise IndexError(f'Frame {number} not in {self.blob_path}')
+        return memoryview(self.blob)[int(offset):end]
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def reset_readers():
+    """
+    Forget the cached readers, e.g. in a forked data loader worker, which
+    must not share the readers and their lock with the parent process.
+    """
+    global _readers, _readers_lock
+    _readers = {}
+    _readers_lock = threading.Lock()
+
+
+def read_frame(base_path, ref):
+    """
+    Read a frame of a tub. Readers are cached per blob and re-opened if
+    the blob has grown since it was mapped.
+
+    :param base_path:   path of the tub
+    :param ref:         frame reference as stored in the record
+    :return:            memoryview of the encoded image
+    """
+    name, number = ref.rsplit(FRAME_REF_SEP, 1)
+    number = int(number)
+    blob_path = os.path.join(base_path, name)
+    with _readers_lock:
+        reader = _readers.get(blob_path)
+        if reader is None or number >= len(reader):
+            reader = FrameReader(blob_path)
+            _readers[blob_path] = reader
+    return reader.frame(number)
+
+
+def forget_readers(base_path):
+    """ Drop the cached readers of the blobs of a tub, after its blobs were
+    rewritten or removed """
+    base_path = os.path.normpath(str(base_path))
+    with _readers_lock:
+        for path in [p for p in _readers
+                     if os.path.dirname(os.path.normpath(p)) == base_path]:
+            del _readers[path]
+
+
+def open_image(base_path, value):
+    """
+    Return something PIL's Image.open() accepts for an image value stored
+    in a record, independent of the tub layout.
+
+    :param base_path:   path of the tub
+    :param value:       image file name or frame reference of the record
+    :return:            file path or file like object
+    """
+    if is_frame_ref(value):
+        return BytesIO(read_frame(base_path, value))
+    return os.path.join(base_path, 'images', value)
+
+
+def _image_keys(manifest):
+    return [k for k, t in zip(manifest.inputs, manifest.types)
+            if t in IMAGE_TYPES]
+
+
+def _rewrite_catalog(base_path, catalog_name, convert, before_replace=None):
+    """
+    Apply convert(record) to each record of a catalog and rewrite the
+    catalog and its line lengths. before_replace() is called once the new
+    catalog is written, before it replaces the old one.
+    """
+    catalog_path = os.path.join(base_path, catalog_name)
+    with open(catalog_path, 'r', newline=NEWLINE) as f:
+        lines = f.read().splitlines()
+    new_lines = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            new_lines.append(line)
+            continue
+        convert(record)
+        new_lines.append(json.dumps(record, allow_nan=False, sort_keys=True))
+    tmp_path = catalog_path + '.tmp'
+    with open(tmp_path, 'w', newline=NEWLINE) as f:
+        for line in new_lines:
+            f.write(f'{line}{NEWLINE}')
+    if before_replace:
+        before_replace()
+    os.replace(tmp_path, catalog_path)
+    metadata = CatalogMetadata(catalog_path)
+    metadata.update_line_lengths([len(line) + 1 for line in new_lines])
+    metadata.close()
+    # image paths changed
+    TubIndex.invalidate(base_path)
+
+
+def pack_tub(base_path, delete_images=False):
+    """
+    Move the image files of a tub into frame blobs, one per catalog. Images
+    are copied as they are, without re-encoding.
+
+    :param base_path:       path of the tub
+    :param delete_images:   if the image files are removed after packing
+    :return:                number of packed images
+    """
+    from donkeycar.parts.tub_v2 import Tub
+    tub = Tub(base_path, read_only=True)
+    keys = _image_keys(tub.manifest)
+    catalogs = list(tub.manifest.catalog_paths)
+    tub.close()
+    packed = []
+    for catalog_name in catalogs:
+        writer = FrameWriter(os.path.join(base_path, frames_name(catalog_name)))
+
+        def convert(record):
+            for key in keys:
+                value = record.get(key)
+                if not value or is_frame_ref(value):
+                    continue
+                path = os.path.join(base_path, Tub.images(), value)
+                if not os.path.exists(path):
+                    logger.warning(f'Missing image {path}')
+                    continue
+                with open(path, 'rb') as f:
+                    record[key] = writer.append(f.read())
+                packed.append(path)
+
+        try:
+            # the frames have to be on disk before the catalog pointing at
+            # them replaces the old one
+            _rewrite_catalog(base_path, catalog_name, convert,
+                             lambda: writer.flush(sync=True))
+        finally:
+            writer.close()
+    forget_readers(base_path)
+    if delete_images:
+        for path in packed:
+            os.remove(path)
+    logger.info(f'Packed {len(packed)} images of {base_path}')
+    return len(packed)
+
+
+def image_extension(data):
+    """ File extension matching the format of an encoded image """
+    if data[:2] == b'\xff\xd8':
+        return '.jpg'
+    if data[:4] == b'\x89PNG':
+        return '.png'
+    return '.ppm'
+
+
+def unpack_tub(base_path, delete_frames=False):
+    """
+    Write the frames of a packed tub back to image files.
+
+    :param base_path:       path of the tub
+    :param delete_frames:   if the frame blobs are removed after unpacking
+    :return:                number of unpacked images
+    """
+    from donkeycar.parts.tub_v2 import Tub
+    tub = Tub(base_path, read_only=True)
+    keys = _image_keys(tub.manifest)
+    catalogs = list(tub.manifest.catalog_paths)
+    tub.close()
+    images_path = os.path.join(base_path, Tub.images())
+    os.makedirs(images_path, exist_ok=True)
+    count = 0
+    for catalog_name in catalogs:
+        def convert(record):
+            nonlocal count
+            for key in keys:
+                value = record.get(key)
+                if not is_frame_ref(value):
+                    continue
+                data = bytes(read_frame(base_path, value))
+                name = Tub._image_file_name(record['_index'], key,
+                                            image_extension(data))
+                with open(os.path.join(images_path, name), 'wb') as f:
+                    f.write(data)
+                record[key] = name
+                count += 1
+
+        _rewrite_catalog(base_path, catalog_name, convert)
+    forget_readers(base_path)
+    if delete_frames:
+        for catalog_name in catalogs:
+            blob = os.path.join(base_path, frames_name(catalog_name))
+            for path in (blob, blob[:-len(FRAMES_EXT)] + INDEX_EXT):
+                if os.path.exists(path):
+                    os.remove(path)
+    logger.info(f'Unpacked {count} images of {base_path}')
+    return count
@@ -0,0 +1,145 @@
+"""
+Image codecs used by the Tub to store recorded frames, and a thread pool
+that encodes several frames at the same time.
+
+All codecs produce files that PIL can read, so records written with any
+of them load through donkeycar.utils.load_image.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCodec(object):
+    """
+    Base class of the image codecs, encodes a uint8 image array (H, W, C)
+    or (H, W) to bytes.
+    """
+    extension = '.jpg'
+
+    def encode(self, img_arr):
+        raise NotImplementedError('Implement encode in the codec')
+
+
+class PilCodec(ImageCodec):
+    """ JPEG encoding with PIL, the default of the Tub """
+    def __init__(self, quality=75, optimize=False):
+        self.quality = quality
+        self.optimize = optimize
+
+    def encode(self, img_arr):
+        stream = BytesIO()
+        Image.fromarray(img_arr).save(stream, format='JPEG',
+                                      quality=self.quality,
+                                      optimize=self.optimize)
+        return stream.getvalue()
+
+
+class CvCodec(ImageCodec):
+    """ JPEG encoding with OpenCV, usually faster than PIL on the Pi """
+    def __init__(self, quality=75):
+        import cv2
+        self.cv2 = cv2
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+    def encode(self, img_arr):
+        if img_arr.ndim == 3 and img_arr.shape[2] == 3:
+            # OpenCV expects BGR order
+            img_arr = img_arr[:, :, ::-1]
+        ok, buffer = self.cv2.imencode('.jpg', img_arr, self.params)
+        if not ok:
+            raise ValueError('OpenCV could not encode image')
+        return buffer.tobytes()
+
+
+class RawCodec(ImageCodec):
+    """
+    Uncompressed binary PPM (RGB) / PGM (grey) images. Encoding is just a
+    copy of the pixels, at the cost of larger files.
+    """
+    extension = '.ppm'
+
+    def encode(self, img_arr):
+        h, w = img_arr.shape[:2]
+        magic = b'P5' if img_arr.ndim == 2 or img_arr.shape[2] == 1 else b'P6'
+        header = magic + b'\n%d %d\n255\n' % (w, h)
+        return header + np.ascontiguousarray(img_arr).tobytes()
+
+
+CODECS = {'pil': PilCodec, 'cv2': CvCodec, 'raw': RawCodec}
+
+
+def get_codec(name='pil', quality=75):
+    """
+    :param name:    one of CODECS
+    :param quality: JPEG quality, ignored by the raw codec
+    :return:        ImageCodec instance
+    """
+    if name not in CODECS:
+        raise ValueError(f'Unknown image codec {name}, use one of '
+                         f'{list(CODECS)}')
+    if name == 'raw':
+        return RawCodec()
+    return CODECS[name](quality=quality)
+
+
+def write_atomic(path, data):
+    """
+    Write data to a temporary file and move it into place, so readers never
+    see a partially written file.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ImageEncoderPool(object):
+    """
+    Encodes and writes images on a pool of threads. PIL and OpenCV release
+    the GIL while encoding, so several frames are encoded in parallel.
+    At most max_in_flight frames are queued, submit() blocks beyond that.
+    submit() returns a future, its result tells if the image was written.
+    """
+    def __init__(self, codec, workers=2, max_in_flight=None):
+        self.codec = codec
+        self.max_in_flight = max_in_flight or 4 * workers
+        self.pool = ThreadPoolExecutor(max_workers=workers,
+                                       thread_name_prefix='image_encoder')
+        self.condition = threading.Condition()
+        self.in_flight = 0
+
+    def _encode(self, img_arr, path):
+        try:
+            write_atomic(path, self.codec.encode(img_arr))
+            return True
+        except Exception as e:
+            logger.error(f'Could not write image {path}: {e}')
+            return False
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def submit(self, img_arr, path):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.in_flight < self.max_in_flight)
+            self.in_flight += 1
+        return self.pool.submit(self._encode, img_arr, path)
+
+    def wait(self):
+        """ Block until all submitted images are written """
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight == 0)
+
+    def close(self):
+        self.wait()
+        self.pool.shutdown(wait=True)
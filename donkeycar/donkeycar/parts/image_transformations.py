@@ -1,3 +1,4 @@
+import json
 import logging
 from typing import List
 from donkeycar.config import Config
@@ -31,6 +32,42 @@ class ImageTransformations:
         return image
 
 
+# config keys read by each transformation, custom transformations read
+# keys starting with their name
+TRANSFORMATION_CONFIG_PREFIXES = {
+    'TRAPEZE': ('ROI_TRAPEZE_',),
+    'CROP': ('ROI_CROP_',),
+    'CANNY': ('CANNY_',),
+    'BLUR': ('BLUR_',),
+    'RESIZE': ('RESIZE_',),
+    'SCALE': ('SCALE_',),
+}
+
+
+def transformation_config(config: Config, names: List[str]) -> dict:
+    """
+    The config values the given transformations depend on, e.g. to detect
+    if transformed images of an earlier run can be reused.
+    """
+    prefixes = set()
+    for name in names:
+        prefixes.update(TRANSFORMATION_CONFIG_PREFIXES.get(name, (name,)))
+    return {key: getattr(config, key) for key in sorted(dir(config))
+            if key.isupper() and key.startswith(tuple(prefixes))}
+
+
+def transformation_cache_key(config: Config,
+                             key: str = 'TRANSFORMATIONS') -> str:
+    """
+    Key of the images the transformations listed under key in the config
+    create, e.g. to cache transformed images.
+    """
+    names = list(getattr(config, key, []) or [])
+    return json.dumps(dict(transformations=names,
+                           config=transformation_config(config, names)),
+                      sort_keys=True, default=str)
+
+
 def image_transformer(name: str, config):
     """
     Factory for cv image transformation parts.
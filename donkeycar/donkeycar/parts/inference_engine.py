@@ -0,0 +1,202 @@
+"""
+Runs several models on every frame, like a pilot together with models it is
+compared to.
+
+The image transformations and the normalisation are computed once per
+frame and shared by all models, the models are invoked concurrently on a
+thread pool. Keras, TensorRT and TfLite release the GIL while they invoke
+the model, so they can overlap on machines with several cores.
+"""
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from donkeycar.parts.image_transformations import ImageTransformations
+from donkeycar.utils import normalize_image
+
+logger = logging.getLogger(__name__)
+
+
+class EngineModel(object):
+    """ Model registered in the engine with its channels and latencies """
+
+    def __init__(self, name: str, pilot, outputs: Sequence[str],
+                 other_input: Optional[str], stats_size: int):
+        self.name = name
+        self.pilot = pilot
+        self.outputs = list(outputs)
+        self.other_input = other_input
+        self.latencies = deque(maxlen=stats_size)
+
+    def current(self):
+        """ The pilot to run, a reloaded pilot is swapped in first """
+        from donkeycar.parts.model_reloader import ReloadablePilot
+        if isinstance(self.pilot, ReloadablePilot):
+            self.pilot.swap()
+            return self.pilot.pilot
+        return self.pilot
+
+    @staticmethod
+    def shares_normalisation(pilot) -> bool:
+        """ If the pilot only normalises the image and infers in run(),
+        pilots keeping state in run(), like the sequence models, are run as
+        they are """
+        from donkeycar.parts.keras import KerasPilot
+        return isinstance(pilot, KerasPilot) \
+            and type(pilot).run is KerasPilot.run
+
+    def run(self, pilot, img: np.ndarray, model_img: Optional[np.ndarray],
+            other: Any) -> tuple:
+        """ Infer on the image prepared for the model if given, otherwise
+        run the pilot on the image """
+        start = time.perf_counter()
+        if model_img is None:
+            outputs = pilot.run(img, other) if other is not None \
+                else pilot.run(img)
+        else:
+            other_arr = np.array(other) if other is not None else None
+            outputs = pilot.inference(model_img, other_arr)
+        self.latencies.append(time.perf_counter() - start)
+        # outputs beyond the channels of the model are dropped
+        return tuple(outputs)[:len(self.outputs)]
+
+
+class InferenceEngine(object):
+    """
+    Part running the registered models on the same frame. Its inputs are
+    the image and the additional inputs of the models, its outputs the
+    outputs of all models in the order they were added:
+
+        engine = InferenceEngine(cfg)
+        engine.add_model('pilot', kl, ['pilot/angle', 'pilot/throttle'])
+        engine.add_model('b', kl_b, ['b/angle', 'b/throttle'])
+        V.add(engine, inputs=engine.inputs('cam/image_array'),
+              outputs=engine.outputs(), run_condition='run_pilot')
+    """
+
+    def __init__(self, cfg=None, concurrent: bool = True,
+                 stats_size: int = 1000):
+        """
+        :param cfg:         config with the TRANSFORMATIONS and
+                            POST_TRANSFORMATIONS applied to the image
+                            before all models, none if not given
+        :param concurrent:  if the models are invoked on a thread pool
+        :param stats_size:  number of latencies kept per model
+        """
+        self.transformation = ImageTransformations(
+            cfg, 'TRANSFORMATIONS', 'POST_TRANSFORMATIONS') if cfg else None
+        self.concurrent = concurrent
+        self.stats_size = stats_size
+        self.models: List[EngineModel] = []
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.preprocessing = deque(maxlen=stats_size)
+        self._norm_buffer: Optional[np.ndarray] = None
+
+    def add_model(self, name: str, pilot, outputs: Sequence[str],
+                  other_input: str = None) -> 'InferenceEngine':
+        """
+        Register a pilot.
+
+        :param name:        name of the model in the latency stats
+        :param pilot:       KerasPilot, FastAiPilot or any part taking the
+                            image and optionally one additional input
+        :param outputs:     channels of the outputs of the pilot
+        :param other_input: channel of the additional input of the pilot,
+                            like the imu array of KerasIMU
+        """
+        assert name not in (m.name for m in self.models), \
+            f'Model {name} is already registered'
+        self.models.append(EngineModel(name, pilot, outputs, other_input,
+                                       self.stats_size))
+        return self
+
+    def load_model(self, name: str, model_type: str, model_path: str,
+                   cfg, outputs: Sequence[str] = None,
+                   other_input: str = None) -> 'InferenceEngine':
+        """
+        Create the pilot with utils.get_model_by_type, load it and register
+        it. The outputs default to '<name>/angle' and '<name>/throttle'.
+        """
+        from donkeycar.utils import get_model_by_type
+        pilot = get_model_by_type(model_type, cfg)
+        pilot.load(model_path)
+        outputs = outputs or [f'{name}/angle', f'{name}/throttle']
+        return self.add_model(name, pilot, outputs, other_input)
+
+    def inputs(self, image_input: str = 'cam/image_array') -> List[str]:
+        """ Input channels of the part, the image first """
+        others = [m.other_input for m in self.models if m.other_input]
+        return [image_input] + list(dict.fromkeys(others))
+
+    def outputs(self) -> List[str]:
+        return [output for m in self.models for output in m.outputs]
+
+    def normalise(self, img: np.ndarray) -> np.ndarray:
+        """ Normalised image shared by all models, in a reused buffer """
+        if self._norm_buffer is None or self._norm_buffer.shape != img.shape:
+            self._norm_buffer = np.empty(img.shape, dtype=np.float32)
+        return normalize_image(img, out=self._norm_buffer)
+
+    def run(self, img_arr: np.ndarray, *other_inputs) -> tuple:
+        start = time.perf_counter()
+        if self.transformation:
+            img_arr = self.transformation.run(img_arr)
+        values = dict(zip(self.inputs()[1:], other_inputs))
+        normalised = None
+        jobs = []
+        for model in self.models:
+            pilot = model.current()
+            image = None
+            if model.shares_normalisation(pilot):
+                if pilot.uint8_input or pilot.raw_image_input:
+                    image = img_arr
+                else:
+                    if normalised is None:
+                        normalised = self.normalise(img_arr)
+                    image = normalised
+            jobs.append((model, pilot, img_arr, image,
+                         values.get(model.other_input)))
+        self.preprocessing.append(time.perf_counter() - start)
+
+        if self.concurrent and len(jobs) > 1:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=len(self.models),
+                    thread_name_prefix='inference')
+            futures = [self.executor.submit(model.run, *job)
+                       for model, *job in jobs]
+            results = [future.result() for future in futures]
+        else:
+            results = [model.run(*job) for model, *job in jobs]
+        return tuple(output for result in results for output in result)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """ Mean, 95th percentile and maximum latency in milliseconds of the
+        preprocessing and each model """
+        latencies = {'preprocessing': self.preprocessing}
+        latencies.update((m.name, m.latencies) for m in self.models)
+        stats = {}
+        for name, values in latencies.items():
+            if not values:
+                continue
+            ms = np.array(values) * 1000.0
+            stats[name] = {'mean_ms': float(ms.mean()),
+                           'p95_ms': float(np.percentile(ms, 95)),
+                           'max_ms': float(ms.max()),
+                           'count': len(ms)}
+        return stats
+
+    def shutdown(self):
+        for name, s in self.stats().items():
+            logger.info(f'Inference {name}: mean {s["mean_ms"]:.2f}ms, '
+                        f'p95 {s["p95_ms"]:.2f}ms, max {s["max_ms"]:.2f}ms '
+                        f'over {s["count"]} frames')
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        for model in self.models:
+            if hasattr(model.pilot, 'shutdown'):
+                model.pilot.shutdown()
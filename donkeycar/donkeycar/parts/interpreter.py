@@ -2,7 +2,7 @@ import os
 from abc import ABC, abstractmethod
 import logging
 import numpy as np
-from typing import Union, Sequence, List
+from typing import Dict, Union, Sequence, List
 
 import tensorflow as tf
 from tensorflow import keras
@@ -11,6 +11,8 @@ from tensorflow.python.framework.convert_to_constants import \
     convert_variables_to_constants_v2 as convert_var_to_const
 from tensorflow.python.saved_model import tag_constants, signature_constants
 
+from donkeycar.utils import ONE_BYTE_SCALE, normalize_image
+
 logger = logging.getLogger(__name__)
 
 
@@ -104,6 +106,31 @@ class Interpreter(ABC):
     def predict_from_dict(self, input_dict) -> Sequence[Union[float, np.ndarray]]:
         pass
 
+    def predict_batch(self, input_dict: Dict[str, np.ndarray]) \
+            -> List[Sequence[Union[float, np.ndarray]]]:
+        """ Predictions for a batch of inputs, in the form predict_from_dict
+        returns them, one per row. Row by row unless the interpreter can
+        invoke the model on the whole batch. """
+        size = len(next(iter(input_dict.values())))
+        predictions = []
+        for i in range(size):
+            output = self.predict_from_dict({k: v[i] for k, v
+                                             in input_dict.items()})
+            # interpreters may return the same output buffers every time
+            predictions.append([np.array(o) for o in output]
+                               if isinstance(output, list)
+                               else np.array(output))
+        return predictions
+
+    def uint8_image_input(self) -> bool:
+        """ If the model takes uint8 images and normalises them itself """
+        return False
+
+    def takes_uint8_images(self) -> bool:
+        """ If predict() takes uint8 images, because the model or the
+        interpreter normalises them """
+        return self.uint8_image_input()
+
     def summary(self) -> str:
         pass
 
@@ -158,10 +185,23 @@ class KerasInterpreter(Interpreter):
             input_dict[k] = np.expand_dims(v, axis=0)
         return self.invoke(input_dict)
 
+    def predict_batch(self, input_dict):
+        outputs = self.model(input_dict, training=False)
+        if type(outputs) is list:
+            outputs = [output.numpy() for output in outputs]
+            return [[output[i] for output in outputs]
+                    for i in range(len(outputs[0]))]
+        return list(outputs.numpy())
+
     def load(self, model_path: str) -> None:
         logger.info(f'Loading model {model_path}')
         self.model = keras.models.load_model(model_path, compile=False)
 
+    def uint8_image_input(self) -> bool:
+        assert self.model, 'Model not set'
+        return any(name == 'img_in' and inp.dtype == tf.uint8 for name, inp
+                   in zip(self.model.input_names, self.model.inputs))
+
     def load_weights(self, model_path: str, by_name: bool = True) -> \
             None:
         assert self.model, 'Model not set'
@@ -233,26 +273,58 @@ class FastAIInterpreter(Interpreter):
 class TfLite(Interpreter):
     """
     This class wraps around the TensorFlow Lite interpreter.
+
+    Inputs are written straight into the tensors of the interpreter through
+    the views returned by tensor(), uint8 images are normalised or quantised
+    on the way, so the pilot can hand over the camera frame as it is. The
+    outputs are copied into preallocated arrays, dequantised for full
+    integer models. The arrays are reused by the next prediction.
     """
 
-    def __init__(self):
+    def __init__(self, num_threads: int = None, use_xnnpack: bool = True):
+        """
+        :param num_threads: number of threads of the interpreter, None for
+                            the default of tflite
+        :param use_xnnpack: if the XNNPACK delegate is applied to the float
+                            operations of the model
+        """
         super().__init__()
+        self.num_threads = num_threads
+        self.use_xnnpack = use_xnnpack
         self.interpreter = None
         self.input_shapes = None
         self.input_details = None
         self.output_details = None
-    
+        # preallocated output arrays, float32 for quantised outputs
+        self.output_buffers = None
+        # float32 arrays for inputs which need quantisation
+        self.quantize_buffers = None
+
     def load(self, model_path):
         assert os.path.splitext(model_path)[1] == '.tflite', \
             'TFlitePilot should load only .tflite files'
         logger.info(f'Loading model {model_path}')
         # Load TFLite model and allocate tensors.
-        self.interpreter = tf.lite.Interpreter(model_path=model_path)
+        resolvers = tf.lite.experimental.OpResolverType
+        resolver = resolvers.AUTO if self.use_xnnpack \
+            else resolvers.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.interpreter = tf.lite.Interpreter(
+            model_path=model_path, num_threads=self.num_threads,
+            experimental_op_resolver_type=resolver)
         self.interpreter.allocate_tensors()
 
-        # Get input and output tensors.
-        self.input_details = self.interpreter.get_input_details()
+        # Get input and output tensors. The converter does not keep the
+        # order of the keras model, the image goes first and the outputs
+        # are numbered like 'StatefulPartitionedCall:1'
+        self.input_details = sorted(self.interpreter.get_input_details(),
+                                    key=lambda d: 'img_in' not in d['name'])
         self.output_details = self.interpreter.get_output_details()
+        numbers = [d['name'].rpartition(':')[2]
+                   for d in self.output_details]
+        if all(n.isdigit() for n in numbers):
+            self.output_details = [d for _, d in sorted(
+                zip(map(int, numbers), self.output_details),
+                key=lambda x: x[0])]
 
         # Get Input shape
         self.input_shapes = []
@@ -260,18 +332,51 @@ class TfLite(Interpreter):
         for detail in self.input_details:
             logger.debug(detail)
             self.input_shapes.append(detail['shape'])
+        self.quantize_buffers = [
+            np.empty(d['shape'], dtype=np.float32) if self.quantized(d)
+            else None for d in self.input_details]
+        self.output_buffers = [
+            np.empty(d['shape'][1:], dtype=np.float32 if self.quantized(d)
+                     else d['dtype']) for d in self.output_details]
+        logger.info(f'Loaded tflite model with {self.num_threads or "default"}'
+                    f' threads, XNNPACK {"on" if self.use_xnnpack else "off"}'
+                    f', image input {self.input_details[0]["dtype"].__name__}')
+
+    @staticmethod
+    def quantized(detail) -> bool:
+        """ If the tensor holds quantised integers of real values """
+        scale, _ = detail['quantization']
+        return scale != 0.0
+
+    @staticmethod
+    def raw_image(detail) -> bool:
+        """ If uint8 images can be copied into the tensor as they are,
+        because it takes uint8 without quantisation, like models with folded
+        normalisation, or it quantises [0,1] with the step 1/255 """
+        if detail['dtype'] != np.uint8:
+            return False
+        scale, zero_point = detail['quantization']
+        return scale == 0.0 or \
+            (zero_point == 0 and abs(scale * 255.0 - 1.0) < 1e-4)
 
     def compile(self, **kwargs):
         pass
 
     def invoke(self) -> Sequence[Union[float, np.ndarray]]:
         self.interpreter.invoke()
-        outputs = []
-        for tensor in self.output_details:
-            output_data = self.interpreter.get_tensor(tensor['index'])
+        outputs = self.output_buffers
+        for buffer, detail in zip(outputs, self.output_details):
             # as we invoke the interpreter with a batch size of one we remove
-            # the additional dimension here again
-            outputs.append(output_data[0])
+            # the additional dimension here again. The view must not outlive
+            # this loop, the interpreter refuses to run while views exist.
+            view = self.interpreter.tensor(detail['index'])()[0]
+            if self.quantized(detail):
+                scale, zero_point = detail['quantization']
+                np.subtract(view, zero_point, out=buffer, dtype=np.float32)
+                buffer *= scale
+            else:
+                np.copyto(buffer, view)
+            del view
         # don't return list if output is 1d
         return outputs if len(outputs) > 1 else outputs[0]
 
@@ -280,20 +385,69 @@ class TfLite(Interpreter):
         assert self.input_shapes and self.input_details, \
             "Tflite model not loaded"
         input_arrays = (img_arr, other_arr)
-        for arr, shape, detail \
-                in zip(input_arrays, self.input_shapes, self.input_details):
-            in_data = arr.reshape(shape).astype(np.float32)
-            self.interpreter.set_tensor(detail['index'], in_data)
+        for arr, buffer, detail \
+                in zip(input_arrays, self.quantize_buffers,
+                       self.input_details):
+            self.set_input(arr, buffer, detail)
         return self.invoke()
 
     def predict_from_dict(self, input_dict):
-        for detail in self.input_details:
-            k = detail['name']
-            inp_k = input_dict[k]
-            inp_k_res = inp_k.reshape(detail['shape']).astype(np.float32)
-            self.interpreter.set_tensor(detail['index'], inp_k_res)
+        for buffer, detail in zip(self.quantize_buffers, self.input_details):
+            self.set_input(input_dict[self.input_key(detail, input_dict)],
+                           buffer, detail)
         return self.invoke()
 
+    @staticmethod
+    def input_key(detail, input_dict) -> str:
+        """ Key of the input in the dictionary, the converter prefixes the
+        names of the keras inputs, like 'serving_default_img_in:0' """
+        name = detail['name']
+        if name in input_dict:
+            return name
+        keys = [k for k in input_dict if k in name]
+        assert keys, f'No input for tensor {name} in {list(input_dict)}'
+        # prefer 'img_in' over 'in' if both are contained in the name
+        return max(keys, key=len)
+
+    def set_input(self, arr, buffer, detail):
+        """
+        Write the input into its tensor, without temporaries. uint8 images
+        are normalised for float models and quantised for full integer
+        models, unless they can be copied as they are.
+        """
+        arr = np.asarray(arr)
+        normalise = arr.dtype == np.uint8
+        tensor = self.interpreter.tensor(detail['index'])()
+        arr = np.reshape(arr, tensor.shape)
+        if normalise and self.raw_image(detail):
+            np.copyto(tensor, arr)
+        elif buffer is not None:
+            scale, zero_point = detail['quantization']
+            real_scale = ONE_BYTE_SCALE if normalise else 1.0
+            np.multiply(arr, real_scale / scale, out=buffer,
+                        dtype=np.float32)
+            buffer += zero_point
+            np.rint(buffer, out=buffer)
+            info = np.iinfo(detail['dtype'])
+            np.clip(buffer, info.min, info.max, out=buffer)
+            np.copyto(tensor, buffer, casting='unsafe')
+        elif normalise:
+            normalize_image(arr, out=tensor)
+        else:
+            np.copyto(tensor, arr, casting='unsafe')
+        # release the view before the next invoke
+        del tensor
+
+    def takes_uint8_images(self) -> bool:
+        return True
+
+    def uint8_image_input(self) -> bool:
+        assert self.input_details, "Tflite model not loaded"
+        # the image is the first input if the names were not kept
+        images = [d for d in self.input_details if 'img_in' in d['name']] \
+            or self.input_details[:1]
+        return images[0]['dtype'] == np.uint8
+
     def get_input_shapes(self):
         assert self.input_shapes is not None, "Need to load model first"
         return self.input_shapes
@@ -321,10 +475,15 @@ class TensorRT(Interpreter):
         self.frozen_func = convert_var_to_const(graph_func)
         self.input_shapes = [inp.shape for inp in graph_func.inputs]
 
+    def uint8_image_input(self) -> bool:
+        return any('img_in' in inp.name and inp.dtype == tf.uint8
+                   for inp in self.frozen_func.inputs)
+
     def predict(self, img_arr: np.ndarray, other_arr: np.ndarray) \
             -> Sequence[Union[float, np.ndarray]]:
         # first reshape as usual
-        img_arr = np.expand_dims(img_arr, axis=0).astype(np.float32)
+        img_dtype = self.frozen_func.inputs[0].dtype.as_numpy_dtype
+        img_arr = np.expand_dims(img_arr, axis=0).astype(img_dtype)
         img_tensor = self.convert(img_arr)
         if other_arr is not None:
             other_arr = np.expand_dims(other_arr, axis=0).astype(np.float32)
@@ -343,7 +502,8 @@ class TensorRT(Interpreter):
         for inp in self.frozen_func.inputs:
             name = inp.name.split(':')[0]
             val = input_dict[name]
-            val_res = np.expand_dims(val, axis=0).astype(np.float32)
+            val_res = np.expand_dims(val, axis=0).astype(
+                inp.dtype.as_numpy_dtype)
             val_conv = self.convert(val_res)
             args.append(val_conv)
         output_tensors = self.frozen_func(*args)
@@ -355,6 +515,7 @@ class TensorRT(Interpreter):
     @staticmethod
     def convert(arr):
         """ Helper function. """
-        value = tf.compat.v1.get_variable("features", dtype=tf.float32,
+        value = tf.compat.v1.get_variable("features",
+                                          dtype=tf.as_dtype(arr.dtype),
                                           initializer=tf.constant(arr))
         return tf.convert_to_tensor(value=value)
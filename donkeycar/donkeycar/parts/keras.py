@@ -31,6 +31,7 @@ from tensorflow.keras.layers import Activation, Dropout, Flatten
 from tensorflow.keras.layers import LSTM
 from tensorflow.keras.layers import TimeDistributed as TD
 from tensorflow.keras.layers import Conv3D, MaxPooling3D, Conv2DTranspose
+from tensorflow.keras.layers import Rescaling
 from tensorflow.keras.backend import concatenate
 from tensorflow.keras.models import Model
 from tensorflow.python.keras.callbacks import EarlyStopping, ModelCheckpoint
@@ -55,6 +56,12 @@ class KerasPilot(ABC):
         # self.model: Optional[Model] = None
         self.input_shape = input_shape
         self.optimizer = "adam"
+        # if the model takes uint8 images and normalises them itself
+        self.uint8_input = False
+        # if the interpreter takes uint8 images, because the model or the
+        # interpreter itself normalises them
+        self.raw_image_input = False
+        self._norm_buffer: Optional[np.ndarray] = None
         self.interpreter = interpreter
         self.interpreter.set_model(self)
         logger.info(f'Created {self} with interpreter: {interpreter}')
@@ -62,6 +69,12 @@ class KerasPilot(ABC):
     def load(self, model_path: str) -> None:
         logger.info(f'Loading model {model_path}')
         self.interpreter.load(model_path)
+        self.uint8_input = self.interpreter.uint8_image_input()
+        self.raw_image_input = self.interpreter.takes_uint8_images()
+        if self.uint8_input:
+            logger.info('Model normalises uint8 images itself')
+        elif self.raw_image_input:
+            logger.info(f'{self.interpreter} normalises uint8 images')
 
     def load_weights(self, model_path: str, by_name: bool = True) -> None:
         self.interpreter.load_weights(model_path, by_name=by_name)
@@ -94,6 +107,32 @@ class KerasPilot(ABC):
     def seq_size(self) -> int:
         return 0
 
+    def fold_normalization(self) -> None:
+        """
+        Replace the model by one which takes uint8 images and normalises
+        them in a Rescaling layer, so neither the training pipeline nor the
+        drive loop have to convert images to float.
+        """
+        assert isinstance(self.interpreter, KerasInterpreter), \
+            'Normalisation can only be folded into keras models'
+        if not self.uint8_input:
+            self.interpreter.model = fold_normalization(
+                self.interpreter.model)
+            self.uint8_input = True
+
+    def normalize(self, img_arr: np.ndarray) -> np.ndarray:
+        """
+        Image as expected by the interpreter: unchanged for uint8 models or
+        interpreters normalising images themselves, otherwise normalised
+        into a float32 buffer which is reused by the next call.
+        """
+        if self.uint8_input or self.raw_image_input:
+            return img_arr
+        if self._norm_buffer is None or \
+                self._norm_buffer.shape != img_arr.shape:
+            self._norm_buffer = np.empty(img_arr.shape, dtype=np.float32)
+        return normalize_image(img_arr, out=self._norm_buffer)
+
     def run(self, img_arr: np.ndarray, other_arr: List[float] = None) \
             -> Tuple[Union[float, np.ndarray], ...]:
         """
@@ -105,7 +144,7 @@ class KerasPilot(ABC):
                             state vector in the Behavioural model
         :return:            tuple of (angle, throttle)
         """
-        norm_arr = normalize_image(img_arr)
+        norm_arr = self.normalize(img_arr)
         np_other_array = np.array(other_arr) if other_arr else None
         return self.inference(norm_arr, np_other_array)
 
@@ -113,7 +152,8 @@ class KerasPilot(ABC):
             -> Tuple[Union[float, np.ndarray], ...]:
         """ Inferencing using the interpreter
             :param img_arr:     float32 [0,1] numpy array with normalized image
-                                data
+                                data, or uint8 image data if the model
+                                or the interpreter normalises it
             :param other_arr:   numpy array of additional data to be used in the
                                 pilot, like IMU array for the IMU model or a
                                 state vector in the Behavioural model
@@ -131,6 +171,15 @@ class KerasPilot(ABC):
         output = self.interpreter.predict_from_dict(input_dict)
         return self.interpreter_to_output(output)
 
+    def inference_batch(self, input_dict: Dict[str, np.ndarray]) \
+            -> List[Tuple[Union[float, np.ndarray], ...]]:
+        """ Inferencing of a batch, as created by the training pipeline
+            :param input_dict:  input dictionary of str and batched np.ndarray
+            :return:            list of the outputs of each row
+        """
+        outputs = self.interpreter.predict_batch(input_dict)
+        return [self.interpreter_to_output(output) for output in outputs]
+
     @abstractmethod
     def interpreter_to_output(
             self,
@@ -240,9 +289,12 @@ class KerasPilot(ABC):
                                   f'pipeline')
 
     def output_types(self) -> Tuple[Dict[str, np.typename], ...]:
-        """ Used in tf.data, assume all types are doubles"""
+        """ Used in tf.data, assume all types are floats except uint8
+            images for models which normalise themselves """
         shapes = self.output_shapes()
-        types = tuple({k: tf.float64 for k in d} for d in shapes)
+        types = tuple({k: tf.float32 for k in d} for d in shapes)
+        if self.uint8_input:
+            types[0]['img_in'] = tf.uint8
         return types
 
     def output_shapes(self) -> Dict[str, tf.TensorShape]:
@@ -387,7 +439,7 @@ class KerasMemory(KerasLinear):
         # Only called at start to fill the previous values
 
         np_mem_arr = np.array(self.mem_seq).reshape((2 * self.mem_length,))
-        img_arr_norm = normalize_image(img_arr)
+        img_arr_norm = self.normalize(img_arr)
         angle, throttle = super().inference(img_arr_norm, np_mem_arr)
         # fill new values into back of history list for next call
         self.mem_seq.popleft()
@@ -662,7 +714,7 @@ class KerasLSTM(KerasPilot):
         self.img_seq.append(img_arr)
         new_shape = (self.seq_length, *self.input_shape)
         img_arr = np.array(self.img_seq).reshape(new_shape)
-        img_arr_norm = normalize_image(img_arr)
+        img_arr_norm = self.normalize(img_arr)
         return self.inference(img_arr_norm, other_arr)
 
     def interpreter_to_output(self, interpreter_out) \
@@ -738,7 +790,7 @@ class Keras3D_CNN(KerasPilot):
         self.img_seq.append(img_arr)
         new_shape = (self.seq_length, *self.input_shape)
         img_arr = np.array(self.img_seq).reshape(new_shape)
-        img_arr_norm = normalize_image(img_arr)
+        img_arr_norm = self.normalize(img_arr)
         return self.inference(img_arr_norm, other_arr)
 
     def interpreter_to_output(self, interpreter_out) \
@@ -780,6 +832,33 @@ class KerasLatent(KerasPilot):
         return steering[0][0], throttle[0][0]
 
 
+def fold_normalization(model: Model) -> Model:
+    """
+    Wrap a model which expects normalised float images into a model taking
+    uint8 images in its 'img_in' input. Other inputs are passed through and
+    the outputs keep their names, so the model trains on the same x and y
+    dictionaries apart from the image dtype.
+    """
+    inputs, model_inputs = [], []
+    for name, inp in zip(model.input_names, model.inputs):
+        if name == 'img_in':
+            x = Input(shape=inp.shape[1:], dtype='uint8', name=name)
+            model_inputs.append(Rescaling(ONE_BYTE_SCALE,
+                                          name='img_rescaling')(x))
+        else:
+            x = Input(shape=inp.shape[1:], dtype=inp.dtype, name=name)
+            model_inputs.append(x)
+        inputs.append(x)
+    outputs = model(model_inputs if len(model_inputs) > 1
+                    else model_inputs[0])
+    if not isinstance(outputs, (list, tuple)):
+        outputs = [outputs]
+    outputs = [Activation('linear', name=name)(out)
+               for name, out in zip(model.output_names, outputs)]
+    return Model(inputs=inputs,
+                 outputs=outputs if len(outputs) > 1 else outputs[0])
+
+
 def conv2d(filters, kernel, strides, layer_num, activation='relu'):
     """
     Helper function to create a standard valid-padded convolutional layer
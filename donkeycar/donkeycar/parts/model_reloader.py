@@ -0,0 +1,178 @@
+"""
+Reloads the model of the pilot when its file changes, without stalling the
+drive loop.
+
+A new pilot is created, loaded and warmed up with a dummy prediction on
+the thread of the ModelReloader part. The ReloadablePilot in the drive loop
+keeps predicting with the old pilot and swaps to the new one right before
+its next prediction, so the swap never happens in the middle of an
+inference, also if the pilot runs on the thread of an AsyncPilot. Each
+pilot has its own interpreter, the old one is released after the swap.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up(pilot) -> None:
+    """
+    Dummy prediction with zero inputs, so lazy initialisations of the
+    interpreter happen before the pilot drives.
+    """
+    from donkeycar.parts.keras import KerasPilot
+    if not isinstance(pilot, KerasPilot):
+        pilot.run(np.zeros(pilot.input_shape, dtype=np.uint8))
+        return
+    # without the batch dimension
+    shapes = [tuple(shape[1:]) for shape in pilot.get_input_shapes()]
+    uint8 = pilot.uint8_input or pilot.raw_image_input
+    img = np.zeros(shapes[0], dtype=np.uint8 if uint8 else np.float32)
+    other = np.zeros(shapes[1], dtype=np.float32) if len(shapes) > 1 \
+        else None
+    pilot.interpreter.predict(img, other)
+
+
+class ReloadablePilot(object):
+    """
+    Pilot part which predicts with the current pilot and swaps in the next
+    one, given by the ModelReloader, before its next prediction. Add it
+    like the pilot itself, or wrap it into an AsyncPilot.
+    """
+
+    def __init__(self, pilot):
+        self.pilot = pilot
+        self.lock = threading.Lock()
+        # loaded and warmed up pilot waiting for the swap
+        self.next_pilot = None
+        self.swaps = 0
+
+    def put(self, pilot) -> None:
+        """ Hand over the next pilot, replaces one not swapped in yet """
+        with self.lock:
+            self.next_pilot = pilot
+
+    def swap(self) -> None:
+        with self.lock:
+            if self.next_pilot is None:
+                return
+            self.pilot, self.next_pilot = self.next_pilot, None
+            self.swaps += 1
+        logger.info(f'Swapped in reloaded pilot {self.pilot}')
+
+    def run(self, *inputs):
+        self.swap()
+        return self.pilot.run(*inputs)
+
+    def shutdown(self):
+        if hasattr(self.pilot, 'shutdown'):
+            self.pilot.shutdown()
+
+
+class ModelReloader(object):
+    """
+    Threaded part which watches the model file and loads a new pilot in the
+    background once the file has not changed for settle_time seconds. Its
+    outputs are the load time in milliseconds of the last reload and if it
+    succeeded, None until the first reload:
+
+        V.add(ModelReloader(pilot, create_pilot, load_pilot, model_path),
+              outputs=['modelfile/load_ms', 'modelfile/loaded'],
+              threaded=True)
+
+    A failed reload keeps the old pilot driving.
+    """
+
+    def __init__(self, pilot: ReloadablePilot, create_pilot: Callable,
+                 load_pilot: Callable, model_path: str,
+                 settle_time: float = 2.0, poll_delay: float = 0.5):
+        """
+        :param pilot:           pilot part in the drive loop
+        :param create_pilot:    creates a new pilot with its own interpreter
+        :param load_pilot:      loads the model file into a pilot, called
+                                with the pilot and the file
+        :param model_path:      model file to watch
+        :param settle_time:     seconds the file must not change before it
+                                is loaded, so it is completely written
+        :param poll_delay:      seconds between checks of the file
+        """
+        self.pilot = pilot
+        self.create_pilot = create_pilot
+        self.load_pilot = load_pilot
+        self.model_path = model_path
+        self.settle_time = settle_time
+        self.poll_delay = poll_delay
+        self.modified_time = self.mtime()
+        # time the file was seen changing last, None if it is loaded
+        self.changed_at: Optional[float] = None
+        self.load_ms: Optional[float] = None
+        self.loaded: Optional[bool] = None
+        self.reloads = 0
+        self.failures = 0
+        self.on = True
+
+    def mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.model_path)
+        except OSError:
+            # the file is being replaced
+            return None
+
+    def poll(self) -> bool:
+        """ If the file changed and has settled since """
+        m_time = self.mtime()
+        now = time.time()
+        if m_time != self.modified_time:
+            self.modified_time = m_time
+            self.changed_at = now
+            logger.info(f'{self.model_path} changed')
+            return False
+        return self.changed_at is not None and m_time is not None \
+            and now - self.changed_at >= self.settle_time
+
+    def reload(self) -> bool:
+        """ Load and warm up a new pilot and hand it over for the swap """
+        self.changed_at = None
+        start = time.perf_counter()
+        try:
+            pilot = self.create_pilot()
+            self.load_pilot(pilot, self.model_path)
+            warm_up(pilot)
+        except Exception as e:
+            self.failures += 1
+            self.loaded = False
+            logger.error(f'Reloading {self.model_path} failed, keep driving '
+                         f'with the old model: {e}')
+            return False
+        self.load_ms = (time.perf_counter() - start) * 1000.0
+        self.loaded = True
+        self.reloads += 1
+        self.pilot.put(pilot)
+        logger.info(f'Reloaded {self.model_path} in {self.load_ms:.0f}ms')
+        return True
+
+    def update(self):
+        """ Watch loop, run on the part thread by the vehicle """
+        while self.on:
+            if self.poll():
+                self.reload()
+            time.sleep(self.poll_delay)
+
+    def run_threaded(self):
+        return self.load_ms, self.loaded
+
+    def run(self):
+        """ Check the file and reload it on the loop, if not threaded """
+        if self.poll():
+            self.reload()
+        return self.run_threaded()
+
+    def shutdown(self):
+        self.on = False
+        logger.info(f'ModelReloader reloaded {self.reloads} times, '
+                    f'{self.failures} failed')
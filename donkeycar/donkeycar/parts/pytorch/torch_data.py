@@ -1,11 +1,12 @@
 # PyTorch
 import torch
-from torch.utils.data import IterableDataset, DataLoader
-from donkeycar.utils import train_test_split
-from donkeycar.parts.tub_v2 import Tub
+from torch.utils.data import Dataset, IterableDataset, DataLoader, \
+    get_worker_info
+from donkeycar.parts.frame_store import reset_readers
+from donkeycar.pipeline.image_cache import reset_image_cache
 from torchvision import transforms
 from typing import List, Any
-from donkeycar.pipeline.types import TubRecord, TubDataset
+from donkeycar.pipeline.types import TubRecord, TubDataset, split_records
 from donkeycar.pipeline.sequence import TubSequence
 import pytorch_lightning as pl
 
@@ -43,6 +44,41 @@ def get_default_transform(for_video=False, for_inference=False, resize=True):
     return transforms.Compose(transform_items)
 
 
+def x_from_record(record: TubRecord, transform) -> torch.Tensor:
+    # Loads the result of Image.open()
+    img_arr = record.image(as_nparray=False)
+    return transform(img_arr)
+
+
+def y_from_record(record: TubRecord) -> torch.Tensor:
+    angle: float = record.underlying['user/angle']
+    throttle: float = record.underlying['user/throttle']
+    predictions = torch.tensor([angle, throttle], dtype=torch.float)
+
+    # Normalize to be between [0, 1]
+    # angle and throttle are originally between [-1, 1]
+    predictions = (predictions + 1) / 2
+    return predictions
+
+
+def worker_init_fn(worker_id: int) -> None:
+    """
+    Runs in each DataLoader worker process. Workers open their own frame
+    readers and image cache instead of using the ones inherited from the
+    parent process, and share the image cache budget.
+    """
+    info = get_worker_info()
+    reset_readers()
+    reset_image_cache()
+    config = info.dataset.config
+    config.IMAGE_CACHE_MB \
+        = getattr(config, 'IMAGE_CACHE_MB', 2048) / info.num_workers
+    config.IMAGE_CACHE_DISK_MB \
+        = getattr(config, 'IMAGE_CACHE_DISK_MB', 0) / info.num_workers
+    # each worker needs its own disk cache file
+    config.IMAGE_CACHE_DISK_PATH = None
+
+
 class TorchTubDataset(IterableDataset):
     '''
     Loads the dataset, and creates a train/test split.
@@ -72,24 +108,12 @@ class TorchTubDataset(IterableDataset):
         """ This can be overridden if more complicated pipelines are
             required """
 
-        def y_transform(record: TubRecord):
-            angle: float = record.underlying['user/angle']
-            throttle: float = record.underlying['user/throttle']
-            predictions = torch.tensor([angle, throttle], dtype=torch.float)
-
-            # Normalize to be between [0, 1]
-            # angle and throttle are originally between [-1, 1]
-            predictions = (predictions + 1) / 2
-            return predictions
-
         def x_transform(record: TubRecord):
-            # Loads the result of Image.open()
-            img_arr = record.image(as_nparray=False)
-            return self.transform(img_arr)
+            return x_from_record(record, self.transform)
 
         # Build pipeline using the transformations
         pipeline = self.sequence.build_pipeline(x_transform=x_transform,
-                                                y_transform=y_transform)
+                                                y_transform=y_from_record)
         return pipeline
 
     def __len__(self):
@@ -99,6 +123,33 @@ class TorchTubDataset(IterableDataset):
         return iter(self.pipeline)
 
 
+class TorchTubMapDataset(Dataset):
+    """
+    Map-style dataset of records. In contrast to TorchTubDataset the
+    DataLoader can shuffle it in each epoch and load it in several worker
+    processes.
+    """
+
+    def __init__(self, config, records: List[TubRecord], transform=None):
+        """Create a map-style PyTorch Tub Dataset
+
+        Args:
+            config (object): the configuration information
+            records (List[TubRecord]): a list of tub records
+            transform (function, optional): a transform to apply to the data
+        """
+        self.config = config
+        self.records = records
+        self.transform = transform or get_default_transform()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        record = self.records[index]
+        return x_from_record(record, self.transform), y_from_record(record)
+
+
 class TorchTubDataModule(pl.LightningDataModule):
 
     def __init__(self, config: Any, tub_paths: List[str], transform=None):
@@ -121,9 +172,9 @@ class TorchTubDataModule(pl.LightningDataModule):
         else:
             self.transform = get_default_transform()
 
-        self.tubs: List[Tub] = [Tub(tub_path, read_only=True)
-                                for tub_path in self.tub_paths]
-        self.records: List[TubRecord] = []
+        self.dataset = TubDataset(config, self.tub_paths)
+        # number of processes loading the data in the background
+        self.num_workers = getattr(config, 'TORCH_NUM_WORKERS', 0)
 
     def setup(self, stage=None):
         """Load all the tub data and set up the datasets.
@@ -133,29 +184,30 @@ class TorchTubDataModule(pl.LightningDataModule):
                                         It is used to separate setup logic for trainer.fit 
                                         and trainer.test. Defaults to None.
         """
-        # Loop through all the different tubs and load all the records for each of them
-        for tub in self.tubs:
-            for underlying in tub:
-                record = TubRecord(self.config, tub.base_path,
-                                   underlying=underlying)
-                self.records.append(record)
-
-        train_records, val_records = train_test_split(
-            self.records, test_size=(1. - self.config.TRAIN_TEST_SPLIT))
+        # Records of all tubs, created on access by the datasets
+        self.records = self.dataset.get_records()
+        train_records, val_records = split_records(self.config,
+                                                   self.records)
 
         assert len(val_records) > 0, "Not enough validation data. Add more data"
 
-        self.train_dataset = TorchTubDataset(
+        self.train_dataset = TorchTubMapDataset(
             self.config, train_records, transform=self.transform)
-        self.val_dataset = TorchTubDataset(
+        self.val_dataset = TorchTubMapDataset(
             self.config, val_records, transform=self.transform)
 
-    def train_dataloader(self):
-        # The number of workers are set to 0 to avoid errors on Macs and Windows
+    def _dataloader(self, dataset, shuffle):
+        # More than 0 workers can cause errors on Macs and Windows
         # See: https://github.com/rusty1s/pytorch_geometric/issues/366#issuecomment-498022534
-        return DataLoader(self.train_dataset, batch_size=self.config.BATCH_SIZE, num_workers=0)
+        workers = self.num_workers
+        return DataLoader(dataset, batch_size=self.config.BATCH_SIZE,
+                          shuffle=shuffle, num_workers=workers,
+                          persistent_workers=workers > 0,
+                          pin_memory=torch.cuda.is_available(),
+                          worker_init_fn=worker_init_fn if workers else None)
+
+    def train_dataloader(self):
+        return self._dataloader(self.train_dataset, shuffle=True)
 
     def val_dataloader(self):
-        # The number of workers are set to 0 to avoid errors on Macs and Windows
-        # See: https://github.com/rusty1s/pytorch_geometric/issues/366#issuecomment-498022534
-        return DataLoader(self.val_dataset, batch_size=self.config.BATCH_SIZE, num_workers=0)
+        return self._dataloader(self.val_dataset, shuffle=False)
@@ -18,6 +18,7 @@ from paho.mqtt.client import Client as MQTTClient
 logger = logging.getLogger()
 
 LOG_MQTT_KEY = 'log/default'
+PROFILE_MQTT_PREFIX = 'profile/'
 
 
 class MqttTelemetry(StreamHandler):
@@ -44,6 +45,7 @@ class MqttTelemetry(StreamHandler):
         self._mqtt_client.connect(self._mqtt_broker, cfg.TELEMETRY_MQTT_BROKER_PORT)
         self._mqtt_client.loop_start()
         self._on = True
+        self._profiler = None
         if cfg.TELEMETRY_LOGGING_ENABLE:
             self.setLevel(logging.getLevelName(cfg.TELEMETRY_LOGGING_LEVEL))
             self.setFormatter(logging.Formatter(cfg.TELEMETRY_LOGGING_FORMAT))
@@ -59,6 +61,21 @@ class MqttTelemetry(StreamHandler):
                 
         return self._step_inputs, self._step_types        
 
+    def add_profiler(self, profiler):
+        """
+        Publish the latest part timings of the vehicle PartProfiler with
+        every update as profile/<part>/<statistic> in ms
+        """
+        self._profiler = profiler
+
+    def report_profile(self):
+        metrics = {}
+        for part, stats in self._profiler.snapshot().items():
+            for k, v in stats.items():
+                metrics[f'{PROFILE_MQTT_PREFIX}{part}/{k}'] = v
+        if metrics:
+            self.report(metrics)
+
     @staticmethod
     def filter_supported_metrics(inputs, types):
         supported_inputs = []
@@ -96,6 +113,9 @@ class MqttTelemetry(StreamHandler):
 
     def publish(self):
 
+        if self._profiler is not None:
+            self.report_profile()
+
         # Create packet
         packet = {}
         while not self._telem_q.empty():
@@ -117,7 +137,7 @@ class MqttTelemetry(StreamHandler):
             # Publish only the last timestamp for per step metrics
             last_sample = packet[list(packet)[-1]]
             for k, v in last_sample.items():
-                if k in self._step_inputs:
+                if k in self._step_inputs or k.startswith(PROFILE_MQTT_PREFIX):
                     topic = f'{self._topic}/{k}'
                     
                     try:
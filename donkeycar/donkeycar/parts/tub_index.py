@@ -0,0 +1,441 @@
+"""
+Columnar index of a tub. The scalar channels of all records (floats, ints,
+booleans, strings like image paths and session ids, fixed length vectors)
+are kept as one NumPy array per channel in the 'index' folder of the tub,
+so they can be loaded, filtered and plotted without parsing the json lines
+of the catalogs.
+
+The index is brought up to date on load: only catalogs which were added or
+changed since the index was saved are parsed again.
+"""
+import json
+import logging
+import os
+import shutil
+from collections.abc import Mapping
+
+import numpy as np
+
+from donkeycar.parts.datastore_v2 import Manifest, NEWLINE
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = 'index'
+INDEX_VERSION = 2
+# columns every record has, in addition to the manifest inputs
+PRIVATE_COLUMNS = {'_index': 'int', '_timestamp_ms': 'int',
+                   '_session_id': 'str'}
+STRING_TYPES = ('str', 'image_array', 'gray16_array')
+VECTOR_TYPES = ('list', 'vector', 'nparray')
+# row to catalog mapping, used for incremental updates
+CATALOG_COLUMN = '_catalog'
+
+
+def _file_name(key):
+    return key.replace('/', '__')
+
+
+class TubIndex(object):
+    """
+    Channels of all records of a tub, including deleted ones, as arrays.
+    Missing values are NaN for float columns and are tracked in a presence
+    mask for all other columns.
+    """
+    def __init__(self, base_path, types, columns, present, deleted_indexes,
+                 complete):
+        """
+        :param base_path:       path of the tub
+        :param types:           dict of column name to tub type
+        :param columns:         dict of column name to np.ndarray
+        :param present:         dict of column name to bool array for
+                                columns with missing values
+        :param deleted_indexes: indexes of deleted records
+        :param complete:        if the records can be rebuilt from the
+                                columns without loss
+        """
+        self.base_path = base_path
+        self.types = types
+        self.columns = columns
+        self.present = present
+        self.complete = complete
+        self.alive = ~np.isin(columns['_index'], list(deleted_indexes)) \
+            if deleted_indexes else np.ones(len(columns['_index']), bool)
+
+    def __len__(self):
+        return len(self.columns['_index'])
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def keys(self):
+        return [k for k in self.columns if k != CATALOG_COLUMN]
+
+    def column(self, key):
+        return self.columns[key]
+
+    def has_value(self, key):
+        """ Bool mask of the rows which have a value for key """
+        if key in self.present:
+            return self.present[key]
+        return np.ones(len(self), dtype=bool)
+
+    def has_row_value(self, key, row):
+        """ If the record in row has a value for key """
+        if key == CATALOG_COLUMN or key not in self.columns:
+            return False
+        if key in self.present:
+            return bool(self.present[key][row])
+        if self.types.get(key) == 'float':
+            value = self.columns[key][row]
+            return bool(value == value)
+        return True
+
+    def row(self, row):
+        """ The record in row as a read only mapping, see RowView """
+        return RowView(self, row)
+
+    def mask(self, train_filter=None):
+        """
+        Rows of records which are not deleted and pass the filter. Filters
+        working on whole columns, like
+
+            lambda rec: rec.underlying['user/throttle'] > 0
+
+        are evaluated vectorized, see ColumnRecord. Other filters return
+        None here and have to be applied to each record.
+        """
+        if not train_filter:
+            return self.alive
+        try:
+            res = np.asarray(train_filter(ColumnRecord(self)))
+        except Exception:
+            return None
+        if res.dtype != bool or res.shape != (len(self),):
+            return None
+        return self.alive & res
+
+    def records(self, mask=None):
+        """
+        Rebuild the record dictionaries of the selected rows, only
+        possible if the index is complete.
+        """
+        assert self.complete, f'Index of {self.base_path} is not complete'
+        rows = np.flatnonzero(self.alive if mask is None else mask)
+        keys = self.keys()
+        values = {}
+        for key in keys:
+            col = self.columns[key]
+            # tolist() converts to python types in one go
+            values[key] = col[rows].tolist() if col.dtype != object \
+                else col[rows]
+        present = {k: self.present[k][rows] for k in keys if k in self.present}
+        for i in range(len(rows)):
+            record = {}
+            for key in keys:
+                if key in present and not present[key][i]:
+                    continue
+                value = values[key][i]
+                if self.types.get(key) == 'float' and value != value:
+                    continue
+                record[key] = value
+            yield record
+
+    def dataframe(self, mask=None):
+        """
+        DataFrame of the selected rows without image columns. Vector
+        columns are split into one column per dimension named key_i.
+        """
+        import pandas as pd
+        rows = self.alive if mask is None else mask
+        data = {}
+        for key in self.keys():
+            tub_type = self.types.get(key)
+            if tub_type in ('image_array', 'gray16_array'):
+                continue
+            col = self.columns[key][rows]
+            if col.ndim == 2:
+                for i in range(col.shape[1]):
+                    data[f'{key}_{i}'] = col[:, i]
+                continue
+            if key in self.present:
+                col = pd.Series(col).where(self.present[key][rows])
+            data[key] = col
+        return pd.DataFrame(data)
+
+    @classmethod
+    def path(cls, base_path):
+        return os.path.join(base_path, INDEX_DIR)
+
+    @classmethod
+    def invalidate(cls, base_path):
+        """ Remove the index, e.g. after rewriting catalogs """
+        shutil.rmtree(cls.path(base_path), ignore_errors=True)
+
+    @classmethod
+    def load(cls, base_path, save=True):
+        """
+        Load the index of a tub and update it with new or changed catalogs.
+
+        :param base_path:   path of the tub
+        :param save:        if an updated index is written back to the tub
+        :return:            TubIndex
+        """
+        base_path = str(base_path)
+        manifest = Manifest(base_path, read_only=True)
+        try:
+            catalog_paths = list(manifest.catalog_paths)
+            deleted_indexes = set(manifest.deleted_indexes)
+            types = dict(zip(manifest.inputs, manifest.types))
+        finally:
+            manifest.close()
+        types.update(PRIVATE_COLUMNS)
+        sizes = [os.path.getsize(os.path.join(base_path, p))
+                 for p in catalog_paths]
+
+        meta, columns, present = cls._read(base_path, types)
+        # number of catalogs which are unchanged since the index was saved
+        valid = 0
+        if meta:
+            for old, new in zip(meta['catalog_sizes'], sizes):
+                if old != new:
+                    break
+                valid += 1
+            if valid < len(meta['catalog_sizes']):
+                # old catalogs changed, keep the unchanged ones
+                keep = columns[CATALOG_COLUMN] < valid
+                columns = {k: v[keep] for k, v in columns.items()}
+                present = {k: v[keep] for k, v in present.items()}
+        complete = meta.get('complete', True) if meta else True
+        if meta is None or valid < len(sizes):
+            rows = []
+            catalogs = []
+            for number in range(valid, len(catalog_paths)):
+                for record in cls._read_catalog(base_path,
+                                                catalog_paths[number]):
+                    rows.append(record)
+                    catalogs.append(number)
+            new_columns, new_present, new_complete = \
+                cls._build(rows, catalogs, types)
+            columns, present = cls._concat(columns, present, new_columns,
+                                           new_present, len(rows))
+            complete = complete and new_complete
+            if save:
+                cls._write(base_path, columns, present, types, complete,
+                           catalog_paths, sizes)
+        return TubIndex(base_path, types, columns, present, deleted_indexes,
+                        complete)
+
+    @staticmethod
+    def _read_catalog(base_path, catalog_path):
+        with open(os.path.join(base_path, catalog_path), 'r',
+                  newline=NEWLINE) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # incomplete last line, the ManifestIterator skips
+                    # those too
+                    continue
+
+    @staticmethod
+    def _build(rows, catalogs, types):
+        columns = {CATALOG_COLUMN: np.array(catalogs, dtype=np.int32)}
+        present = {}
+        complete = True
+        n = len(rows)
+        extra_keys = set()
+        for row in rows:
+            extra_keys.update(row.keys() - types.keys())
+        if extra_keys:
+            logger.warning(f'Keys {extra_keys} are not part of the tub '
+                           f'inputs and not indexed')
+            complete = False
+        for key, tub_type in types.items():
+            values = [row.get(key) for row in rows]
+            has_value = np.array([v is not None for v in values], dtype=bool)
+            if tub_type == 'float':
+                col = np.array([np.nan if v is None else v for v in values],
+                               dtype=np.float64)
+            elif tub_type in ('int', 'boolean'):
+                dtype = np.int64 if tub_type == 'int' else bool
+                col = np.array([0 if v is None else v for v in values],
+                               dtype=dtype)
+            elif tub_type in STRING_TYPES:
+                col = np.array(['' if v is None else v for v in values],
+                               dtype=object)
+            elif tub_type in VECTOR_TYPES:
+                lengths = {len(v) for v in values if v is not None}
+                if len(lengths) > 1 or not all(
+                        isinstance(x, (int, float)) for v in values
+                        if v is not None for x in v):
+                    # variable length or nested, not indexed
+                    complete = False
+                    continue
+                dim = lengths.pop() if lengths else 0
+                col = np.array([v if v is not None else [0.0] * dim
+                                for v in values],
+                               dtype=np.float64).reshape(n, dim)
+            else:
+                complete = False
+                continue
+            columns[key] = col
+            if tub_type != 'float' and not has_value.all():
+                present[key] = has_value
+        return columns, present, complete
+
+    @staticmethod
+    def _concat(columns, present, new_columns, new_present, new_len):
+        if not columns:
+            return new_columns, new_present
+        old_len = len(columns[CATALOG_COLUMN])
+        result = {}
+        for key in columns.keys() & new_columns.keys():
+            result[key] = np.concatenate([columns[key], new_columns[key]])
+        result_present = {}
+        for key in (present.keys() | new_present.keys()) & result.keys():
+            old = present.get(key, np.ones(old_len, dtype=bool))
+            new = new_present.get(key, np.ones(new_len, dtype=bool))
+            result_present[key] = np.concatenate([old, new])
+        return result, result_present
+
+    @classmethod
+    def _read(cls, base_path, types):
+        path = cls.path(base_path)
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None, {}, {}
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta.get('version') != INDEX_VERSION \
+                    or meta.get('types') != types:
+                return None, {}, {}
+            rows = meta['rows']
+            columns = {}
+            present = {}
+            for key in meta['columns']:
+                name = os.path.join(path, _file_name(key))
+                if meta['types'].get(key) in STRING_TYPES:
+                    offsets = np.load(name + '.offsets.npy')
+                    data = np.load(name + '.data.npy').tobytes()
+                    columns[key] = np.array(
+                        [data[offsets[i]:offsets[i + 1]].decode()
+                         for i in range(len(offsets) - 1)], dtype=object)
+                else:
+                    columns[key] = np.load(name + '.npy')
+            for key in meta['present']:
+                present[key] = np.load(
+                    os.path.join(path, _file_name(key)) + '.present.npy')
+            lengths = {key: len(col) for key, col in columns.items()}
+            lengths.update({f'{key} present': len(has_value)
+                            for key, has_value in present.items()})
+            wrong = {k: n for k, n in lengths.items() if n != rows}
+            if wrong:
+                raise ValueError(f'index has {rows} rows but columns have '
+                                 f'{wrong}')
+            return meta, columns, present
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f'Rebuilding index of {base_path}: {e}')
+            return None, {}, {}
+
+    @classmethod
+    def _write(cls, base_path, columns, present, types, complete,
+               catalog_paths, sizes):
+        path = cls.path(base_path)
+        meta_path = os.path.join(path, 'meta.json')
+        try:
+            os.makedirs(path, exist_ok=True)
+            # the columns are overwritten in place, so the old meta must not
+            # survive an interrupted write, the index is rebuilt then
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            for key, col in columns.items():
+                name = os.path.join(path, _file_name(key))
+                if col.dtype == object:
+                    encoded = [v.encode() for v in col]
+                    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+                    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+                    np.save(name + '.offsets.npy', offsets)
+                    np.save(name + '.data.npy',
+                            np.frombuffer(b''.join(encoded), dtype=np.uint8))
+                else:
+                    np.save(name + '.npy', col)
+            for key, has_value in present.items():
+                np.save(os.path.join(path, _file_name(key)) + '.present.npy',
+                        has_value)
+            # meta is written last and moved into place, without it the
+            # index is rebuilt on the next load
+            meta = dict(version=INDEX_VERSION, types=types,
+                        columns=list(columns), present=list(present),
+                        rows=len(columns[CATALOG_COLUMN]),
+                        complete=complete, catalog_paths=catalog_paths,
+                        catalog_sizes=sizes)
+            tmp_path = meta_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, meta_path)
+        except OSError as e:
+            logger.warning(f'Could not save index of {base_path}: {e}')
+
+
+class ColumnView(object):
+    """ Mapping of channel name to the whole column of a TubIndex """
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.index.column(key)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key, default=None):
+        return self.index.column(key) if key in self.index else default
+
+
+class RowView(Mapping):
+    """
+    Read only record dictionary of one row of a TubIndex. The values are
+    read from the columns on access, so a view only costs the reference to
+    the index and the row number. Missing values are left out like in the
+    catalogs.
+    """
+    __slots__ = ('index', 'row')
+
+    def __init__(self, index, row):
+        self.index = index
+        self.row = row
+
+    def __getitem__(self, key):
+        if not self.index.has_row_value(key, self.row):
+            raise KeyError(key)
+        value = self.index.columns[key][self.row]
+        # numpy scalars and vectors to python types like in the json record
+        return value.tolist() if isinstance(value, (np.generic, np.ndarray)) \
+            else value
+
+    def __contains__(self, key):
+        return self.index.has_row_value(key, self.row)
+
+    def __iter__(self):
+        return (key for key in self.index.keys()
+                if self.index.has_row_value(key, self.row))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ColumnRecord(object):
+    """
+    Stand-in for a TubRecord whose underlying values are whole columns,
+    used to evaluate TRAIN_FILTER on all records at once.
+    """
+    def __init__(self, index):
+        self.base_path = index.base_path
+        self.underlying = ColumnView(index)
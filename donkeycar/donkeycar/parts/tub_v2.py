@@ -1,23 +1,53 @@
 import atexit
+import logging
 import os
+import queue
+import threading
 import time
+from collections import deque
 from datetime import datetime
+from io import BytesIO
 import json
 
 import numpy as np
 from PIL import Image
 
 from donkeycar.parts.datastore_v2 import Manifest, ManifestIterator
+from donkeycar.parts.frame_store import FrameWriter, frames_name
+from donkeycar.parts.image_codec import ImageEncoderPool, PilCodec, \
+    write_atomic
 
+logger = logging.getLogger(__name__)
 
 class Tub(object):
     """
     A datastore to store sensor data in a key, value format. \n
     Accepts str, int, float, image_array, image, and array data types.
     """
+    IMAGE_STORAGES = ('files', 'frames')
 
     def __init__(self, base_path, inputs=[], types=[], metadata=[],
-                 max_catalog_len=1000, read_only=False):
+                 max_catalog_len=1000, read_only=False, image_codec=None,
+                 encoder_workers=0, image_storage='files'):
+        """
+        :param image_codec:     ImageCodec used to store image arrays,
+                                defaults to JPEG encoding with PIL
+        :param encoder_workers: if positive, images are encoded on a pool
+                                of that many threads. The catalog line of
+                                a record is only written once its images
+                                are on disk, the latest records are only
+                                guaranteed to be in the catalog after
+                                flush() or close(). Records whose images
+                                could not be written are marked deleted.
+        :param image_storage:   'files' stores one file per image in the
+                                images folder, 'frames' appends images to
+                                one packed frame blob per catalog, see
+                                donkeycar.parts.frame_store. Frames are
+                                always encoded in the writing thread.
+        """
+        assert image_storage in self.IMAGE_STORAGES, \
+            f'image_storage must be one of {self.IMAGE_STORAGES} but is ' \
+            f'{image_storage}'
         self.base_path = base_path
         self.images_base_path = os.path.join(self.base_path, Tub.images())
         self.inputs = inputs
@@ -27,15 +57,37 @@ class Tub(object):
                                  metadata=metadata, max_len=max_catalog_len,
                                  read_only=read_only)
         self.input_types = dict(zip(self.inputs, self.types))
+        self.image_codec = image_codec or PilCodec()
+        self.image_storage = image_storage
+        self.encoder = ImageEncoderPool(self.image_codec, encoder_workers) \
+            if encoder_workers > 0 and image_storage == 'files' else None
+        self.frame_writer = None
+        # (contents, image futures, flush) of records whose images are
+        # still encoded, in the order of their indexes
+        self.pending = deque()
+        # Guards the manifest when records are written from a background
+        # thread, see AsyncTubWriter
+        self.lock = threading.RLock()
         # Create images folder if necessary
         if not os.path.exists(self.images_base_path):
             os.makedirs(self.images_base_path, exist_ok=True)
 
-    def write_record(self, record=None):
+    def write_record(self, record=None, timestamp_ms=None, flush=True):
         """
         Can handle various data types including images.
+
+        :param record:          dictionary of input keys and values
+        :param timestamp_ms:    time the record was taken, defaults to now
+        :param flush:           if the catalog file should be flushed, can
+                                be set to False when writing many records
+                                in a row followed by flush()
         """
+        with self.lock:
+            self._write_record(record, timestamp_ms, flush)
+
+    def _write_record(self, record, timestamp_ms, flush):
         contents = dict()
+        futures = []
         for key, value in record.items():
             if value is None:
                 continue
@@ -58,41 +110,125 @@ class Tub(object):
                     contents[key] = list(value)
                 elif input_type == 'image_array':
                     # Handle image array
-                    image = Image.fromarray(np.uint8(value))
-                    name = Tub._image_file_name(self.manifest.current_index, key)
-                    image_path = os.path.join(self.images_base_path, name)
-                    image.save(image_path)
+                    if self.image_storage == 'frames':
+                        contents[key] = self._frame_writer().append(
+                            self.image_codec.encode(np.uint8(value)))
+                        continue
+                    name = Tub._image_file_name(
+                        self.current_index, key,
+                        extension=self.image_codec.extension)
+                    future = self._save_image(np.uint8(value), name)
+                    if future is not None:
+                        futures.append(future)
                     contents[key] = name
                 elif input_type == 'gray16_array':
                     # save np.uint16 as a 16bit png
                     image = Image.fromarray(np.uint16(value))
-                    name = Tub._image_file_name(self.manifest.current_index, key, ext='.png')
+                    if self.image_storage == 'frames':
+                        buffer = BytesIO()
+                        image.save(buffer, format='PNG')
+                        contents[key] = \
+                            self._frame_writer().append(buffer.getvalue())
+                        continue
+                    name = Tub._image_file_name(self.current_index, key, extension='.png')
                     image_path = os.path.join(self.images_base_path, name)
                     image.save(image_path)
                     contents[key]=name
 
         # Private properties
-        contents['_timestamp_ms'] = int(round(time.time() * 1000))
-        contents['_index'] = self.manifest.current_index
+        if timestamp_ms is None:
+            timestamp_ms = int(round(time.time() * 1000))
+        contents['_timestamp_ms'] = timestamp_ms
+        contents['_index'] = self.current_index
         contents['_session_id'] = self.manifest.session_id
 
-        self.manifest.write_record(contents)
+        if self.encoder:
+            # the catalog line must not point at images which are not
+            # written yet, so records wait until their images are done
+            self.pending.append((contents, futures, flush))
+            self._write_pending()
+            return
+        if self.frame_writer:
+            # the frames have to reach the file before the catalog line
+            # pointing at them, otherwise a crash leaves records whose
+            # frames were never written
+            self.frame_writer.flush()
+        self.manifest.write_record(contents, flush=flush)
+
+    def _save_image(self, img_arr, name):
+        image_path = os.path.join(self.images_base_path, name)
+        if self.encoder:
+            return self.encoder.submit(img_arr, image_path)
+        write_atomic(image_path, self.image_codec.encode(img_arr))
+
+    def _write_pending(self, wait=False):
+        """
+        Write the catalog lines of pending records in order, as long as the
+        images of the oldest record are written.
+
+        :param wait:    wait for all images, so no record is left pending
+        """
+        while self.pending:
+            contents, futures, flush = self.pending[0]
+            if not wait and not all(f.done() for f in futures):
+                return
+            self.pending.popleft()
+            self.manifest.write_record(contents, flush=flush)
+            if not all(f.result() for f in futures):
+                # keep the index sequence, but never hand out the record
+                logger.error(f'Marking record {contents["_index"]} deleted, '
+                             f'its images could not be written')
+                self.manifest.delete_records([contents['_index']])
+
+    @property
+    def current_index(self):
+        """ Index of the next record, including pending records """
+        return self.manifest.current_index + len(self.pending)
+
+    def _frame_writer(self):
+        # Frames of a record go to the blob of the catalog the record is
+        # written to, so switch blobs together with the catalog
+        name = frames_name(self.manifest.next_catalog_name())
+        if self.frame_writer is None or self.frame_writer.name != name:
+            if self.frame_writer:
+                self.frame_writer.close()
+            self.frame_writer = FrameWriter(os.path.join(self.base_path, name))
+        return self.frame_writer
+
+    def flush(self, sync=False):
+        with self.lock:
+            if self.encoder:
+                self.encoder.wait()
+                self._write_pending(wait=True)
+            if self.frame_writer:
+                self.frame_writer.flush(sync)
+            self.manifest.flush(sync)
 
     def delete_records(self, record_indexes):
-        self.manifest.delete_records(record_indexes)
+        with self.lock:
+            self.manifest.delete_records(record_indexes)
 
     def delete_last_n_records(self, n):
-        # build ordered list of non-deleted indexes
-        all_alive_indexes = sorted(set(range(self.manifest.current_index))
-                                   - self.manifest.deleted_indexes)
-        to_delete_indexes = all_alive_indexes[-n:]
-        self.manifest.delete_records(to_delete_indexes)
+        with self.lock:
+            self._write_pending(wait=True)
+            # build ordered list of non-deleted indexes
+            all_alive_indexes = sorted(set(range(self.manifest.current_index))
+                                       - self.manifest.deleted_indexes)
+            to_delete_indexes = all_alive_indexes[-n:]
+            self.manifest.delete_records(to_delete_indexes)
 
     def restore_records(self, record_indexes):
-        self.manifest.restore_records(record_indexes)
+        with self.lock:
+            self.manifest.restore_records(record_indexes)
 
     def close(self):
-        self.manifest.close()
+        with self.lock:
+            if self.encoder:
+                self.encoder.close()
+                self._write_pending(wait=True)
+            if self.frame_writer:
+                self.frame_writer.close()
+            self.manifest.close()
 
     def __iter__(self):
         return ManifestIterator(self.manifest)
@@ -117,15 +253,22 @@ class TubWriter(object):
     A Donkey part, which can write records to the datastore.
     """
     def __init__(self, base_path, inputs=[], types=[], metadata=[],
-                 max_catalog_len=1000):
-        self.tub = Tub(base_path, inputs, types, metadata, max_catalog_len)
+                 max_catalog_len=1000, image_codec=None, encoder_workers=0,
+                 image_storage='files'):
+        self.tub = Tub(base_path, inputs, types, metadata, max_catalog_len,
+                       image_codec=image_codec,
+                       encoder_workers=encoder_workers,
+                       image_storage=image_storage)
 
     def run(self, *args):
         assert len(self.tub.inputs) == len(args), \
             f'Expected {len(self.tub.inputs)} inputs but received {len(args)}'
         record = dict(zip(self.tub.inputs, args))
         self.tub.write_record(record)
-        return self.tub.manifest.current_index
+        return self.tub.current_index
+
+    def delete_last_n_records(self, n):
+        self.tub.delete_last_n_records(n)
 
     def __iter__(self):
         return self.tub.__iter__()
@@ -137,6 +280,162 @@ class TubWriter(object):
         self.close()
 
 
+class AsyncTubWriter(TubWriter):
+    """
+    A Donkey part, which writes records to the datastore in a background
+    thread. The drive loop only puts the record into a bounded queue, the
+    writer thread encodes images, appends the catalog lines and flushes
+    the tub once per batch of queued records.
+
+    When the queue is full, the 'block' policy waits for the writer and the
+    'drop_oldest' policy discards the oldest queued record. The part
+    returns the number of records the tub will hold once the queue is
+    written, the current queue depth and the latency in ms between queueing
+    and writing of the last written record. Hand the writer, not its tub,
+    to parts deleting records, like the joystick or the TubWiper, so
+    records still in the queue are deleted as well.
+    """
+    POLICIES = ('block', 'drop_oldest')
+
+    def __init__(self, base_path, inputs=[], types=[], metadata=[],
+                 max_catalog_len=1000, queue_size=100, policy='drop_oldest',
+                 sync=True, image_codec=None, encoder_workers=0,
+                 image_storage='files'):
+        """
+        :param queue_size:  maximum number of records waiting to be written
+        :param policy:      what to do when the queue is full, one of
+                            AsyncTubWriter.POLICIES
+        :param sync:        if each batch should also be fsync'ed to disk
+        """
+        assert policy in self.POLICIES, \
+            f'policy must be one of {self.POLICIES} but is {policy}'
+        super().__init__(base_path, inputs, types, metadata, max_catalog_len,
+                         image_codec, encoder_workers, image_storage)
+        self.policy = policy
+        self.sync = sync
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.num_records = self.tub.current_index
+        self.count_lock = threading.Lock()
+        # set when records were queued, wakes up the writer thread
+        self.queued = threading.Event()
+        self.num_dropped = 0
+        self.latency_ms = 0.0
+        self.running = True
+        self.thread = threading.Thread(target=self.update, daemon=True)
+        self.thread.start()
+
+    def run(self, *args):
+        assert len(self.tub.inputs) == len(args), \
+            f'Expected {len(self.tub.inputs)} inputs but received {len(args)}'
+        record = dict(zip(self.tub.inputs, args))
+        item = (record, int(round(time.time() * 1000)), time.perf_counter())
+        if not self.thread.is_alive():
+            self.writer_died()
+            return self.num_records, self.queue.qsize(), self.latency_ms
+        if self.policy == 'block':
+            # don't wait forever if the writer thread dies meanwhile
+            while True:
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    if not self.thread.is_alive():
+                        self.writer_died()
+                        return self.num_records, self.queue.qsize(), \
+                            self.latency_ms
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.num_dropped += 1
+                        self.count_records(-1)
+                    except queue.Empty:
+                        pass
+        self.count_records(1)
+        self.queued.set()
+        return self.num_records, self.queue.qsize(), self.latency_ms
+
+    def count_records(self, n):
+        """ Records are counted by the drive loop, the writer thread and
+        deletions, which may run on the controller thread """
+        with self.count_lock:
+            self.num_records += n
+
+    def writer_died(self):
+        """ The record is dropped, the error is logged once """
+        if not self.num_dropped:
+            logger.error(f'Tub writer thread of {self.tub.base_path} is not '
+                         f'running, records are not written')
+        self.num_dropped += 1
+
+    def take_queued(self):
+        """ Queued records, oldest first. Call while holding the tub lock, so
+        records are never between the queue and the tub. """
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def write_batch(self, batch):
+        """ Write and flush the records, call while holding the tub lock """
+        for record, timestamp_ms, queued_at in batch:
+            try:
+                self.tub.write_record(record, timestamp_ms=timestamp_ms,
+                                      flush=False)
+            except Exception as e:
+                # the record is not in the tub, don't count it
+                self.count_records(-1)
+                logger.error(f'Could not write record: {e}')
+            self.latency_ms = (time.perf_counter() - queued_at) * 1000
+        try:
+            self.tub.flush(self.sync)
+        except Exception as e:
+            logger.error(f'Could not flush tub: {e}')
+
+    def update(self):
+        while self.running or not self.queue.empty():
+            self.queued.wait(0.1)
+            # records are taken from the queue and written under the tub
+            # lock, so deletions see each record either queued or written
+            with self.tub.lock:
+                self.queued.clear()
+                batch = self.take_queued()
+                if batch:
+                    self.write_batch(batch)
+
+    def delete_last_n_records(self, n):
+        """
+        Delete the last n records, including the ones which are still
+        queued. Queued records are discarded, older queued records which are
+        kept are written before the rest is deleted from the tub.
+        """
+        with self.tub.lock:
+            batch = self.take_queued()
+            keep = max(len(batch) - n, 0)
+            discarded = len(batch) - keep
+            self.count_records(-discarded)
+            if keep:
+                self.write_batch(batch[:keep])
+            if n > discarded:
+                self.tub.delete_last_n_records(n - discarded)
+
+    def close(self):
+        # write all queued records before closing the tub
+        self.running = False
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.num_dropped:
+            logger.warning(f'Dropped {self.num_dropped} records because the '
+                           f'write queue was full or the writer stopped')
+        self.tub.close()
+
+
 class TubWiper:
     """
     Donkey part which deletes a bunch of records from the end of tub.
@@ -147,7 +446,8 @@ class TubWiper:
     """
     def __init__(self, tub, num_records=20):
         """
-        :param tub: tub to operate on
+        :param tub: tub or tub writer to operate on, pass the AsyncTubWriter
+                    and not its tub, so queued records are deleted too
         :param num_records: number or records to delete
         """
         self._tub = tub
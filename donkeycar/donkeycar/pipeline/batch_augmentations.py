@@ -0,0 +1,172 @@
+"""
+Augmentations of whole uint8 image batches of shape (N, H, W, C) with
+vectorised TensorFlow ops, which tf.data runs on its own threads after
+batching. They are configured with the same AUGMENTATIONS list and AUG_*
+keys as the per-image ImageAugmentation and apply each augmentation to a
+random subset of the batch.
+"""
+import logging
+from typing import Callable, List, Optional
+
+import numpy as np
+import tensorflow as tf
+
+from donkeycar.config import Config
+
+logger = logging.getLogger(__name__)
+
+BatchOp = Callable[[tf.Tensor], tf.Tensor]
+
+
+class BatchAugmentation(object):
+    # number of precomputed cutout masks
+    MASK_BANK_SIZE = 256
+    BLUR_KERNEL_SIZE = 13
+
+    def __init__(self, cfg: Config, key: str, prob: float = 0.5,
+                 seed: Optional[int] = None):
+        self.prob = prob
+        self.rng = np.random.default_rng(seed)
+        self.masks = {}
+        self.ops: List[BatchOp] = [self.create(aug_type, cfg)
+                                   for aug_type in getattr(cfg, key, [])]
+
+    def create(self, aug_type: str, config: Config) -> BatchOp:
+        """ Augmentation factory. """
+        if aug_type == 'BRIGHTNESS':
+            b_limit = getattr(config, 'AUG_BRIGHTNESS_RANGE', 0.2)
+            logger.info(f'Creating batch augmentation {aug_type} {b_limit}')
+            return lambda batch: self.brightness(batch, b_limit)
+
+        elif aug_type == 'BLUR':
+            b_range = getattr(config, 'AUG_BLUR_RANGE', 3)
+            if np.isscalar(b_range):
+                b_range = (0, b_range)
+            logger.info(f'Creating batch augmentation {aug_type} {b_range}')
+            return lambda batch: self.blur(batch, b_range)
+
+        elif aug_type == 'CUTOUT':
+            holes = getattr(config, 'AUG_CUTOUT_HOLES', 8)
+            size = getattr(config, 'AUG_CUTOUT_SIZE', 20)
+            fill = getattr(config, 'AUG_CUTOUT_FILL', 255)
+            logger.info(f'Creating batch augmentation {aug_type}: '
+                        f'Holes={holes}, Size={size}, Fill={fill}')
+            return lambda batch: self.cutout(batch, holes, size, fill)
+        raise ValueError(f'Unknown batch augmentation {aug_type}')
+
+    def _selected(self, batch: tf.Tensor) -> tf.Tensor:
+        """ Indexes of the images of the batch to augment """
+        n = tf.shape(batch)[0]
+        return tf.where(tf.random.uniform([n]) < self.prob)[:, 0]
+
+    def brightness(self, batch: tf.Tensor, limit: float) -> tf.Tensor:
+        """ Random brightness and contrast, like RandomBrightnessContrast """
+        n = tf.shape(batch)[0]
+        selected = tf.random.uniform([n]) < self.prob
+        alpha = tf.where(selected, 1 + tf.random.uniform([n], -limit, limit),
+                         1.)
+        beta = tf.where(selected, tf.random.uniform([n], -limit, limit) * 255,
+                        0.)
+        out = tf.cast(batch, tf.float32) * alpha[:, None, None, None] \
+            + beta[:, None, None, None]
+        return tf.cast(tf.clip_by_value(out, 0, 255), tf.uint8)
+
+    def blur(self, batch: tf.Tensor, sigma_range) -> tf.Tensor:
+        """
+        Gaussian blur with a random sigma per image, like GaussianBlur. The
+        selected images are stacked along the channels, so the two 1d
+        convolutions of the separable blur are single depthwise convolutions
+        with one kernel per image.
+        """
+        selected = self._selected(batch)
+        return tf.cond(
+            tf.size(selected) > 0,
+            lambda: tf.tensor_scatter_nd_update(
+                batch, selected[:, None],
+                self._blur(tf.gather(batch, selected), sigma_range)),
+            lambda: batch)
+
+    def _blur(self, images: tf.Tensor, sigma_range) -> tf.Tensor:
+        n = tf.shape(images)[0]
+        h, w, c = images.shape[1:]
+        images = tf.cast(images, tf.float32)
+        half = self.BLUR_KERNEL_SIZE // 2
+        sigma = tf.maximum(tf.random.uniform([n], *sigma_range), 1e-3)
+        x = tf.range(-half, half + 1, dtype=tf.float32)
+        kernels = tf.exp(-0.5 * (x[None, :] / sigma[:, None]) ** 2)
+        kernels /= tf.reduce_sum(kernels, axis=1, keepdims=True)
+        # (kernel size, n * c) with the kernel of each image for its channels
+        kernels = tf.transpose(tf.repeat(kernels, c, axis=0))
+        # (1, h, w, n * c), padded with the opencv default border
+        stacked = tf.reshape(tf.transpose(images, [1, 2, 0, 3]),
+                             [1, h, w, -1])
+        stacked = tf.pad(stacked, [[0, 0], [half, half], [half, half], [0, 0]],
+                         mode='REFLECT')
+        strides = [1, 1, 1, 1]
+        stacked = tf.nn.depthwise_conv2d(
+            stacked, kernels[None, :, :, None], strides, 'VALID')
+        stacked = tf.nn.depthwise_conv2d(
+            stacked, kernels[:, None, :, None], strides, 'VALID')
+        images = tf.transpose(tf.reshape(stacked, [h, w, n, c]), [2, 0, 1, 3])
+        return tf.cast(tf.clip_by_value(tf.round(images), 0, 255), tf.uint8)
+
+    def mask_bank(self, h: int, w: int, c: int, holes: int, size: int) \
+            -> np.ndarray:
+        """
+        MASK_BANK_SIZE random cutout masks of shape (h, w, c), each with 1 to
+        holes rectangles with sides of 4 to size pixels, and an empty mask
+        last. Masks are 255 inside the rectangles and 0 elsewhere.
+        """
+        key = (h, w, c, holes, size)
+        if key not in self.masks:
+            n, rng = self.MASK_BANK_SIZE, self.rng
+            num_holes = rng.integers(1, holes + 1, n)
+            y0 = rng.integers(0, h, (n, holes, 1))
+            x0 = rng.integers(0, w, (n, holes, 1))
+            y1 = y0 + rng.integers(4, size + 1, (n, holes, 1))
+            x1 = x0 + rng.integers(4, size + 1, (n, holes, 1))
+            rows, cols = np.arange(h), np.arange(w)
+            used = np.arange(holes)[None, :, None] < num_holes[:, None, None]
+            in_rows = (rows >= y0) & (rows < y1) & used
+            in_cols = (cols >= x0) & (cols < x1)
+            # (n, holes, h, w) reduced over the holes
+            masks = np.any(in_rows[:, :, :, None] & in_cols[:, :, None, :],
+                           axis=1)
+            bank = np.zeros((n + 1, h, w, c), dtype=np.uint8)
+            bank[:n] = masks[..., None] * np.uint8(255)
+            self.masks[key] = bank
+        return self.masks[key]
+
+    def cutout(self, batch: tf.Tensor, holes: int, size: int, fill: int) \
+            -> tf.Tensor:
+        """
+        Rectangular holes filled with fill, like CoarseDropout. Clamping the
+        images from below and above with masks of the batch shape avoids the
+        slow broadcasting of tf.where on uint8 tensors.
+        """
+        bank = tf.constant(self.mask_bank(*batch.shape[1:], holes, size))
+        n = tf.shape(batch)[0]
+        picks = tf.where(tf.random.uniform([n]) < self.prob,
+                         tf.random.uniform([n], 0, self.MASK_BANK_SIZE,
+                                           tf.int32),
+                         self.MASK_BANK_SIZE)
+        masks = tf.gather(bank, picks)
+        fill = tf.constant(fill, tf.uint8)
+        batch = tf.maximum(batch, tf.bitwise.bitwise_and(masks, fill))
+        return tf.minimum(
+            batch, tf.bitwise.bitwise_or(tf.bitwise.invert(masks), fill))
+
+    def run(self, batch) -> tf.Tensor:
+        """
+        Augment a uint8 batch of shape (N, H, W, C), or (N, T, H, W, C) for
+        sequence models, with known image size.
+        """
+        batch = tf.convert_to_tensor(batch)
+        if not self.ops:
+            return batch
+        shape = tf.shape(batch)
+        images = tf.reshape(batch, tf.concat([[-1], shape[-3:]], axis=0))
+        images.set_shape([None] + batch.shape[-3:].as_list())
+        for op in self.ops:
+            images = op(images)
+        return tf.reshape(images, shape)
@@ -0,0 +1,222 @@
+"""
+Cache of the transformed images of a set of tubs. The deterministic
+TRANSFORMATIONS are applied once to all images and the resulting uint8
+images are stored in .npy shards, which are memory mapped during training,
+so that only the augmentations and post transformations run per epoch.
+Records whose image is not in the cache are transformed as usual.
+
+A cache lives in a folder named after the hash of the transformation
+config, the image size and the tub paths. It is rebuilt when the tubs
+changed since it was built.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+from donkeycar.config import Config
+from donkeycar.parts.datastore_v2 import Manifest
+from donkeycar.parts.frame_store import open_image
+from donkeycar.parts.tub_index import TubIndex
+from donkeycar.pipeline.image_cache import ImageProcessor, writeable
+from donkeycar.pipeline.types import Collator, TubRecord, TubRecords
+from donkeycar.utils import load_image
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+IMAGE_KEY = 'cam/image_array'
+
+
+def cache_signature(config: Config, tub_paths: List[str]) -> dict:
+    """ Everything the transformed images depend on """
+    from donkeycar.parts.image_transformations import transformation_config
+    transformations = list(getattr(config, 'TRANSFORMATIONS', []))
+    return dict(version=CACHE_VERSION,
+                transformations=transformations,
+                transformation_config=transformation_config(
+                    config, transformations),
+                image_size=[config.IMAGE_W, config.IMAGE_H,
+                            config.IMAGE_DEPTH],
+                tubs=sorted(os.path.abspath(os.path.expanduser(p))
+                            for p in tub_paths))
+
+
+def _tub_state(tub_path):
+    """ Catalog sizes change whenever records are added or rewritten """
+    manifest = Manifest(tub_path, read_only=True)
+    try:
+        return [os.path.getsize(os.path.join(tub_path, p))
+                for p in manifest.catalog_paths]
+    finally:
+        manifest.close()
+
+
+class CachedTubRecord(TubRecord):
+    """
+    TubRecord whose image() starts from the transformed image of the
+    DatasetCache instead of decoding and transforming the original image.
+    The transformation of an ImageProcessor is skipped, other processors
+    are applied to the transformed image.
+    """
+    def __init__(self, record: TubRecord, cache: 'DatasetCache', row: int):
+        super().__init__(record.config, record.base_path, record.underlying)
+        self._dataset_cache = cache
+        self._row = row
+
+    def image(self, processor=None, as_nparray=True) -> np.ndarray:
+        # the shards are mapped read only, like TubRecord.image() the
+        # image may be changed in place by the caller
+        _image = writeable(self._dataset_cache.image(self._row))
+        if isinstance(processor, ImageProcessor):
+            return processor.after_transform(_image)
+        return processor(_image) if processor else _image
+
+
+class DatasetCache(object):
+
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.shards = [np.load(os.path.join(path, shard['file']),
+                               mmap_mode='r') for shard in meta['shards']]
+        self.shard_size = meta['shard_size']
+        tubs = meta['signature']['tubs']
+        # (tub path, image path) -> row
+        self.rows = {(tubs[t], p): i for i, (t, p)
+                     in enumerate(meta['rows'])}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def image(self, row: int) -> np.ndarray:
+        return self.shards[row // self.shard_size][row % self.shard_size]
+
+    def wrap(self, records: list) -> list:
+        """
+        Replace records, or sequences of records, by CachedTubRecords.
+        Records whose image is not in the cache are kept.
+        """
+        def wrap_record(record):
+            if isinstance(record, list):
+                return [wrap_record(r) for r in record]
+            row = self.rows.get((os.path.abspath(record.base_path),
+                                 record.underlying.get(IMAGE_KEY)))
+            return record if row is None \
+                else CachedTubRecord(record, self, row)
+        def wrap_records(records):
+            if isinstance(records, TubRecords):
+                return records.wrapped(wrap_record)
+            return [wrap_record(r) for r in records]
+
+        if isinstance(records, Collator):
+            # wrap the records once instead of each window
+            return Collator(records.seq_length, wrap_records(records.records),
+                            records.starts)
+        return wrap_records(records)
+
+    @classmethod
+    def cache_path(cls, config: Config, tub_paths: List[str]) -> str:
+        signature = cache_signature(config, tub_paths)
+        digest = hashlib.sha1(json.dumps(signature, sort_keys=True,
+                                         default=str).encode()).hexdigest()
+        base = getattr(config, 'DATASET_CACHE_PATH', None) or \
+            os.path.join(os.path.dirname(os.path.abspath(config.DATA_PATH)),
+                         'dataset_cache')
+        return os.path.join(os.path.expanduser(base), digest[:16])
+
+    @classmethod
+    def open(cls, config: Config, tub_paths: List[str]) \
+            -> Optional['DatasetCache']:
+        """ The cache if it exists and is up to date, otherwise None """
+        path = cls.cache_path(config, tub_paths)
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        for tub_path, state in zip(meta['signature']['tubs'],
+                                   meta['tub_states']):
+            if _tub_state(tub_path) != state:
+                logger.info(f'Tub {tub_path} changed, dataset cache {path} '
+                            f'is outdated')
+                return None
+        return cls(path, meta)
+
+    @classmethod
+    def ensure(cls, config: Config, tub_paths: List[str]) -> 'DatasetCache':
+        """ Open the cache, or (re)build it if missing or outdated """
+        return cls.open(config, tub_paths) or cls.build(config, tub_paths)
+
+    @classmethod
+    def build(cls, config: Config, tub_paths: List[str],
+              shard_size: int = 4096, workers: int = 4) -> 'DatasetCache':
+        """
+        Transform the images of all records of the tubs, including deleted
+        ones, so record deletion does not invalidate the cache.
+        """
+        from donkeycar.parts.image_transformations import \
+            ImageTransformations
+        signature = cache_signature(config, tub_paths)
+        path = cls.cache_path(config, tub_paths)
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        transformation = ImageTransformations(config, 'TRANSFORMATIONS')
+
+        rows, tub_states = [], []
+        for tub_number, tub_path in enumerate(signature['tubs']):
+            index = TubIndex.load(tub_path)
+            tub_states.append(_tub_state(tub_path))
+            if IMAGE_KEY not in index:
+                continue
+            has_image = index.has_value(IMAGE_KEY)
+            rows.extend((tub_number, p) for p in
+                        index.column(IMAGE_KEY)[has_image])
+
+        def load(row):
+            tub_number, image_path = row
+            img = load_image(open_image(signature['tubs'][tub_number],
+                                        image_path), config)
+            return np.asarray(transformation.run(img), dtype=np.uint8)
+
+        start = time.time()
+        shards = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for first in range(0, len(rows), shard_size):
+                chunk = rows[first:first + shard_size]
+                images = executor.map(load, chunk)
+                img = next(images)
+                name = f'shard_{len(shards):04d}.npy'
+                shard = np.lib.format.open_memmap(
+                    os.path.join(tmp_path, name), mode='w+', dtype=np.uint8,
+                    shape=(len(chunk),) + img.shape)
+                shard[0] = img
+                for i, img in enumerate(images, 1):
+                    if img.shape != shard.shape[1:]:
+                        raise ValueError(
+                            f'Transformed images have different shapes '
+                            f'{img.shape} and {shard.shape[1:]}')
+                    shard[i] = img
+                shard.flush()
+                del shard
+                shards.append(dict(file=name, rows=len(chunk)))
+                logger.info(f'Cached {first + len(chunk)}/{len(rows)} '
+                            f'images')
+        meta = dict(signature=signature, tub_states=tub_states,
+                    shard_size=shard_size, shards=shards,
+                    rows=[[t, p] for t, p in rows], created_at=time.time())
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, default=str)
+        # replace an outdated cache only once the new one is complete
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        logger.info(f'Built dataset cache {path} with {len(rows)} images in '
+                    f'{time.time() - start:.1f}s')
+        return cls(path, meta)
@@ -0,0 +1,237 @@
+"""
+A bounded cache of decoded images shared by all TubRecords of a process, so
+the training and validation records use the same cache and memory use stays
+within a configured budget.
+"""
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def writeable(img: np.ndarray) -> np.ndarray:
+    """ The image, or a copy of it if it is a read only cached image """
+    return img if img.flags.writeable else img.copy()
+
+
+def processor_signature(processor: Optional[Callable]) -> Optional[str]:
+    """
+    Cache key of an image processor. Only processors with a 'cache_key'
+    attribute produce cacheable output, the result of other processors
+    (e.g. random augmentations) is computed each time from the cached
+    decoded image. For an ImageProcessor the key covers the transformation,
+    its augmentations run on each call.
+
+    :return:    '' for no processor, the cache key or None if the output
+                of the processor must not be cached
+    """
+    if processor is None:
+        return ''
+    key = getattr(processor, 'cache_key', None)
+    return str(key) if key is not None else None
+
+
+class ImageProcessor(object):
+    """
+    Image processing of training records: a deterministic transformation,
+    whose output may be stored like in the DatasetCache, followed by
+    processing which runs on every call, like random augmentations. If a
+    cache_key is given, TubRecord.image() caches the transformed image
+    under that key.
+    """
+    def __init__(self, transform: Callable[[np.ndarray], np.ndarray],
+                 then: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+                 cache_key: Optional[str] = None):
+        self.transform = transform
+        self.then = then
+        self.cache_key = cache_key
+
+    def __call__(self, img: np.ndarray) -> np.ndarray:
+        return self.after_transform(self.transform(img))
+
+    def after_transform(self, img: np.ndarray) -> np.ndarray:
+        """ Processing of an image which is transformed already """
+        return self.then(img) if self.then else img
+
+
+class DiskImageCache(object):
+    """
+    Second cache tier, which appends uint8 images to a memory mapped file
+    of fixed size. Images are not evicted, once the file is full new images
+    are not added anymore. The file is only valid for the lifetime of the
+    cache.
+    """
+    def __init__(self, path: Optional[str] = None, max_bytes: int = 1 << 30):
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix='.image_cache')
+            os.close(fd)
+        self.path = path
+        self.max_bytes = max_bytes
+        # sparse file, disk space is only used when written
+        with open(self.path, 'wb') as f:
+            f.truncate(max_bytes)
+        self.data = np.memmap(self.path, dtype=np.uint8, mode='r+',
+                              shape=(max_bytes,))
+        self.entries = dict()
+        self.used = 0
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        offset, shape = entry
+        size = int(np.prod(shape))
+        img = self.data[offset:offset + size].reshape(shape)
+        img.flags.writeable = False
+        return img
+
+    def put(self, key: Hashable, img: np.ndarray) -> bool:
+        if key in self.entries or img.dtype != np.uint8:
+            return False
+        if self.used + img.nbytes > self.max_bytes:
+            return False
+        self.data[self.used:self.used + img.nbytes] = img.reshape(-1)
+        self.entries[key] = (self.used, img.shape)
+        self.used += img.nbytes
+        return True
+
+    def close(self):
+        del self.data
+        self.entries.clear()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class ImageCache(object):
+    """
+    Thread safe LRU cache of image arrays with a byte budget. Images evicted
+    from memory are kept in the optional DiskImageCache.
+    """
+    def __init__(self, max_bytes: int,
+                 disk: Optional[DiskImageCache] = None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.images = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.images)
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        with self.lock:
+            img = self.images.get(key)
+            if img is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+                return img
+            if self.disk:
+                img = self.disk.get(key)
+                if img is not None:
+                    self.disk_hits += 1
+                    return img
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, img: np.ndarray) -> None:
+        """ Cache the image. A cached image is shared and made read only,
+        images which are not cached are left as they are. """
+        with self.lock:
+            if img.nbytes > self.max_bytes or key in self.images:
+                return
+            img.flags.writeable = False
+            self.images[key] = img
+            self.bytes += img.nbytes
+            while self.bytes > self.max_bytes:
+                old_key, old_img = self.images.popitem(last=False)
+                self.bytes -= old_img.nbytes
+                self.evictions += 1
+                if self.disk:
+                    self.disk.put(old_key, old_img)
+
+    def get_or_load(self, key: Hashable,
+                    loader: Callable[[], np.ndarray]) -> np.ndarray:
+        img = self.get(key)
+        if img is None:
+            img = loader()
+            self.put(key, img)
+        return img
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return dict(hits=self.hits, disk_hits=self.disk_hits,
+                        misses=self.misses, evictions=self.evictions,
+                        entries=len(self.images), bytes=self.bytes,
+                        disk_bytes=self.disk.used if self.disk else 0,
+                        hit_rate=(self.hits + self.disk_hits) / lookups
+                        if lookups else 0.0)
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.bytes = 0
+            if self.disk:
+                self.disk.entries.clear()
+                self.disk.used = 0
+
+    def close(self):
+        self.clear()
+        if self.disk:
+            self.disk.close()
+            self.disk = None
+
+
+_cache: Optional[ImageCache] = None
+_cache_settings: Any = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache(config) -> Optional[ImageCache]:
+    """
+    The image cache of the process as configured by CACHE_IMAGES,
+    IMAGE_CACHE_MB, IMAGE_CACHE_DISK_MB and IMAGE_CACHE_DISK_PATH, or None
+    if images are not cached.
+    """
+    global _cache, _cache_settings
+    if not getattr(config, 'CACHE_IMAGES', True):
+        return None
+    settings = (getattr(config, 'IMAGE_CACHE_MB', 2048),
+                getattr(config, 'IMAGE_CACHE_DISK_MB', 0),
+                getattr(config, 'IMAGE_CACHE_DISK_PATH', None))
+    with _cache_lock:
+        if _cache is None or settings != _cache_settings:
+            if _cache:
+                _cache.close()
+            memory_mb, disk_mb, disk_path = settings
+            disk = DiskImageCache(disk_path, int(disk_mb * (1 << 20))) \
+                if disk_mb else None
+            _cache = ImageCache(int(memory_mb * (1 << 20)), disk)
+            _cache_settings = settings
+            logger.info(f'Created image cache with {memory_mb}MB memory and '
+                        f'{disk_mb}MB disk')
+        return _cache
+
+
+def reset_image_cache():
+    """
+    Forget the image cache of the process without closing it. Used in
+    forked data loader workers, which must not share the cache, its lock
+    and its disk file with the parent process.
+    """
+    global _cache, _cache_settings, _cache_lock
+    _cache = None
+    _cache_settings = None
+    _cache_lock = threading.Lock()
@@ -0,0 +1,323 @@
+"""
+Predictions of a pilot over the records of tubs, computed offline in large
+batches with the inputs the training pipeline creates.
+
+The predictions of a model are stored next to the records, in the
+'predictions' folder of the tub, as one column per output indexed by the
+record '_index'. They are kept as long as the model file, its type and the
+image transformations are the same, records added to the tub later are
+predicted on the next run. tubplot, makemovie and the pilot screen of the
+ui read them instead of running the model record by record.
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from donkeycar.config import Config
+from donkeycar.pipeline.types import Collator, TubDataset, TubRecords
+
+logger = logging.getLogger(__name__)
+
+PREDICTIONS_DIR = 'predictions'
+PREDICTIONS_VERSION = 1
+OUTPUT_KEYS = ('pilot/angle', 'pilot/throttle')
+
+
+def transformation_signature(config: Config, transformations: List[str] = None,
+                             post_transformations: List[str] = None) -> dict:
+    """ The image transformations the predictions depend on, defaults to the
+    TRANSFORMATIONS and POST_TRANSFORMATIONS of the config """
+    from donkeycar.parts.image_transformations import transformation_config
+    if transformations is None:
+        transformations = getattr(config, 'TRANSFORMATIONS', [])
+    if post_transformations is None:
+        post_transformations = getattr(config, 'POST_TRANSFORMATIONS', [])
+    transformations = list(transformations or [])
+    post_transformations = list(post_transformations or [])
+    return dict(transformations=transformations,
+                post_transformations=post_transformations,
+                transformation_config=transformation_config(
+                    config, transformations + post_transformations),
+                image_size=[config.IMAGE_W, config.IMAGE_H,
+                            config.IMAGE_DEPTH])
+
+
+def model_signature(model_path: str, model_type: str) -> dict:
+    """ The model file and type the predictions were made with """
+    model_path = os.path.abspath(os.path.expanduser(model_path))
+    stat = os.stat(model_path)
+    # savedmodel and tensorrt models are folders, their files change
+    if os.path.isdir(model_path):
+        stat = max((os.stat(os.path.join(root, f)) for root, _, files
+                    in os.walk(model_path) for f in files),
+                   key=lambda s: s.st_mtime, default=stat)
+    return dict(model=model_path, model_mtime=stat.st_mtime,
+                model_size=stat.st_size, model_type=model_type)
+
+
+def prediction_signature(config: Config, model_path: str, model_type: str) \
+        -> dict:
+    """ Everything the predictions depend on """
+    # json round trip, so tuples in the config compare equal after loading
+    transformation = json.loads(json.dumps(transformation_signature(config),
+                                           default=str))
+    return dict(version=PREDICTIONS_VERSION,
+                **model_signature(model_path, model_type),
+                transformation=transformation)
+
+
+def record_indexes(records) -> np.ndarray:
+    """ _index of the records, of the last record of a sequence """
+    if isinstance(records, Collator):
+        return record_indexes(records.records)[
+            np.asarray(records.starts, dtype=np.int64)
+            + records.seq_length - 1]
+    if isinstance(records, TubRecords):
+        return records.column('_index').astype(np.int64)
+    return np.fromiter(
+        ((r[-1] if isinstance(r, list) else r).underlying['_index']
+         for r in records), dtype=np.int64, count=len(records))
+
+
+class Predictions(object):
+    """ Pilot outputs for the records of a tub, sorted by record _index """
+
+    def __init__(self, indexes: np.ndarray, columns: Dict[str, np.ndarray],
+                 signature: dict):
+        order = np.argsort(indexes, kind='stable')
+        self.indexes = np.asarray(indexes, dtype=np.int64)[order]
+        self.columns = {k: np.asarray(v, dtype=np.float32)[order]
+                        for k, v in columns.items()}
+        self.signature = signature
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def __contains__(self, index) -> bool:
+        return self.position(index) is not None
+
+    def position(self, index: int) -> Optional[int]:
+        i = int(np.searchsorted(self.indexes, index))
+        return i if i < len(self.indexes) and self.indexes[i] == index \
+            else None
+
+    def get(self, index: int) -> Optional[Tuple[float, ...]]:
+        """ The outputs predicted for the record, None if not predicted """
+        i = self.position(index)
+        if i is None:
+            return None
+        return tuple(float(self.columns[k][i]) for k in OUTPUT_KEYS)
+
+    def lookup(self, indexes: Sequence[int]) -> Dict[str, np.ndarray]:
+        """ Columns for the given record indexes, nan where not predicted """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        if not len(self.indexes):
+            return {k: np.full(len(indexes), np.nan, dtype=np.float32)
+                    for k in self.columns}
+        pos = np.minimum(np.searchsorted(self.indexes, indexes),
+                         len(self.indexes) - 1)
+        found = self.indexes[pos] == indexes
+        return {k: np.where(found, v[pos], np.float32(np.nan))
+                for k, v in self.columns.items()}
+
+    def missing(self, indexes: np.ndarray) -> np.ndarray:
+        """ Mask of the record indexes without prediction """
+        return ~np.isin(indexes, self.indexes)
+
+    def merged(self, indexes: np.ndarray, columns: Dict[str, np.ndarray]) \
+            -> 'Predictions':
+        """ Predictions extended by new records """
+        return Predictions(
+            np.concatenate([self.indexes, indexes]),
+            {k: np.concatenate([v, columns[k]])
+             for k, v in self.columns.items()},
+            self.signature)
+
+    def valid_for(self, config: Config, transformations: List[str] = None,
+                  post_transformations: List[str] = None) -> bool:
+        """ If the images were transformed like the given transformations
+        would do it """
+        signature = json.loads(json.dumps(transformation_signature(
+            config, transformations, post_transformations), default=str))
+        return self.signature['transformation'] == signature
+
+    def made_by(self, model_path: str, model_type: str) -> bool:
+        """ If the predictions were made with the model as it is now """
+        try:
+            signature = model_signature(model_path, model_type)
+        except OSError:
+            return False
+        return self.signature.get('version') == PREDICTIONS_VERSION and \
+            all(self.signature.get(k) == v for k, v in signature.items())
+
+    @staticmethod
+    def path(tub_path: str, model_path: str) -> str:
+        name = os.path.basename(os.path.normpath(model_path))
+        return os.path.join(os.path.expanduser(tub_path), PREDICTIONS_DIR,
+                            name + '.npz')
+
+    def save(self, tub_path: str, model_path: str) -> str:
+        path = self.path(tub_path, model_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, _index=self.indexes,
+                 meta=np.array(json.dumps(self.signature)), **self.columns)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, tub_path: str, model_path: str, signature: dict = None) \
+            -> Optional['Predictions']:
+        """ The stored predictions of the model, None if there are none or
+        they were made with another signature """
+        path = cls.path(tub_path, model_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                stored = json.loads(str(data['meta']))
+                columns = {k: data[k] for k in OUTPUT_KEYS}
+                indexes = data['_index']
+        except Exception as e:
+            logger.warning(f'Ignoring unreadable predictions {path}: {e}')
+            return None
+        if signature is not None and stored != signature:
+            logger.info(f'Predictions {path} are outdated')
+            return None
+        return cls(indexes, columns, stored)
+
+
+def load_predictions(tub_path: str, model_path: str, config: Config = None,
+                     model_type: str = None) -> Optional[Predictions]:
+    """
+    The stored predictions of the model for the tub. If the config is given
+    they are only returned if the model and transformations did not change
+    since they were made.
+    """
+    signature = None
+    if config is not None:
+        model_type = model_type or config.DEFAULT_MODEL_TYPE
+        signature = prediction_signature(config, model_path, model_type)
+    return Predictions.load(tub_path, model_path, signature)
+
+
+def predict_records(model, config: Config, records, batch_size: int = None,
+                    workers: int = 4) -> Dict[str, np.ndarray]:
+    """
+    Run the model over the records in batches. The inputs are created like
+    in training, by the x transformation of the BatchSequence, on a thread
+    pool which loads and transforms the next batch while the current one is
+    predicted.
+
+    :return:    columns of the outputs, in the order of the records
+    """
+    from donkeycar.pipeline.training import BatchSequence
+    config = copy(config)
+    config.BATCH_SIZE = batch_size or getattr(config, 'PREDICT_BATCH_SIZE',
+                                              256)
+    columns = {k: np.empty(len(records), dtype=np.float32)
+               for k in OUTPUT_KEYS}
+    if not len(records):
+        return columns
+    pipe = BatchSequence(model, config, records, is_train=False,
+                         shuffle=False)
+    x_transform = pipe.pipeline.x_transform
+    size = config.BATCH_SIZE
+
+    with ThreadPoolExecutor(max_workers=workers) as loader, \
+            ThreadPoolExecutor(max_workers=1) as prefetcher:
+        def load(first):
+            xs = list(loader.map(x_transform, records[first:first + size]))
+            return {k: np.stack([x[k] for x in xs]) for k in xs[0]}
+
+        batch = prefetcher.submit(load, 0)
+        for first in range(0, len(records), size):
+            x = batch.result()
+            if first + size < len(records):
+                batch = prefetcher.submit(load, first + size)
+            outputs = model.inference_batch(x)
+            for i, k in enumerate(OUTPUT_KEYS):
+                columns[k][first:first + len(outputs)] = \
+                    [o[i] for o in outputs]
+            logger.debug(f'Predicted {first + len(outputs)}/{len(records)} '
+                         f'records')
+    return columns
+
+
+def predict_tub(model, config: Config, tub_path: str, model_path: str,
+                model_type: str = None, limit: int = None,
+                force: bool = False, save: bool = True,
+                records=None) -> Predictions:
+    """
+    Predictions of the loaded model for the records of the tub. Stored
+    predictions are reused, only records without prediction are run
+    through the model.
+
+    :param limit:   only the first records are predicted
+    :param force:   predict all records, even if stored predictions exist
+    :param save:    store the predictions in the tub
+    :param records: records of the tub, if they were loaded already
+    """
+    model_type = model_type or config.DEFAULT_MODEL_TYPE
+    signature = prediction_signature(config, model_path, model_type)
+    tub_path = os.path.expanduser(tub_path)
+    stored = None if force else Predictions.load(tub_path, model_path,
+                                                 signature)
+    if records is None:
+        dataset = TubDataset(config=config, tub_paths=[tub_path],
+                             seq_size=model.seq_size())
+        records = dataset.get_records()
+    if limit is not None:
+        records = records[:limit]
+    indexes = record_indexes(records)
+    predictions = stored or Predictions(
+        np.zeros(0, dtype=np.int64),
+        {k: np.zeros(0, dtype=np.float32) for k in OUTPUT_KEYS}, signature)
+    missing = np.flatnonzero(predictions.missing(indexes))
+    if not len(missing):
+        logger.info(f'Predictions of {model_path} for {tub_path} are up to '
+                    f'date')
+        return predictions
+
+    if len(missing) < len(indexes):
+        records = [records[int(i)] for i in missing]
+    start = time.time()
+    columns = predict_records(model, config, records)
+    predictions = predictions.merged(indexes[missing], columns)
+    duration = time.time() - start
+    logger.info(f'Predicted {len(missing)} records of {tub_path} in '
+                f'{duration:.1f}s, {len(missing) / max(duration, 1e-6):.0f} '
+                f'records/s')
+    if save:
+        path = predictions.save(tub_path, model_path)
+        logger.info(f'Saved predictions to {path}')
+    return predictions
+
+
+def predict_tubs(config: Config, tub_paths: List[str], model_path: str,
+                 model_type: str = None, limit: int = None,
+                 force: bool = False, save: bool = True) \
+        -> Dict[str, Predictions]:
+    """
+    Load the model and predict the records of all tubs, see predict_tub.
+
+    :return:    predictions by tub path
+    """
+    from donkeycar.parts.keras import KerasPilot
+    from donkeycar.utils import get_model_by_type
+    model_type = model_type or config.DEFAULT_MODEL_TYPE
+    model_path = os.path.expanduser(model_path)
+    model = get_model_by_type(model_type, config)
+    if not isinstance(model, KerasPilot):
+        raise ValueError(f'Batch predictions need a tensorflow model, not '
+                         f'{model_type}')
+    model.load(model_path)
+    return {tub_path: predict_tub(model, config, tub_path, model_path,
+                                  model_type, limit, force, save)
+            for tub_path in tub_paths}
@@ -10,11 +10,16 @@ from donkeycar.parts.keras import KerasPilot
 from donkeycar.parts.interpreter import keras_model_to_tflite, \
     saved_model_to_tensor_rt
 from donkeycar.pipeline.database import PilotDatabase
+from donkeycar.pipeline.dataset_cache import DatasetCache
+from donkeycar.pipeline.image_cache import ImageProcessor, get_image_cache
 from donkeycar.pipeline.sequence import TubRecord, TubSequence, TfmIterator
-from donkeycar.pipeline.types import TubDataset
+from donkeycar.pipeline.types import TubDataset, split_records
 from donkeycar.pipeline.augmentations import ImageAugmentation
-from donkeycar.parts.image_transformations import ImageTransformations
-from donkeycar.utils import get_model_by_type, normalize_image, train_test_split
+from donkeycar.pipeline.batch_augmentations import BatchAugmentation
+from donkeycar.parts.image_transformations import ImageTransformations, \
+    transformation_cache_key
+from donkeycar.utils import get_model_by_type, normalize_image, \
+    ONE_BYTE_SCALE
 import tensorflow as tf
 import numpy as np
 
@@ -25,34 +30,73 @@ class BatchSequence(object):
     themselves to np.ndarray initially and later into the types required by
     tf.data (i.e. dictionaries or np.ndarrays).
     """
+    PIPELINES = ('generator', 'parallel')
+
     def __init__(self,
                  model: KerasPilot,
                  config: Config,
                  records: List[TubRecord],
-                 is_train: bool) -> None:
+                 is_train: bool,
+                 shuffle: bool = None,
+                 dataset_cache: DatasetCache = None) -> None:
+        """
+        :param shuffle:         if the parallel pipeline reshuffles the
+                                records every epoch, defaults to is_train
+        :param dataset_cache:   if given, images of the records in the cache
+                                are read already transformed and only
+                                augmentations and post transformations are
+                                applied, other records are transformed
+        """
         self.model = model
         self.config = config
+        self.dataset_cache = dataset_cache
+        if dataset_cache:
+            records = dataset_cache.wrap(records)
         self.sequence = TubSequence(records)
         self.batch_size = self.config.BATCH_SIZE
         self.is_train = is_train
+        self.shuffle = is_train if shuffle is None else shuffle
+        self.pipeline_type = getattr(config, 'TRAIN_PIPELINE', 'parallel')
+        assert self.pipeline_type in self.PIPELINES, \
+            f'TRAIN_PIPELINE must be one of {self.PIPELINES} but is ' \
+            f'{self.pipeline_type}'
         self.augmentation = ImageAugmentation(config, 'AUGMENTATIONS')
+        # augment whole batches instead of single images, only possible if
+        # no post transformations have to follow the augmentations
+        self.batch_augmentation = None
+        if is_train and getattr(config, 'TRAIN_BATCH_AUGMENTATION', False):
+            if getattr(config, 'POST_TRANSFORMATIONS', []):
+                print('Augmenting single images because '
+                      'POST_TRANSFORMATIONS are set')
+            else:
+                self.batch_augmentation = BatchAugmentation(config,
+                                                            'AUGMENTATIONS')
         self.transformation = ImageTransformations(config, 'TRANSFORMATIONS')
         self.post_transformation = ImageTransformations(config,
                                                         'POST_TRANSFORMATIONS')
+        # the transformed images are cached by the image cache, the
+        # transformation is skipped for images of the dataset cache
+        self.image_processor = ImageProcessor(
+            self.transform_image, self.augment_image,
+            cache_key=transformation_cache_key(config))
         self.pipeline = self._create_pipeline()
 
     def __len__(self) -> int:
         return math.ceil(len(self.pipeline) / self.batch_size)
 
-    def image_processor(self, img_arr):
-        """ Transforms the image and augments it if in training. We are not
-        calling the normalisation here, because then the normalised images
-        would get cached in the TubRecord, and they are 8 times larger (as
-        they are 64bit floats and not uint8) """
+    def transform_image(self, img_arr):
+        """ Applies the TRANSFORMATIONS. We are not calling the
+        normalisation here, because the images are processed from the uint8
+        images of the image cache and processed images would be 8 times
+        larger (as they are 64bit floats and not uint8) """
         assert img_arr.dtype == np.uint8, \
             f"image_processor requires uint8 array but not {img_arr.dtype}"
-        img_arr = self.transformation.run(img_arr)
-        if self.is_train:
+        return self.transformation.run(img_arr)
+
+    def augment_image(self, img_arr):
+        """ Augments the transformed image if in training and applies the
+        POST_TRANSFORMATIONS """
+        if self.is_train and not self.batch_augmentation:
             img_arr = self.augmentation.run(img_arr)
         img_arr = self.post_transformation.run(img_arr)
 
@@ -65,8 +109,12 @@ class BatchSequence(object):
         def get_x(record: TubRecord) -> Dict[str, Union[float, np.ndarray]]:
             """ Extracting x from record for training"""
             out_dict = self.model.x_transform(record, self.image_processor)
-            # apply the normalisation here on the fly to go from uint8 -> float
-            out_dict['img_in'] = normalize_image(out_dict['img_in'])
+            # apply the normalisation here on the fly to go from uint8 ->
+            # float, unless the model normalises uint8 images itself or the
+            # batches are augmented and normalised later
+            if not getattr(self.model, 'uint8_input', False) \
+                    and not self.batch_augmentation:
+                out_dict['img_in'] = normalize_image(out_dict['img_in'])
             return out_dict
 
         def get_y(record: TubRecord) -> Dict[str, Union[float, np.ndarray]]:
@@ -81,11 +129,93 @@ class BatchSequence(object):
 
     def create_tf_data(self) -> tf.data.Dataset:
         """ Assembles the tf data pipeline """
+        if self.pipeline_type == 'parallel':
+            return self.create_parallel_tf_data()
         dataset = tf.data.Dataset.from_generator(
             generator=lambda: self.pipeline,
-            output_types=self.model.output_types(),
+            output_types=self.output_types(),
             output_shapes=self.model.output_shapes())
-        return dataset.repeat().batch(self.batch_size)
+        return self.augment_batches(dataset.repeat().batch(self.batch_size))
+
+    def output_types(self):
+        """ Types of the model, with uint8 images if batches are augmented """
+        types = self.model.output_types()
+        if self.batch_augmentation:
+            types[0]['img_in'] = tf.uint8
+        return types
+
+    def augment_batches(self, dataset: tf.data.Dataset,
+                        num_parallel_calls: int = None) -> tf.data.Dataset:
+        """ Applies the batch augmentation and the normalisation """
+        if not self.batch_augmentation:
+            return dataset
+        normalise = not getattr(self.model, 'uint8_input', False)
+
+        def augment(x, y):
+            img = self.batch_augmentation.run(x['img_in'])
+            if normalise:
+                img = tf.cast(img, tf.float32) * ONE_BYTE_SCALE
+            return dict(x, img_in=img), y
+
+        return dataset.map(augment, num_parallel_calls=num_parallel_calls)
+
+    def create_parallel_tf_data(self) -> tf.data.Dataset:
+        """
+        Assembles a tf data pipeline over the record indexes. Records are
+        loaded, transformed and normalised in tf.numpy_function calls that
+        tf.data runs on its own thread pool, so image decoding and the
+        image transformations of several records run in parallel.
+        """
+        types = self.output_types()
+        shapes = self.model.output_shapes()
+        # (position in the (x, y) tuple, key) of every tensor
+        flat_keys = [(i, k) for i, d in enumerate(shapes) for k in d]
+        flat_types = [types[i][k] for i, k in flat_keys]
+        records = self.sequence.records
+
+        def load(index):
+            record = records[int(index)]
+            xy = (self.pipeline.x_transform(record),
+                  self.pipeline.y_transform(record))
+            return [np.asarray(xy[i][k], dtype=t.as_numpy_dtype)
+                    for (i, k), t in zip(flat_keys, flat_types)]
+
+        def load_tensors(index):
+            flat = tf.numpy_function(load, [index], flat_types)
+            # numpy_function loses the structure and the shapes
+            xy = tuple({} for _ in shapes)
+            for (i, k), tensor in zip(flat_keys, flat):
+                tensor.set_shape(shapes[i][k])
+                xy[i][k] = tensor
+            return xy
+
+        dataset = tf.data.Dataset.range(len(records))
+        if self.shuffle:
+            dataset = dataset.shuffle(len(records),
+                                      reshuffle_each_iteration=True)
+        tune = tf.data.experimental.AUTOTUNE
+        dataset = dataset.repeat() \
+            .map(load_tensors, num_parallel_calls=tune,
+                 deterministic=not self.shuffle) \
+            .batch(self.batch_size)
+        return self.augment_batches(dataset, tune).prefetch(tune)
+
+
+def representative_data(model: KerasPilot, pipe: BatchSequence,
+                        count: int = 200):
+    """
+    Generator of single inputs of the model from the pipeline, used to
+    calibrate the quantisation of full integer tflite models. The inputs
+    are passed by name, the converter does not keep their order.
+    """
+    names = model.interpreter.model.input_names
+
+    def gen():
+        dataset = pipe.create_tf_data().unbatch().take(count)
+        for x, _ in dataset.as_numpy_iterator():
+            yield {name: np.expand_dims(x[name], axis=0) for name in names}
+
+    return gen
 
 
 def get_model_train_details(database: PilotDatabase, model: str = None) \
@@ -121,8 +251,7 @@ def train(cfg: Config, tub_paths: str, model: str = None,
     dataset = TubDataset(config=cfg, tub_paths=all_tub_paths,
                          seq_size=kl.seq_size())
     training_records, validation_records \
-        = train_test_split(dataset.get_records(), shuffle=True,
-                           test_size=(1. - cfg.TRAIN_TEST_SPLIT))
+        = split_records(cfg, dataset.get_records(), shuffle=True)
     print(f'Records # Training {len(training_records)}')
     print(f'Records # Validation {len(validation_records)}')
 
@@ -137,8 +266,13 @@ def train(cfg: Config, tub_paths: str, model: str = None,
         train_size = len(training_records)
         val_size = len(validation_records)
     else:
-        training_pipe = BatchSequence(kl, cfg, training_records, is_train=True)
-        validation_pipe = BatchSequence(kl, cfg, validation_records, is_train=False)
+        dataset_cache = DatasetCache.ensure(cfg, dataset.tub_paths) \
+            if getattr(cfg, 'TRAIN_DATASET_CACHE', False) else None
+        training_pipe = BatchSequence(kl, cfg, training_records, is_train=True,
+                                      dataset_cache=dataset_cache)
+        validation_pipe = BatchSequence(kl, cfg, validation_records,
+                                        is_train=False,
+                                        dataset_cache=dataset_cache)
         tune = tf.data.experimental.AUTOTUNE
         dataset_train = training_pipe.create_tf_data().prefetch(tune)
         dataset_validate = validation_pipe.create_tf_data().prefetch(tune)
@@ -161,9 +295,16 @@ def train(cfg: Config, tub_paths: str, model: str = None,
                        patience=cfg.EARLY_STOP_PATIENCE,
                        show_plot=cfg.SHOW_PLOT)
 
+    image_cache = get_image_cache(cfg)
+    if image_cache:
+        print(f'Image cache {image_cache.stats()}')
+
     if getattr(cfg, 'CREATE_TF_LITE', True):
         tf_lite_model_path = f'{base_path}.tflite'
-        keras_model_to_tflite(model_path, tf_lite_model_path)
+        data_gen = None
+        if getattr(cfg, 'TFLITE_FULL_INTEGER', False):
+            data_gen = representative_data(kl, validation_pipe)
+        keras_model_to_tflite(model_path, tf_lite_model_path, data_gen)
 
     if getattr(cfg, 'CREATE_TENSOR_RT', False):
         # load h5 (ie. keras) model
@@ -1,11 +1,17 @@
-import copy
 import os
-from typing import Any, List, Optional, TypeVar, Iterator, Iterable
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, List, Optional, TypeVar, Iterator, \
+    Sequence
 import logging
 import numpy as np
 from donkeycar.config import Config
+from donkeycar.parts.frame_store import open_image
+from donkeycar.parts.tub_index import TubIndex
 from donkeycar.parts.tub_v2 import Tub
-from donkeycar.utils import load_image, load_pil_image
+from donkeycar.pipeline.image_cache import ImageProcessor, \
+    get_image_cache, processor_signature, writeable
+from donkeycar.utils import load_image, load_pil_image, split_indexes
 from typing_extensions import TypedDict
 
 
@@ -39,80 +45,331 @@ class TubRecord(object):
         self.config = config
         self.base_path = base_path
         self.underlying = underlying
-        self._cache_images = getattr(self.config, 'CACHE_IMAGES', True)
-        self._image: Optional[Any] = None
+        self._cache = get_image_cache(config)
 
     def image(self, processor=None, as_nparray=True) -> np.ndarray:
         """
-        Loads the image.
+        Loads the image. Decoded images are kept in the shared image cache
+        unless CACHE_IMAGES is False, see get_image_cache().
 
         :param processor:   Image processing like augmentations or cropping, if
-                            not None. Defaults to None.
+                            not None. Defaults to None. The processed image
+                            is only cached if the processor has a cache_key
+                            attribute, otherwise it is applied to the cached
+                            decoded image on each call. Of an ImageProcessor
+                            with cache_key the transformed image is cached
+                            and the augmentations run on each call.
         :param as_nparray:  Whether to convert the image to a np array of uint8.
                             Defaults to True. If false, returns result of
                             Image.open()
-        :return:            Image
+        :return:            Image, which the caller may change in place,
+                            images from the cache are copied
         """
-        if self._image is None:
-            image_path = self.underlying['cam/image_array']
-            full_path = os.path.join(self.base_path, 'images', image_path)
+        image_path = self.underlying['cam/image_array']
 
+        def load():
+            # image file or frame of a packed tub
+            full_path = open_image(self.base_path, image_path)
             if as_nparray:
-                _image = load_image(full_path, cfg=self.config)
-            else:
-                # If you just want the raw Image
-                _image = load_pil_image(full_path, cfg=self.config)
-            if processor:
-                _image = processor(_image)
-            # only cache images if config does not forbid it
-            if self._cache_images:
-                self._image = _image
+                return load_image(full_path, cfg=self.config)
+            # If you just want the raw Image
+            return load_pil_image(full_path, cfg=self.config)
+
+        if self._cache is None or not as_nparray:
+            _image = load()
+            return processor(_image) if processor else _image
+
+        key = (self.base_path, image_path, self.config.IMAGE_W,
+               self.config.IMAGE_H, self.config.IMAGE_DEPTH)
+        signature = processor_signature(processor)
+        if not processor or not signature:
+            # processors may change the image in place
+            _image = writeable(self._cache.get_or_load(key, load))
+            return writeable(processor(_image)) if processor else _image
+
+        # only the transformation of an ImageProcessor is cached
+        if isinstance(processor, ImageProcessor):
+            transform, then = processor.transform, processor.after_transform
         else:
-            _image = self._image
-        return _image
+            transform, then = processor, None
+        _image = self._cache.get(key + (signature,))
+        if _image is None:
+            _image = transform(writeable(self._cache.get_or_load(key, load)))
+            self._cache.put(key + (signature,), _image)
+        _image = writeable(_image)
+        return then(_image) if then else _image
 
     def __repr__(self) -> str:
         return repr(self.underlying)
 
 
+class TubRecords(Sequence[TubRecord]):
+    """
+    Records of several tubs which are not held as TubRecord objects. Each
+    tub contributes its TubIndex, or its record dictionaries if the index
+    is not complete, and the rows which are selected for training. The
+    TubRecords are created on access, with a RowView of the index as
+    underlying, so memory and loading time don't grow with a Python object
+    per record.
+    """
+
+    def __init__(self, config: Config, parts: List[tuple],
+                 positions: Optional[np.ndarray] = None,
+                 wrapper: Optional[Callable[[TubRecord], TubRecord]] = None):
+        """
+        :param config:      config of the records
+        :param parts:       list of (base path, TubIndex or list of record
+                            dictionaries, array of selected rows) per tub
+        :param positions:   positions into the records of all parts, all
+                            records in order if None
+        :param wrapper:     applied to each record on access, e.g. to
+                            replace it by a CachedTubRecord
+        """
+        self.config = config
+        self.parts = parts
+        self.offsets = np.cumsum([0] + [len(rows) for _, _, rows in parts])
+        self.positions = positions
+        self.wrapper = wrapper
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1]) if self.positions is None \
+            else len(self.positions)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(f'Record {i} out of range of {n} records')
+        if self.positions is not None:
+            i = self.positions[i]
+        part = int(np.searchsorted(self.offsets, i, side='right')) - 1
+        base_path, source, rows = self.parts[part]
+        row = rows[i - self.offsets[part]]
+        underlying = source.row(row) if isinstance(source, TubIndex) \
+            else source[row]
+        record = TubRecord(self.config, base_path, underlying)
+        return self.wrapper(record) if self.wrapper else record
+
+    def __iter__(self) -> Iterator[TubRecord]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def _select(self, values: List[np.ndarray]) -> np.ndarray:
+        """ Concatenate per part values and select the positions """
+        values = np.concatenate(values) if values else np.zeros(0)
+        return values if self.positions is None else values[self.positions]
+
+    def column(self, key: str) -> np.ndarray:
+        """ Values of key of all records, None where they are missing """
+        values = []
+        for _, source, rows in self.parts:
+            if isinstance(source, TubIndex):
+                values.append(source.column(key)[rows] if key in source
+                              else np.full(len(rows), None))
+            else:
+                values.append(np.array([source[r].get(key) for r in rows]))
+        return self._select(values)
+
+    def has_key(self, key: str) -> np.ndarray:
+        """ Bool array of the records which have a value for key """
+        values = []
+        for _, source, rows in self.parts:
+            if isinstance(source, TubIndex):
+                has = source.has_value(key)[rows] if key in source \
+                    else np.zeros(len(rows), dtype=bool)
+                if key in source and source.types.get(key) == 'float':
+                    has = has & ~np.isnan(source.column(key)[rows])
+                values.append(has)
+            else:
+                values.append(np.array([key in source[r] for r in rows],
+                                       dtype=bool))
+        return self._select(values).astype(bool)
+
+    def sessions(self) -> np.ndarray:
+        """ Tub and session of all records, see record_session """
+        values = []
+        for base_path, source, rows in self.parts:
+            if isinstance(source, TubIndex):
+                ids = source.column('_session_id')[rows]
+            else:
+                ids = [source[r].get('_session_id', '') for r in rows]
+            values.append(np.array([f'{base_path}:{i}' for i in ids],
+                                   dtype=object))
+        return self._select(values)
+
+    def subset(self, positions: Sequence[int]) -> 'TubRecords':
+        """ TubRecords of the records at the given positions """
+        positions = np.asarray(positions, dtype=np.int64)
+        if self.positions is not None:
+            positions = self.positions[positions]
+        return TubRecords(self.config, self.parts, positions, self.wrapper)
+
+    def wrapped(self, wrapper: Callable[[TubRecord], TubRecord]) \
+            -> 'TubRecords':
+        """ The same records, passed through wrapper on access """
+        return TubRecords(self.config, self.parts, self.positions, wrapper)
+
+
+def _natural_key(name: str) -> list:
+    """ Sort key which orders tub_2 before tub_10 """
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', name)]
+
+
+def find_tubs(paths: List[str]) -> List[str]:
+    """
+    Tub paths of the given paths. A path which is not a tub but a folder of
+    tubs, like the data folder of a car, is replaced by the tubs in it in
+    natural order of their names.
+    """
+    tub_paths = []
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isdir(path) \
+                and not os.path.exists(os.path.join(path, 'manifest.json')):
+            tubs = [entry.path for entry in os.scandir(path) if entry.is_dir()
+                    and os.path.exists(os.path.join(entry.path,
+                                                    'manifest.json'))]
+            if tubs:
+                tub_paths.extend(sorted(tubs, key=_natural_key))
+                continue
+        tub_paths.append(path)
+    return tub_paths
+
+
 class TubDataset(object):
     """
-    Loads the dataset and creates a TubRecord list (or list of lists).
+    Loads the dataset and creates the TubRecords (or a Collator of them).
+    The manifests and indexes of the tubs are read concurrently on
+    TUB_LOAD_WORKERS threads, the tubs are merged in the order of the paths.
     """
 
     def __init__(self, config: Config, tub_paths: List[str],
                  seq_size: int = 0) -> None:
         self.config = config
-        self.tub_paths = tub_paths
-        self.tubs: List[Tub] = [Tub(tub_path, read_only=True)
-                                for tub_path in self.tub_paths]
-        self.records: List[TubRecord] = list()
+        self.tub_paths = find_tubs(tub_paths)
+        self.workers = getattr(config, 'TUB_LOAD_WORKERS', 4)
+        self.tubs: List[Tub] = self._map(
+            lambda path: Tub(path, read_only=True), self.tub_paths, 'Opened')
+        self.records: Optional[TubRecords] = None
         self.train_filter = getattr(config, 'TRAIN_FILTER', None)
         self.seq_size = seq_size
 
+    def _map(self, func: Callable, items: list, action: str) -> list:
+        """
+        Results of func for all items in the order of the items, computed
+        on the loader threads. Progress is logged as the tubs complete.
+        """
+        results = [None] * len(items)
+        if self.workers < 2 or len(items) < 2:
+            for i, item in enumerate(items):
+                results[i] = func(item)
+                logger.info(f'{action} {i + 1}/{len(items)} tubs')
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) \
+                as executor:
+            futures = {executor.submit(func, item): i
+                       for i, item in enumerate(items)}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                logger.info(f'{action} {done}/{len(items)} tubs')
+        return results
+
     def get_records(self):
-        if not self.records:
+        if self.records is None:
             logger.info(f'Loading tubs from paths {self.tub_paths}')
-            for tub in self.tubs:
-                for underlying in tub:
-                    record = TubRecord(self.config, tub.base_path, underlying)
-                    if not self.train_filter or self.train_filter(record):
-                        self.records.append(record)
+            self.records = TubRecords(
+                self.config, self._map(self._load_part, self.tubs, 'Indexed'))
             if self.seq_size > 0:
-                seq = Collator(self.seq_size, self.records)
-                self.records = list(seq)
+                self.records = Collator(self.seq_size, self.records)
         return self.records
 
+    def _load_part(self, tub: Tub) -> tuple:
+        """
+        Source and selected rows of a tub, see TubRecords. The columnar
+        index of the tub is used to filter whole columns at once where
+        possible, otherwise the train filter is applied to each record.
+        """
+        index = TubIndex.load(tub.base_path)
+        if not index.complete:
+            source = list(tub)
+            rows = np.arange(len(source))
+        else:
+            source = index
+            mask = index.mask(self.train_filter)
+            if mask is not None:
+                return tub.base_path, index, np.flatnonzero(mask)
+            rows = np.flatnonzero(index.alive)
+        if self.train_filter:
+            underlying = source.row if source is index else source.__getitem__
+            keep = np.fromiter(
+                (self.train_filter(TubRecord(self.config, tub.base_path,
+                                             underlying(row)))
+                 for row in rows), dtype=bool, count=len(rows))
+            rows = rows[keep]
+        return tub.base_path, source, rows
+
+
+def record_session(record) -> str:
+    """ Tub and session of a record, or of the last record of a sequence """
+    if isinstance(record, list):
+        record = record[-1]
+    return f"{record.base_path}:{record.underlying.get('_session_id', '')}"
+
+
+def record_sessions(records) -> Sequence[str]:
+    """ record_session of all records, from the index columns if possible """
+    if isinstance(records, TubRecords):
+        return records.sessions()
+    if isinstance(records, Collator) \
+            and isinstance(records.records, TubRecords):
+        return records.records.sessions()[records.starts
+                                          + records.seq_length - 1]
+    return [record_session(r) for r in records]
+
+
+def split_records(config: Config, records: List, shuffle: bool = True,
+                  seed: int = None) -> tuple:
+    """
+    Split records, or sequences of records, into training and validation
+    records as configured by TRAIN_TEST_SPLIT, TRAIN_SPLIT_STRATEGY and
+    TRAIN_SPLIT_BLOCK_SIZE. Sessions and blocks never extend over two tubs.
+    """
+    strategy = getattr(config, 'TRAIN_SPLIT_STRATEGY', 'random')
+    groups = record_sessions(records) if strategy != 'random' else None
+    train, val = split_indexes(
+        len(records), test_size=1. - config.TRAIN_TEST_SPLIT,
+        shuffle=shuffle, strategy=strategy, groups=groups,
+        block_size=getattr(config, 'TRAIN_SPLIT_BLOCK_SIZE', 200), seed=seed)
+    if isinstance(records, (Collator, TubRecords)):
+        return records.subset(train), records.subset(val)
+    return [records[i] for i in train], [records[i] for i in val]
 
-class Collator(Iterable[List[TubRecord]]):
-    """" Builds a sequence of continuous records for RNN and similar models. """
-    def __init__(self, seq_length: int, records: List[TubRecord]):
+
+class Collator(Sequence[List[TubRecord]]):
+    """
+    Builds sequences of continuous records for RNN and similar models.
+    The windows are found in one vectorised pass over the record indexes and
+    are kept as start positions into the record list, the record list of a
+    window is only created when it is accessed. Images are loaded lazily by
+    the records, so overlapping windows share the decoded frames through
+    the image cache.
+    """
+    def __init__(self, seq_length: int, records: List[TubRecord],
+                 starts: Optional[np.ndarray] = None):
         """
         :param seq_length:  length of sequence
         :param records:     input record list
+        :param starts:      start positions of the windows, found from the
+                            records if not given
         """
         self.records = records
         self.seq_length = seq_length
+        self.starts = self.window_starts(records, seq_length) \
+            if starts is None else starts
 
     @staticmethod
     def is_continuous(rec_1: TubRecord, rec_2: TubRecord) -> bool:
@@ -127,20 +384,51 @@ class Collator(Iterable[List[TubRecord]]):
                 and '__empty__' not in rec_2.underlying
         return it_is
 
-    def __iter__(self) -> Iterator[List[TubRecord]]:
-        """ Iterable interface. Returns a generator as Iterator. """
-        it = iter(self.records)
-        for this_record in it:
-            seq = [this_record]
-            seq_it = copy.copy(it)
-            for next_record in seq_it:
-                if self.is_continuous(this_record, next_record) and \
-                        len(seq) < self.seq_length:
-                    seq.append(next_record)
-                    this_record = next_record
-                else:
-                    break
-            if len(seq) == self.seq_length:
-                yield seq
+    @staticmethod
+    def window_starts(records: List[TubRecord], seq_length: int) \
+            -> np.ndarray:
+        """
+        Positions of all records which are followed by seq_length - 1
+        continuous records, see is_continuous.
+        """
+        n = len(records)
+        if seq_length < 1 or n < seq_length:
+            return np.zeros(0, dtype=np.int64)
+        if isinstance(records, TubRecords):
+            indexes = records.column('_index').astype(np.int64)
+            empty = records.has_key('__empty__')
+        else:
+            indexes = np.fromiter((r.underlying['_index'] for r in records),
+                                  dtype=np.int64, count=n)
+            empty = np.fromiter(('__empty__' in r.underlying
+                                 for r in records), dtype=bool, count=n)
+        continuous = (np.diff(indexes) == 1) & ~empty[:-1] & ~empty[1:]
+        # number of breaks before each record, a window has none inside
+        breaks = np.concatenate([[0], np.cumsum(~continuous)])
+        return np.flatnonzero(breaks[seq_length - 1:]
+                              == breaks[:n - seq_length + 1])
+
+    @property
+    def windows(self) -> np.ndarray:
+        """ Array of (start, length) of all windows """
+        return np.stack([self.starts,
+                         np.full(len(self.starts), self.seq_length)], axis=1)
+
+    def subset(self, positions: Sequence[int]) -> 'Collator':
+        """ Collator of the windows at the given positions """
+        return Collator(self.seq_length, self.records,
+                        self.starts[np.asarray(positions, dtype=np.int64)])
 
+    def __len__(self) -> int:
+        return len(self.starts)
 
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start = self.starts[i]
+        return self.records[start:start + self.seq_length]
+
+    def __iter__(self) -> Iterator[List[TubRecord]]:
+        """ Iterable interface. Returns a generator as Iterator. """
+        for start in self.starts:
+            yield self.records[start:start + self.seq_length]
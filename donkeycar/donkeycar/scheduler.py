@@ -0,0 +1,130 @@
+"""
+Scheduler that runs independent parts of the drive loop concurrently.
+
+The vehicle execution plan is split into stages using the inputs, outputs
+and run conditions each part declares. A part is placed after every earlier
+part it shares a channel with, if at least one of them writes that channel,
+so the result of a loop is the same as running the parts one after another
+in the order they were added. All parts of a stage run on a bounded thread
+pool, which pays off for parts that spend their time in OpenCV, TensorFlow
+or numpy calls that release the GIL. Outputs are written to memory after
+the whole stage finished, in the order the parts were added.
+
+Parts that keep a reference to the vehicle memory (like ExplodeDict) can
+write channels they did not declare, they are run as barriers on their own.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class StageScheduler:
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers,
+                                       thread_name_prefix='donkey_part')
+        self.stages = []
+        self.deps = []
+        self.critical_path = []
+        self.critical_path_time = 0.0
+        self.critical_path_total = 0.0
+        self.critical_path_count = 0
+
+    def compile(self, plan, mem):
+        """
+        Build the dependency graph of the plan and group it into stages.
+
+        :param plan:    execution plan as compiled by the vehicle
+        :param mem:     vehicle memory, used to detect barrier parts
+        :return:        list of stages, each a list of plan indices
+        """
+        reads = []
+        writes = []
+        barriers = []
+        for p, run, inputs, outputs, run_condition, optional in plan:
+            reads.append(set(inputs) | set(run_condition or []))
+            writes.append(set(outputs))
+            barriers.append(any(v is mem for v in vars(p).values())
+                            if hasattr(p, '__dict__') else False)
+
+        self.deps = []
+        level = []
+        for k in range(len(plan)):
+            deps = [i for i in range(k)
+                    if barriers[i] or barriers[k]
+                    or writes[i] & (reads[k] | writes[k])
+                    or reads[i] & writes[k]]
+            self.deps.append(deps)
+            level.append(max((level[i] + 1 for i in deps), default=0))
+
+        self.stages = [[] for _ in range(max(level, default=-1) + 1)]
+        for k, lvl in enumerate(level):
+            self.stages[lvl].append(k)
+        logger.info(f'Scheduled {len(plan)} parts in {len(self.stages)} '
+                    f'stages on {self.max_workers} workers')
+        return self.stages
+
+    def run(self, plan, mem, profiler, skip_optional=False):
+        """ Execute one loop of the plan stage by stage """
+        mem_get = mem.get_slots
+        mem_put = mem.put_slots
+
+        def run_step(step):
+            p, run, inputs, outputs, run_condition, optional = step
+            start = time.perf_counter()
+            profiler.on_part_start(p)
+            result = run(*mem_get(inputs)) if inputs else run()
+            profiler.on_part_finished(p)
+            return result, time.perf_counter() - start
+
+        durations = [0.0] * len(plan)
+        for stage in self.stages:
+            runnable = [k for k in stage
+                        if not (skip_optional and plan[k][5])
+                        and (plan[k][4] is None or mem_get(plan[k][4])[0])]
+            if len(runnable) == 1:
+                results = [run_step(plan[runnable[0]])]
+            else:
+                futures = [self.pool.submit(run_step, plan[k])
+                           for k in runnable]
+                results = [f.result() for f in futures]
+            for k, (result, duration) in zip(runnable, results):
+                if result is not None:
+                    mem_put(plan[k][3], result)
+                durations[k] = duration
+        self._update_critical_path(plan, durations)
+
+    def _update_critical_path(self, plan, durations):
+        finish = [0.0] * len(plan)
+        prev = [None] * len(plan)
+        for k, deps in enumerate(self.deps):
+            if deps:
+                i = max(deps, key=finish.__getitem__)
+                prev[k] = i
+                finish[k] = finish[i]
+            finish[k] += durations[k]
+        if not finish:
+            return
+        k = max(range(len(finish)), key=finish.__getitem__)
+        path = []
+        while k is not None:
+            if durations[k] > 0.0:
+                path.append(plan[k][0])
+            k = prev[k]
+        self.critical_path = path[::-1]
+        self.critical_path_time = max(finish)
+        self.critical_path_total += self.critical_path_time
+        self.critical_path_count += 1
+
+    def report(self):
+        if not self.critical_path_count:
+            return
+        avg = self.critical_path_total / self.critical_path_count
+        names = ' -> '.join(p.__class__.__name__ for p in self.critical_path)
+        logger.info(f'Critical path: avg {avg * 1000:.2f} ms, last '
+                    f'{self.critical_path_time * 1000:.2f} ms: {names}')
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
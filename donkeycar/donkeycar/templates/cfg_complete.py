@@ -23,6 +23,8 @@ MODELS_PATH = os.path.join(CAR_PATH, 'models')
 #VEHICLE
 DRIVE_LOOP_HZ = 20      # the vehicle loop will pause if faster than this speed.
 MAX_LOOPS = None        # the vehicle loop can abort after this many iterations, when given a positive integer.
+DRIVE_LOOP_WORKERS = 0  # when positive, independent parts of the vehicle loop run concurrently on this many threads.
+DRIVE_LOOP_OVERRUN_POLICY = None  # (None|'skip_optional'|'half_rate') what to do when the vehicle loop can not keep DRIVE_LOOP_HZ.
 
 #CAMERA
 CAMERA_TYPE = "PICAM"   # (PICAM|WEBCAM|CVCAM|CSIC|V4L|D435|MOCK|IMAGE_LIST)
@@ -368,8 +370,21 @@ DEFAULT_AI_FRAMEWORK = 'tensorflow'
 # tensorflow models: (linear|categorical|tflite_linear|tensorrt_linear)
 # pytorch models: (resnet18)
 DEFAULT_MODEL_TYPE = 'linear'
+MODEL_UINT8_INPUT = False       #new models take uint8 images and normalise them in a Rescaling layer, which saves the float conversion in training and in the drive loop
 BATCH_SIZE = 128                #how many records to use when doing one pass of gradient decent. Use a smaller number if your gpu is running out of memory.
+PREDICT_BATCH_SIZE = 256        #records per batch when 'donkey predict', tubplot and makemovie run a model over tubs, inference only needs no gradients so it can be larger than BATCH_SIZE
 TRAIN_TEST_SPLIT = 0.8          #what percent of records to use for training. the remaining used for validation.
+TRAIN_SPLIT_STRATEGY = 'random' #(random|session|block) 'session' keeps whole recording sessions, 'block' contiguous blocks of records in either training or validation, so near identical consecutive frames are not in both
+TRAIN_SPLIT_BLOCK_SIZE = 200     #records per block of the 'block' strategy, 200 records are 10s at 20Hz
+TRAIN_PIPELINE = 'parallel'     #(generator|parallel) 'parallel' loads, transforms and augments records on the tf.data thread pool, 'generator' uses a single python generator
+CACHE_IMAGES = True             #keep decoded images in memory during training, so they are only decoded in the first epoch
+IMAGE_CACHE_MB = 2048           #memory budget of the image cache, least recently used images are evicted when it is full
+IMAGE_CACHE_DISK_MB = 0         #if positive, images evicted from memory are kept decoded in a memory mapped file of this size
+IMAGE_CACHE_DISK_PATH = None    #file of the disk cache, defaults to a temporary file
+TUB_LOAD_WORKERS = 4            #tubs are opened and indexed on this many threads before training, helps most when the tubs are on slow or network storage. A folder of tubs is expanded to all tubs in it
+TRAIN_DATASET_CACHE = False     #train from images with TRANSFORMATIONS already applied, the cache is (re)built with 'donkey cachedata' or automatically when config or tubs changed
+DATASET_CACHE_PATH = os.path.join(CAR_PATH, 'dataset_cache')  #folder of the transformed images
+TORCH_NUM_WORKERS = 4           #worker processes loading and transforming images when training pytorch models, 0 loads them in the training process. Use 0 if loading fails on Mac or Windows
 MAX_EPOCHS = 100                #how many times to visit all records of your data
 SHOW_PLOT = True                #would you like to see a pop up display of final loss?
 VERBOSE_TRAIN = True            #would you like to see a progress bar with text during training?
@@ -383,6 +398,9 @@ LEARNING_RATE_DECAY = 0.0       #only used when OPTIMIZER specified
 SEND_BEST_MODEL_TO_PI = False   #change to true to automatically send best model during training
 CREATE_TF_LITE = True           # automatically create tflite model in training
 CREATE_TENSOR_RT = False        # automatically create tensorrt model in training
+TFLITE_FULL_INTEGER = False     # quantise the tflite model to uint8 inputs and outputs and integer operations, calibrated on validation images
+TFLITE_NUM_THREADS = None       # threads of the tflite interpreter when driving, None for the tflite default
+TFLITE_XNNPACK = True           # run the float operations of tflite models with the XNNPACK delegate
 
 PRUNE_CNN = False               #This will remove weights from your model. The primary goal is to increase performance.
 PRUNE_PERCENT_TARGET = 75       # The desired percentage of pruning.
@@ -491,6 +509,11 @@ POST_TRANSFORMATIONS = []  # transformations applied _after_ training augmentati
 # AUGMENTATIONS
 AUG_BRIGHTNESS_RANGE = 0.2  # this is interpreted as [-0.2, 0.2]
 AUG_BLUR_RANGE = (0, 3)
+# Settings for 'CUTOUT' in AUGMENTATIONS
+AUG_CUTOUT_HOLES = 8        # up to this many rectangles are filled
+AUG_CUTOUT_SIZE = 20        # maximum width and height of the rectangles in pixels
+AUG_CUTOUT_FILL = 255       # value the rectangles are filled with
+TRAIN_BATCH_AUGMENTATION = False  # apply AUGMENTATIONS to whole batches with vectorised tensorflow operations instead of to each image, not used with POST_TRANSFORMATIONS
 
 # "CROP" Transformation
 # Apply mask to borders of the image
@@ -634,12 +657,20 @@ TELEMETRY_LOGGING_LEVEL = 'INFO' # (Python logging level) 'NOTSET' / 'DEBUG' / '
 TELEMETRY_LOGGING_FORMAT = '%(message)s'  # (Python logging format - https://docs.python.org/3/library/logging.html#formatter-objects
 TELEMETRY_DEFAULT_INPUTS = 'pilot/angle,pilot/throttle,recording'
 TELEMETRY_DEFAULT_TYPES = 'float,float'
+TELEMETRY_PROFILE_ENABLE = False  # publish part timings (avg, max, percentiles in ms) of the vehicle loop
 
 # PERF MONITOR
 HAVE_PERFMON = False
 
 #RECORD OPTIONS
 RECORD_DURING_AI = False        #normally we do not record during ai mode. Set this to true to get image and steering records for your Ai. Be careful not to use them to train.
+RECORD_ASYNC = False            #write records in a background thread, so image encoding and disk writes do not block the vehicle loop
+RECORD_QUEUE_SIZE = 100         #maximum number of records waiting to be written when RECORD_ASYNC is True
+RECORD_QUEUE_POLICY = 'drop_oldest'  #(block|drop_oldest) what to do when the record queue is full
+RECORD_IMAGE_CODEC = 'pil'      #(pil|cv2|raw) how recorded images are stored, cv2 is usually faster on a Pi, raw stores uncompressed .ppm files
+RECORD_IMAGE_QUALITY = 75       #jpeg quality of recorded images for the pil and cv2 codecs
+RECORD_ENCODER_WORKERS = 0      #if positive, recorded images are encoded on this many threads
+RECORD_IMAGE_STORAGE = 'files'  #(files|frames) 'frames' appends images to one packed blob per catalog instead of one file per image, convert existing tubs with 'donkey tubpack'
 AUTO_CREATE_NEW_TUB = False     #create a new tub (tub_YY_MM_DD) directory when recording or append records to data directory directly
 
 #LED
@@ -728,6 +759,10 @@ AI_LAUNCH_KEEP_ENABLED = False      # when False ( default) you will need to hit
 
 #Scale the output of the throttle of the ai pilot for all model types.
 AI_THROTTLE_MULT = 1.0              # this multiplier will scale every throttle value for all output from NN models
+PILOT_ASYNC = False                 # run the pilot on its own thread, the drive loop keeps its rate and uses the latest prediction
+PILOT_MAX_AGE_MS = 200              # with PILOT_ASYNC, pilot steering and throttle are replaced by 0 when the latest prediction is older than this
+INFERENCE_MODELS = []               # further models run on every frame next to the pilot, e.g. to compare them, as (name, model type, model path) tuples. Their outputs go to '<name>/angle' and '<name>/throttle'
+INFERENCE_CONCURRENT = True         # invoke the pilot and the INFERENCE_MODELS concurrently on a thread pool
 
 #Path following
 PATH_FILENAME = "donkey_path.pkl"   # the path will be saved to this filename
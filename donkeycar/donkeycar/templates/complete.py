@@ -27,13 +27,14 @@ except:
 
 
 import donkeycar as dk
-from donkeycar.parts.transform import TriggeredCallback, DelayedTrigger
-from donkeycar.parts.tub_v2 import TubWriter
+from donkeycar.parts.tub_v2 import TubWriter, AsyncTubWriter
+from donkeycar.parts.image_codec import get_codec
 from donkeycar.parts.datastore import TubHandler
 from donkeycar.parts.controller import LocalWebController, WebFpv, JoystickController
 from donkeycar.parts.throttle_filter import ThrottleFilter
 from donkeycar.parts.behavior import BehaviorPart
 from donkeycar.parts.file_watcher import FileWatcher
+from donkeycar.parts.model_reloader import ModelReloader, ReloadablePilot
 from donkeycar.parts.launch import AiLaunch
 from donkeycar.parts.kinematics import NormalizeSteeringAngle, UnnormalizeSteeringAngle, TwoWheelSteeringThrottle
 from donkeycar.parts.kinematics import Unicycle, InverseUnicycle, UnicycleUnnormalizeAngularVelocity
@@ -73,7 +74,7 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
             model_type = cfg.DEFAULT_MODEL_TYPE
 
     # Initialize car
-    V = dk.vehicle.Vehicle()
+    V = dk.vehicle.Vehicle(max_workers=getattr(cfg, 'DRIVE_LOOP_WORKERS', 0))
 
     # Initialize logging before anything else to allow console logging
     if cfg.HAVE_CONSOLE_LOGGING:
@@ -122,7 +123,7 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
     if cfg.SHOW_FPS:
         from donkeycar.parts.fps import FrequencyLogger
         V.add(FrequencyLogger(cfg.FPS_DEBUG_INTERVAL),
-              outputs=["fps/current", "fps/fps_list"])
+              outputs=["fps/current", "fps/fps_list"], optional=True)
 
     #
     # add the user input controller(s)
@@ -271,7 +272,8 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
 
     # Use the FPV preview, which will show the cropped image output, or the full frame.
     if cfg.USE_FPV:
-        V.add(WebFpv(), inputs=['cam/image_array'], threaded=True)
+        V.add(WebFpv(), inputs=['cam/image_array'], threaded=True,
+              optional=True)
 
     def load_model(kl, model_path):
         start = time.time()
@@ -307,7 +309,10 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
     #
     if model_path:
         # If we have a model, create an appropriate Keras part
-        kl = dk.utils.get_model_by_type(model_type, cfg)
+        def create_pilot():
+            return dk.utils.get_model_by_type(model_type, cfg)
+
+        kl = create_pilot()
 
         #
         # get callback function to reload the model
@@ -319,8 +324,8 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
             # load the whole model with weigths, etc
             load_model(kl, model_path)
 
-            def reload_model(filename):
-                load_model(kl, filename)
+            def reload_model(pilot, filename):
+                load_model(pilot, filename)
 
             model_reload_cb = reload_model
 
@@ -332,9 +337,10 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
             weights_path = model_path.replace('.json', '.weights')
             load_weights(kl, weights_path)
 
-            def reload_weights(filename):
+            def reload_weights(pilot, filename):
+                load_model_json(pilot, filename)
                 weights_path = filename.replace('.json', '.weights')
-                load_weights(kl, weights_path)
+                load_weights(pilot, weights_path)
 
             model_reload_cb = reload_weights
 
@@ -346,14 +352,13 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
         V.add(FileWatcher(model_path, verbose=True),
               outputs=['modelfile/modified'])
 
-        # these parts will reload the model file, but only when ai is running
-        # so we don't interrupt user driving
-        V.add(FileWatcher(model_path), outputs=['modelfile/dirty'],
-              run_condition="run_pilot")
-        V.add(DelayedTrigger(100), inputs=['modelfile/dirty'],
-              outputs=['modelfile/reload'], run_condition="run_pilot")
-        V.add(TriggeredCallback(model_path, model_reload_cb),
-              inputs=["modelfile/reload"], run_condition="run_pilot")
+        # this part reloads the model file in the background and the new
+        # model takes over between two predictions, so neither user
+        # driving nor the autopilot are interrupted
+        kl = ReloadablePilot(kl)
+        V.add(ModelReloader(kl, create_pilot, model_reload_cb, model_path),
+              outputs=['modelfile/load_ms', 'modelfile/loaded'],
+              threaded=True)
 
         #
         # collect inputs to model for inference
@@ -412,7 +417,38 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
                   inputs=['cam/image_array'], outputs=['cam/image_array_trans'])
             inputs = ['cam/image_array_trans'] + inputs[1:]
 
-        V.add(kl, inputs=inputs, outputs=outputs, run_condition='run_pilot')
+        pilot = kl
+        if getattr(cfg, 'INFERENCE_MODELS', []):
+            #
+            # run further models on the same frame, e.g. to compare them to
+            # the pilot. They share the normalised image and are invoked
+            # concurrently, their outputs go to '<name>/angle' and
+            # '<name>/throttle'
+            #
+            from donkeycar.parts.inference_engine import InferenceEngine
+            pilot = InferenceEngine(
+                concurrent=getattr(cfg, 'INFERENCE_CONCURRENT', True))
+            pilot.add_model('pilot', kl, outputs,
+                            inputs[1] if len(inputs) > 1 else None)
+            for name, engine_model_type, engine_model_path \
+                    in cfg.INFERENCE_MODELS:
+                pilot.load_model(name, engine_model_type, engine_model_path,
+                                 cfg)
+            inputs = pilot.inputs(inputs[0])
+            outputs = pilot.outputs()
+
+        if getattr(cfg, 'PILOT_ASYNC', False):
+            #
+            # run inference on its own thread, the loop gets the latest
+            # prediction together with its age and frame id
+            #
+            from donkeycar.parts.async_pilot import AsyncPilot
+            V.add(AsyncPilot(pilot, len(outputs)), inputs=inputs,
+                  outputs=outputs + ['pilot/age_ms', 'pilot/frame_id'],
+                  run_condition='run_pilot', threaded=True)
+        else:
+            V.add(pilot, inputs=inputs, outputs=outputs,
+                  run_condition='run_pilot')
 
     #
     # stop at a stop sign
@@ -447,9 +483,15 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
     # Decide what inputs should change the car's steering and throttle
     # based on the choice of user or autopilot drive mode
     #
-    V.add(DriveMode(cfg.AI_THROTTLE_MULT),
+    # an asynchronous pilot reports the age of its predictions, the car
+    # stops when they get older than PILOT_MAX_AGE_MS
+    pilot_async = bool(model_path) and getattr(cfg, 'PILOT_ASYNC', False)
+    V.add(DriveMode(cfg.AI_THROTTLE_MULT,
+                    getattr(cfg, 'PILOT_MAX_AGE_MS', 200)
+                    if pilot_async else None),
           inputs=['user/mode', 'user/angle', 'user/throttle',
-                  'pilot/angle', 'pilot/throttle'],
+                  'pilot/angle', 'pilot/throttle']
+          + (['pilot/age_ms'] if pilot_async else []),
           outputs=['steering', 'throttle'])
 
 
@@ -539,22 +581,45 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
     tub_path = TubHandler(path=cfg.DATA_PATH).create_tub_path() if \
         cfg.AUTO_CREATE_NEW_TUB else cfg.DATA_PATH
     meta += getattr(cfg, 'METADATA', [])
-    tub_writer = TubWriter(tub_path, inputs=inputs, types=types, metadata=meta)
-    V.add(tub_writer, inputs=inputs, outputs=["tub/num_records"], run_condition='recording')
+    image_codec = get_codec(getattr(cfg, 'RECORD_IMAGE_CODEC', 'pil'),
+                            getattr(cfg, 'RECORD_IMAGE_QUALITY', 75))
+    encoder_workers = getattr(cfg, 'RECORD_ENCODER_WORKERS', 0)
+    image_storage = getattr(cfg, 'RECORD_IMAGE_STORAGE', 'files')
+    if getattr(cfg, 'RECORD_ASYNC', False):
+        tub_writer = AsyncTubWriter(tub_path, inputs=inputs, types=types,
+                                    metadata=meta,
+                                    queue_size=cfg.RECORD_QUEUE_SIZE,
+                                    policy=cfg.RECORD_QUEUE_POLICY,
+                                    image_codec=image_codec,
+                                    encoder_workers=encoder_workers,
+                                    image_storage=image_storage)
+        V.add(tub_writer, inputs=inputs,
+              outputs=["tub/num_records", "tub/write_queue_depth",
+                       "tub/write_latency_ms"],
+              run_condition='recording')
+    else:
+        tub_writer = TubWriter(tub_path, inputs=inputs, types=types, metadata=meta,
+                               image_codec=image_codec,
+                               encoder_workers=encoder_workers,
+                               image_storage=image_storage)
+        V.add(tub_writer, inputs=inputs, outputs=["tub/num_records"], run_condition='recording')
 
     # Telemetry (we add the same metrics added to the TubHandler
     if cfg.HAVE_MQTT_TELEMETRY:
         from donkeycar.parts.telemetry import MqttTelemetry
         tel = MqttTelemetry(cfg)
         telem_inputs, _ = tel.add_step_inputs(inputs, types)
+        if getattr(cfg, 'TELEMETRY_PROFILE_ENABLE', False):
+            tel.add_profiler(V.profiler)
         V.add(tel, inputs=telem_inputs, outputs=["tub/queue_size"], threaded=True)
 
     if cfg.PUB_CAMERA_IMAGES:
         from donkeycar.parts.network import TCPServeValue
         from donkeycar.parts.image import ImgArrToJpg
         pub = TCPServeValue("camera")
-        V.add(ImgArrToJpg(), inputs=['cam/image_array'], outputs=['jpg/bin'])
-        V.add(pub, inputs=['jpg/bin'])
+        V.add(ImgArrToJpg(), inputs=['cam/image_array'], outputs=['jpg/bin'],
+              optional=True)
+        V.add(pub, inputs=['jpg/bin'], optional=True)
 
 
     if cfg.DONKEY_GYM:
@@ -564,11 +629,12 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
     if has_input_controller:
         print("You can now move your controller to drive your car.")
         if isinstance(ctr, JoystickController):
-            ctr.set_tub(tub_writer.tub)
+            ctr.set_tub(tub_writer)
             ctr.print_controls()
 
     # run the vehicle
-    V.start(rate_hz=cfg.DRIVE_LOOP_HZ, max_loop_count=cfg.MAX_LOOPS)
+    V.start(rate_hz=cfg.DRIVE_LOOP_HZ, max_loop_count=cfg.MAX_LOOPS,
+            overrun_policy=getattr(cfg, 'DRIVE_LOOP_OVERRUN_POLICY', None))
 
 
 class ToggleRecording:
@@ -631,15 +697,20 @@ class ToggleRecording:
 
 
 class DriveMode:
-    def __init__(self, ai_throttle_mult=1.0):
+    def __init__(self, ai_throttle_mult=1.0, max_pilot_age_ms=None):
         """
         :param ai_throttle_mult: scale throttle in autopilot mode
+        :param max_pilot_age_ms: if given, pilot values which are older or
+                                 have no age are not used, the steering is
+                                 0.0 and the throttle the user throttle in
+                                 local_angle mode and 0.0 in autopilot
         """
         self.ai_throttle_mult = ai_throttle_mult
+        self.max_pilot_age_ms = max_pilot_age_ms
 
     def run(self, mode,
             user_steering, user_throttle,
-            pilot_steering, pilot_throttle):
+            pilot_steering, pilot_throttle, pilot_age_ms=None):
         """
         Main final steering and throttle values based on user mode
         :param mode: 'user'|'local_angle'|'local_pilot'
@@ -647,12 +718,21 @@ class DriveMode:
         :param user_throttle: throttle value in user (manual) mode
         :param pilot_steering: steering value in autopilot mode
         :param pilot_throttle: throttle value in autopilot mode
+        :param pilot_age_ms: age of the pilot values in milliseconds, see
+                             AsyncPilot
         :return: tuple of (steering, throttle) where throttle is
                  scaled by ai_throttle_mult in autopilot mode
         """
         if mode == 'user':
             return user_steering, user_throttle
-        elif mode == 'local_angle':
+        if self.max_pilot_age_ms is not None and \
+                (pilot_age_ms is None or pilot_age_ms > self.max_pilot_age_ms):
+            # fail safe on stale or missing predictions: straight ahead,
+            # the user keeps the throttle in local_angle, the autopilot stops
+            if mode == 'local_angle':
+                return 0.0, user_throttle
+            return 0.0, 0.0
+        if mode == 'local_angle':
             return pilot_steering if pilot_steering else 0.0, user_throttle
         return (pilot_steering if pilot_steering else 0.0,
                pilot_throttle * self.ai_throttle_mult if pilot_throttle else 0.0)
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+from donkeycar.parts.async_pilot import AsyncPilot
+
+
+class SlowPilot:
+    """ Pilot returning the frame it got, after a delay """
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.frames = []
+
+    def run(self, frame):
+        time.sleep(self.delay)
+        self.frames.append(frame)
+        return frame * 0.1, 0.5
+
+
+@pytest.fixture
+def pilot():
+    slow = SlowPilot()
+    part = AsyncPilot(slow, 2, poll_delay=0.01)
+    thread = threading.Thread(target=part.update, daemon=True)
+    thread.start()
+    yield part
+    part.shutdown()
+    thread.join(1)
+
+
+def test_latest_frame(pilot):
+    assert pilot.run_threaded(1) == (None, None, None, None)
+    # frames arriving much faster than the inference are dropped
+    for frame in range(2, 50):
+        angle, throttle, age_ms, frame_id = pilot.run_threaded(frame)
+        time.sleep(0.002)
+    time.sleep(0.15)
+    angle, throttle, age_ms, frame_id = pilot.run_threaded(50)
+    assert frame_id == 49
+    assert angle == pytest.approx(4.9) and throttle == 0.5
+    assert 50 < age_ms < 1000
+    frames = pilot.pilot.frames
+    assert frames == sorted(frames) and frames[-1] == 49
+    assert pilot.dropped > 0 and len(frames) < 49
+
+
+def test_failed_inference_ages(pilot):
+    pilot.run_threaded(1)
+    time.sleep(0.1)
+    pilot.pilot.run = lambda frame: 1 / 0
+    _, _, age_before, frame_id = pilot.run_threaded(2)
+    time.sleep(0.1)
+    _, _, age_after, frame_id_after = pilot.run_threaded(3)
+    assert frame_id_after == frame_id == 1
+    assert age_after > age_before
+
+
+def test_age_ignores_wall_clock(pilot, monkeypatch):
+    pilot.run_threaded(1)
+    time.sleep(0.1)
+    # the wall clock is set back, like at the first ntp sync of a pi
+    monkeypatch.setattr(time, 'time', lambda: 0.0)
+    pilot.pilot.run = lambda frame: 1 / 0
+    time.sleep(0.1)
+    _, _, age_ms, frame_id = pilot.run_threaded(2)
+    assert frame_id == 1
+    assert age_ms > 100
+
+
+class ShutdownPilot(SlowPilot):
+    def __init__(self, delay):
+        super().__init__(delay)
+        self.running = False
+        self.shut_down_while_running = None
+
+    def run(self, frame):
+        self.running = True
+        try:
+            return super().run(frame)
+        finally:
+            self.running = False
+
+    def shutdown(self):
+        self.shut_down_while_running = self.running
+
+
+def test_shutdown_waits_for_inference():
+    slow = ShutdownPilot(0.2)
+    part = AsyncPilot(slow, 2, poll_delay=0.01)
+    thread = threading.Thread(target=part.update, daemon=True)
+    thread.start()
+    part.run_threaded(1)
+    time.sleep(0.05)
+    part.shutdown()
+    assert slow.shut_down_while_running is False
+    thread.join(1)
+    assert not thread.is_alive()
+
+
+def test_synchronous_run():
+    part = AsyncPilot(SlowPilot(0), 2)
+    angle, throttle, age_ms, frame_id = part.run(10)
+    assert (angle, throttle, frame_id) == (1.0, 0.5, 1)
+    assert 0 <= age_ms < 100
+
+
+@pytest.mark.parametrize('mode, age, expected', [
+    ('user', 500, (0.3, 0.4)),
+    ('local_angle', 10, (0.5, 0.4)),
+    ('local_angle', 500, (0.0, 0.4)),
+    ('local_angle', None, (0.0, 0.4)),
+    ('local', 10, (0.5, 1.2)),
+    ('local', 500, (0.0, 0.0)),
+    ('local', None, (0.0, 0.0)),
+])
+def test_drive_mode_stale_pilot(mode, age, expected):
+    pytest.importorskip('docopt')
+    from donkeycar.templates.complete import DriveMode
+    drive_mode = DriveMode(ai_throttle_mult=2.0, max_pilot_age_ms=100)
+    assert drive_mode.run(mode, 0.3, 0.4, 0.5, 0.6, age) == \
+        pytest.approx(expected)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from donkeycar.config import Config
+from donkeycar.pipeline.batch_augmentations import BatchAugmentation
+
+
+def _augmentation(augmentations, prob=0.5, **kwargs):
+    cfg = Config()
+    cfg.AUGMENTATIONS = augmentations
+    for key, value in kwargs.items():
+        setattr(cfg, key, value)
+    return BatchAugmentation(cfg, 'AUGMENTATIONS', prob=prob, seed=0)
+
+
+@pytest.fixture
+def batch():
+    return np.random.randint(0, 255, (16, 120, 160, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize('augmentations', [[], ['BRIGHTNESS'], ['BLUR'],
+                                           ['CUTOUT'],
+                                           ['BRIGHTNESS', 'BLUR', 'CUTOUT']])
+def test_shape_and_identity(batch, augmentations):
+    out = _augmentation(augmentations).run(batch).numpy()
+    assert out.shape == batch.shape and out.dtype == np.uint8
+    untouched = _augmentation(augmentations, prob=0.0).run(batch).numpy()
+    np.testing.assert_array_equal(untouched, batch)
+
+
+def test_sequence_batch(batch):
+    sequences = batch.reshape((4, 4) + batch.shape[1:])
+    out = _augmentation(['BRIGHTNESS', 'CUTOUT']).run(sequences)
+    assert out.shape == sequences.shape
+
+
+def test_blur_matches_opencv(batch):
+    cv2 = pytest.importorskip('cv2')
+    sigma = 1.5
+    out = _augmentation(['BLUR'], prob=1.0,
+                        AUG_BLUR_RANGE=(sigma, sigma)).run(batch).numpy()
+    for img, blurred in zip(batch, out):
+        expected = cv2.GaussianBlur(img, (13, 13), sigma)
+        diff = np.abs(blurred.astype(int) - expected.astype(int))
+        assert diff.max() <= 1
+
+
+def test_cutout_fill(batch):
+    out = _augmentation(['CUTOUT'], prob=1.0, AUG_CUTOUT_FILL=7) \
+        .run(batch).numpy()
+    changed = out != batch
+    assert changed.any()
+    assert np.all(out[changed] == 7)
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from donkeycar.config import Config
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.types import TubDataset
+
+pytest.importorskip('cv2')
+from donkeycar.pipeline.dataset_cache import CachedTubRecord, DatasetCache
+from donkeycar.pipeline.image_cache import ImageProcessor
+from donkeycar.pipeline.types import TubRecord
+
+
+@pytest.fixture
+def config(tmpdir):
+    cfg = Config()
+    cfg.IMAGE_W, cfg.IMAGE_H, cfg.IMAGE_DEPTH = 160, 120, 3
+    cfg.DATA_PATH = str(tmpdir.join('data'))
+    cfg.DATASET_CACHE_PATH = str(tmpdir.join('cache'))
+    cfg.TRANSFORMATIONS = ['CROP']
+    cfg.ROI_CROP_LEFT, cfg.ROI_CROP_RIGHT = 0, 0
+    cfg.ROI_CROP_TOP, cfg.ROI_CROP_BOTTOM = 40, 0
+    return cfg
+
+
+def _write(path, count):
+    tub = Tub(path, ['cam/image_array', 'user/angle', 'user/throttle'],
+              ['image_array', 'float', 'float'])
+    for i in range(count):
+        tub.write_record({'cam/image_array': np.full((120, 160, 3), i * 10,
+                                                     dtype=np.uint8),
+                          'user/angle': 0.1 * i, 'user/throttle': 0.5})
+    tub.close()
+
+
+def test_dataset_cache(config, tmpdir):
+    tub_path = str(tmpdir.join('data'))
+    _write(tub_path, 5)
+    assert DatasetCache.open(config, [tub_path]) is None
+    cache = DatasetCache.ensure(config, [tub_path])
+    assert len(cache) == 5
+    records = TubDataset(config, [tub_path]).get_records()
+    wrapped = cache.wrap(records)
+    assert all(isinstance(r, CachedTubRecord) for r in wrapped)
+    # crop masks the top rows
+    img = wrapped[3].image()
+    assert img.shape == (120, 160, 3)
+    assert img[0, 0, 0] == 0 and img[-1, 0, 0] == 30
+    expected = records[3].image().copy()
+    expected[:40] = 0
+    np.testing.assert_array_equal(img, expected)
+    # same config and tubs reuse the cache
+    assert DatasetCache.open(config, [tub_path]).path == cache.path
+    # changed config or tubs do not
+    config.ROI_CROP_TOP = 20
+    assert DatasetCache.open(config, [tub_path]) is None
+    config.ROI_CROP_TOP = 40
+    _write(tub_path, 1)
+    assert DatasetCache.open(config, [tub_path]) is None
+    assert len(DatasetCache.ensure(config, [tub_path])) == 6
+
+
+def test_records_missing_in_cache_are_transformed(config, tmpdir):
+    tub_path = str(tmpdir.join('data'))
+    _write(tub_path, 3)
+    cache = DatasetCache.ensure(config, [tub_path])
+    # records added after the cache was built are not in the cache
+    _write(tub_path, 2)
+    records = TubDataset(config, [tub_path]).get_records()
+    wrapped = cache.wrap(records)
+    assert [isinstance(r, CachedTubRecord) for r in wrapped] == \
+        [True] * 3 + [False] * 2
+
+    def crop(img):
+        img = img.copy()
+        img[:40] = 0
+        return img
+
+    processor = ImageProcessor(crop, lambda img: img + 1)
+    for record in wrapped:
+        img = record.image(processor=processor)
+        # transformed once, by the cache or the processor, then augmented
+        assert img[0, 0, 0] == 1
+        assert img[-1, 0, 0] == record.image()[-1, 0, 0] + 1
+    assert type(wrapped[4]) is TubRecord
@@ -5,7 +5,7 @@ import time
 import unittest
 from pathlib import Path
 
-from donkeycar.parts.datastore_v2 import Manifest
+from donkeycar.parts.datastore_v2 import Manifest, CHECKPOINT_INTERVAL
 
 
 class TestDatastore(unittest.TestCase):
@@ -82,6 +82,29 @@ class TestDatastore(unittest.TestCase):
 
         self.assertEqual(10, read_records)
 
+    def test_recover_records_after_last_checkpoint(self):
+        manifest = Manifest(self._path)
+        count = CHECKPOINT_INTERVAL + 10
+        for i in range(count):
+            manifest.write_record(self._newRecord())
+        # manifests are only written at checkpoints
+        self.assertEqual(CHECKPOINT_INTERVAL,
+                         manifest.catalog_metadata['current_index'])
+        self.assertEqual(CHECKPOINT_INTERVAL, len(
+            manifest.current_catalog.manifest.line_lengths()))
+        # simulate a crash by not closing the manifest
+        manifest_2 = Manifest(self._path, read_only=True)
+        self.assertEqual(count, len(manifest_2))
+        self.assertEqual(count, len(list(manifest_2)))
+        manifest_2.close()
+        manifest.close()
+
+        manifest_3 = Manifest(self._path)
+        self.assertEqual(count, manifest_3.current_index)
+        manifest_3.write_record(self._newRecord())
+        self.assertEqual(count + 1, len(list(manifest_3)))
+        manifest_3.close()
+
     def tearDown(self):
         shutil.rmtree(self._path)
 
@@ -0,0 +1,129 @@
+import json
+import os
+
+import numpy as np
+
+from donkeycar.config import Config
+from donkeycar.parts import frame_store
+from donkeycar.parts.frame_store import FrameReader, is_frame_ref, \
+    pack_tub, read_frame, unpack_tub
+from donkeycar.parts.image_codec import get_codec
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.types import TubRecord
+
+
+def _config():
+    cfg = Config()
+    cfg.IMAGE_W = 160
+    cfg.IMAGE_H = 120
+    cfg.IMAGE_DEPTH = 3
+    return cfg
+
+
+def _write_tub(path, count, image_storage):
+    tub = Tub(path, ['cam/image_array', 'user/angle'],
+              ['image_array', 'float'], max_catalog_len=4,
+              image_codec=get_codec('raw'), image_storage=image_storage)
+    images = [np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+              for _ in range(count)]
+    for i, img in enumerate(images):
+        tub.write_record({'cam/image_array': img, 'user/angle': i / count})
+    tub.close()
+    return images
+
+
+def _read_images(path):
+    cfg = _config()
+    tub = Tub(path, read_only=True)
+    records = list(tub)
+    tub.close()
+    return records, [TubRecord(cfg, path, r).image() for r in records]
+
+
+def test_write_frames(tmpdir):
+    path = str(tmpdir)
+    images = _write_tub(path, 10, 'frames')
+    records, loaded = _read_images(path)
+    assert len(records) == len(images)
+    assert all(is_frame_ref(r['cam/image_array']) for r in records)
+    # one blob per catalog
+    assert records[5]['cam/image_array'].startswith('catalog_1.frames')
+    assert os.listdir(os.path.join(path, Tub.images())) == []
+    for img, img_loaded in zip(images, loaded):
+        np.testing.assert_array_equal(img, img_loaded)
+
+
+def test_frames_written_before_catalog(tmpdir):
+    path = str(tmpdir)
+    tub = Tub(path, ['cam/image_array'], ['image_array'],
+              image_codec=get_codec('pil'), image_storage='frames')
+    img = np.zeros((16, 16, 3), dtype=np.uint8)
+    for flush in (True, False):
+        tub.write_record({'cam/image_array': img}, flush=flush)
+        # the catalog line may be on disk, so the frame has to be as well
+        ref = tub.frame_writer.count - 1
+        reader = FrameReader(tub.frame_writer.blob_path)
+        assert len(reader) == ref + 1
+        assert bytes(reader.frame(ref))[:2] == b'\xff\xd8'
+    tub.close()
+
+
+def test_pack_unpack(tmpdir):
+    path = str(tmpdir)
+    images = _write_tub(path, 10, 'files')
+    assert pack_tub(path, delete_images=True) == len(images)
+    records, loaded = _read_images(path)
+    assert all(is_frame_ref(r['cam/image_array']) for r in records)
+    assert os.listdir(os.path.join(path, Tub.images())) == []
+    for img, img_loaded in zip(images, loaded):
+        np.testing.assert_array_equal(img, img_loaded)
+
+    # appending to a packed tub continues the frame blob
+    tub = Tub(path, ['cam/image_array', 'user/angle'],
+              ['image_array', 'float'], image_codec=get_codec('raw'),
+              image_storage='frames')
+    tub.write_record({'cam/image_array': images[0], 'user/angle': 0.0})
+    tub.close()
+    assert unpack_tub(path, delete_frames=True) == len(images) + 1
+    records, loaded = _read_images(path)
+    assert not any(is_frame_ref(r['cam/image_array']) for r in records)
+    assert not any(f.endswith('.frames') for f in os.listdir(path))
+    for img, img_loaded in zip(images + images[:1], loaded):
+        np.testing.assert_array_equal(img, img_loaded)
+
+
+def test_pack_writes_frames_before_catalog(tmpdir, monkeypatch):
+    path = str(tmpdir)
+    _write_tub(path, 10, 'files')
+    replace = os.replace
+    checked = []
+
+    def checking_replace(src, dst):
+        # all frames the new catalog points at have to be on disk already
+        if dst.endswith('.catalog'):
+            with open(src) as f:
+                for line in f:
+                    ref = json.loads(line)['cam/image_array']
+                    name, number = ref.rsplit('#', 1)
+                    reader = FrameReader(os.path.join(path, name))
+                    assert len(reader.frame(int(number))) > 0
+                    checked.append(ref)
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', checking_replace)
+    pack_tub(path)
+    assert len(checked) == 10
+
+
+def test_unpack_keeps_readers_of_other_tubs(tmpdir):
+    paths = [str(tmpdir.join(name)) for name in ('tub_1', 'tub_10')]
+    refs = []
+    for path in paths:
+        _write_tub(path, 2, 'frames')
+        records, _ = _read_images(path)
+        refs.append(records[0]['cam/image_array'])
+        read_frame(path, refs[-1])
+    unpack_tub(paths[0])
+    blobs = [os.path.dirname(p) for p in frame_store._readers]
+    assert paths[0] not in blobs
+    assert paths[1] in blobs
@@ -0,0 +1,55 @@
+import random
+import unittest
+
+from donkeycar.utilities.histogram import Histogram
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        h = Histogram()
+        self.assertEqual(0, h.count)
+        self.assertEqual([0, 0], h.percentiles([50, 99]))
+        self.assertEqual(0.0, h.mean())
+
+    def test_exact_small_values(self):
+        h = Histogram(precision_bits=6)
+        for v in range(1, 11):
+            h.record(v)
+        self.assertEqual(5, h.percentile(50))
+        self.assertEqual(10, h.percentile(100))
+        self.assertEqual(1, h.min)
+        self.assertEqual(5.5, h.mean())
+
+    def test_relative_error_is_bounded(self):
+        h = Histogram(precision_bits=7)
+        values = [random.randint(0, 5_000_000) for _ in range(10000)]
+        for v in values:
+            h.record(v)
+        values.sort()
+        for q in (50, 90, 99):
+            exact = values[int(len(values) * q / 100) - 1]
+            self.assertLessEqual(abs(h.percentile(q) - exact),
+                                 exact / 64 + 1)
+
+    def test_bucket_bounds(self):
+        h = Histogram(precision_bits=4)
+        for v in range(0, 100000, 7):
+            self.assertLessEqual(v, h._value(h._index(v)))
+            self.assertGreater(v, h._value(h._index(v) - 1))
+
+    def test_clamps_values(self):
+        h = Histogram(max_value=1000)
+        h.record(-5)
+        h.record(10**9)
+        self.assertEqual(0, h.min)
+        self.assertEqual(1000, h.max)
+        self.assertEqual(1000, h.percentile(100))
+
+    def test_reset(self):
+        h = Histogram()
+        h.record(42)
+        h.reset()
+        self.assertEqual(0, h.count)
+        self.assertEqual({'count': 0, 'min': 0, 'max': 0, 'mean': 0.0,
+                          'p50': 0}, h.snapshot([50]))
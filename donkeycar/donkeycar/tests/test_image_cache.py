@@ -0,0 +1,170 @@
+import numpy as np
+import pytest
+
+from donkeycar.config import Config
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.image_cache import DiskImageCache, ImageCache, \
+    ImageProcessor, get_image_cache, reset_image_cache
+from donkeycar.pipeline.types import TubRecord
+
+
+def _image(value):
+    return np.full((10, 10, 3), value, dtype=np.uint8)
+
+
+def test_lru_eviction():
+    cache = ImageCache(max_bytes=3 * 300)
+    for i in range(3):
+        cache.put(i, _image(i))
+    # 0 becomes most recently used, so 1 is evicted next
+    assert cache.get(0) is not None
+    cache.put(3, _image(3))
+    assert cache.get(1) is None
+    assert [cache.get(i)[0, 0, 0] for i in (0, 2, 3)] == [0, 2, 3]
+    stats = cache.stats()
+    assert stats['bytes'] <= 900
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 4 and stats['misses'] == 1
+    with pytest.raises(ValueError):
+        cache.get(0)[0, 0, 0] = 1
+
+
+def test_uncached_images_stay_writeable():
+    cache = ImageCache(max_bytes=300)
+    too_large = np.zeros((20, 20, 3), dtype=np.uint8)
+    cache.put('large', too_large)
+    assert too_large.flags.writeable and cache.get('large') is None
+    cache.put(0, _image(0))
+    duplicate = _image(1)
+    cache.put(0, duplicate)
+    assert duplicate.flags.writeable and cache.get(0)[0, 0, 0] == 0
+
+
+def test_disk_tier(tmpdir):
+    disk = DiskImageCache(str(tmpdir.join('cache')), max_bytes=10 * 300)
+    cache = ImageCache(max_bytes=300, disk=disk)
+    for i in range(4):
+        cache.put(i, _image(i))
+    assert len(cache) == 1
+    for i in range(4):
+        np.testing.assert_array_equal(cache.get(i), _image(i))
+    assert cache.stats()['disk_hits'] == 3
+    cache.close()
+
+
+def test_tub_record_cache(tmpdir):
+    cfg = Config()
+    cfg.IMAGE_W, cfg.IMAGE_H, cfg.IMAGE_DEPTH = 160, 120, 3
+    cfg.IMAGE_CACHE_MB = 1
+    tub = Tub(str(tmpdir), ['cam/image_array'], ['image_array'])
+    tub.write_record({'cam/image_array': np.zeros((120, 160, 3), np.uint8)})
+    tub.close()
+    underlying = next(iter(Tub(str(tmpdir), read_only=True)))
+    cache = get_image_cache(cfg)
+    cache.clear()
+    # records of both splits share the cache
+    train, val = (TubRecord(cfg, str(tmpdir), underlying) for _ in range(2))
+    calls = []
+
+    def processor(img):
+        calls.append(1)
+        return img + 1
+
+    assert train.image(processor=processor)[0, 0, 0] == 1
+    assert val.image(processor=processor)[0, 0, 0] == 1
+    # decoded once, processed on each call
+    assert cache.stats()['entries'] == 1
+    assert len(calls) == 2
+    processor.cache_key = 'plus_one'
+    train.image(processor=processor)
+    val.image(processor=processor)
+    assert len(calls) == 3
+    assert cache.stats()['entries'] == 2
+    cfg.CACHE_IMAGES = False
+    assert get_image_cache(cfg) is None
+
+
+def test_tub_record_caches_transformation(tmpdir):
+    pytest.importorskip('cv2')
+    from donkeycar.parts.image_transformations import ImageTransformations, \
+        transformation_cache_key
+    cfg = Config()
+    cfg.IMAGE_W, cfg.IMAGE_H, cfg.IMAGE_DEPTH = 160, 120, 3
+    cfg.IMAGE_CACHE_MB = 1
+    cfg.TRANSFORMATIONS = ['CROP']
+    cfg.ROI_CROP_LEFT, cfg.ROI_CROP_RIGHT = 0, 0
+    cfg.ROI_CROP_TOP, cfg.ROI_CROP_BOTTOM = 40, 0
+    tub = Tub(str(tmpdir), ['cam/image_array'], ['image_array'])
+    tub.write_record({'cam/image_array': np.full((120, 160, 3), 7, np.uint8)})
+    tub.close()
+    underlying = next(iter(Tub(str(tmpdir), read_only=True)))
+    cache = get_image_cache(cfg)
+    cache.clear()
+    transformation = ImageTransformations(cfg, 'TRANSFORMATIONS')
+    calls = dict(transform=0, augment=0)
+
+    def transform(img):
+        calls['transform'] += 1
+        return transformation.run(img)
+
+    def augment(img):
+        calls['augment'] += 1
+        img += 1
+        return img
+
+    processor = ImageProcessor(transform, augment,
+                               transformation_cache_key(cfg))
+    train, val = (TubRecord(cfg, str(tmpdir), underlying) for _ in range(2))
+    for record in (train, val, train):
+        img = record.image(processor=processor)
+        assert img[0, 0, 0] == 1 and img[-1, 0, 0] == 8
+    # transformed once, augmented on each call
+    assert calls == dict(transform=1, augment=3)
+    key = (str(tmpdir), underlying['cam/image_array'], 160, 120, 3,
+           transformation_cache_key(cfg))
+    assert cache.get(key)[-1, 0, 0] == 7
+    # other transformation settings are cached under another key
+    cfg.ROI_CROP_TOP = 20
+    processor.cache_key = transformation_cache_key(cfg)
+    train.image(processor=processor)
+    assert calls['transform'] == 2
+
+
+def test_tub_record_in_place_processor(tmpdir):
+    cfg = Config()
+    cfg.IMAGE_W, cfg.IMAGE_H, cfg.IMAGE_DEPTH = 160, 120, 3
+    cfg.IMAGE_CACHE_MB = 1
+    tub = Tub(str(tmpdir), ['cam/image_array'], ['image_array'])
+    tub.write_record({'cam/image_array': np.zeros((120, 160, 3), np.uint8)})
+    tub.close()
+    underlying = next(iter(Tub(str(tmpdir), read_only=True)))
+    get_image_cache(cfg).clear()
+    record = TubRecord(cfg, str(tmpdir), underlying)
+
+    def mask(img):
+        img[:40] = 255
+        return img
+
+    # the cached decoded image is not changed by the processor
+    for _ in range(2):
+        img = record.image(processor=mask)
+        assert img[0, 0, 0] == 255 and img[-1, 0, 0] == 0
+    img = record.image()
+    assert img[0, 0, 0] == 0
+    img[0, 0, 0] = 1
+    assert record.image()[0, 0, 0] == 0
+
+
+def test_reset_image_cache(tmpdir):
+    cfg = Config()
+    cfg.IMAGE_CACHE_MB = 1
+    cfg.IMAGE_CACHE_DISK_MB = 1
+    cfg.IMAGE_CACHE_DISK_PATH = str(tmpdir.join('cache'))
+    cache = get_image_cache(cfg)
+    reset_image_cache()
+    # a new cache is created, the old one and its file are left alone
+    cfg.IMAGE_CACHE_DISK_PATH = None
+    new_cache = get_image_cache(cfg)
+    assert new_cache is not cache
+    new_cache.close()
+    assert cache.disk is not None and tmpdir.join('cache').exists()
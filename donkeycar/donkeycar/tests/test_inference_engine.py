@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+from pytest import approx
+
+from donkeycar.parts.inference_engine import InferenceEngine
+from donkeycar.parts.interpreter import TfLite, keras_to_tflite
+from donkeycar.parts.keras import KerasLinear, KerasCategorical, KerasIMU, \
+    KerasLSTM
+from donkeycar.parts.model_reloader import ReloadablePilot
+from donkeycar.utils import get_test_img
+
+TOLERANCE = 1e-4
+
+
+class CountingTransformation:
+    def __init__(self):
+        self.count = 0
+
+    def run(self, img):
+        self.count += 1
+        return img
+
+
+@pytest.fixture(scope='module')
+def pilots(tmp_path_factory):
+    linear = KerasLinear()
+    path = str(tmp_path_factory.mktemp('engine') / 'linear.tflite')
+    keras_to_tflite(linear.interpreter.model, path)
+    tflite = KerasLinear(interpreter=TfLite())
+    tflite.load(path)
+    return {'linear': linear, 'categorical': KerasCategorical(),
+            'tflite': tflite, 'imu': KerasIMU(), 'lstm': KerasLSTM()}
+
+
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_engine_outputs(pilots, concurrent):
+    engine = InferenceEngine(concurrent=concurrent)
+    engine.transformation = CountingTransformation()
+    for name, pilot in pilots.items():
+        engine.add_model(name, pilot, [f'{name}/angle', f'{name}/throttle'],
+                         'imu_array' if name == 'imu' else None)
+    assert engine.inputs() == ['cam/image_array', 'imu_array']
+    assert engine.outputs()[:4] == ['linear/angle', 'linear/throttle',
+                                    'categorical/angle',
+                                    'categorical/throttle']
+    img = get_test_img(pilots['linear'])
+    imu = np.random.rand(6).tolist()
+    pilots['linear']._norm_buffer = None
+    for _ in range(3):
+        outputs = engine.run(img, imu)
+    assert engine.transformation.count == 3
+    # the engine normalises the image for the models, only the lstm model
+    # keeping a sequence of images normalises itself
+    assert pilots['linear']._norm_buffer is None
+    assert pilots['tflite'].raw_image_input
+    expected = []
+    for name, pilot in pilots.items():
+        expected += pilot.run(img, imu) if name == 'imu' else pilot.run(img)
+    assert outputs == approx(tuple(expected), rel=TOLERANCE, abs=TOLERANCE)
+    stats = engine.stats()
+    assert set(stats) == {'preprocessing'} | set(pilots)
+    assert stats['lstm']['count'] == 3 and stats['lstm']['max_ms'] > 0
+
+
+def test_engine_swaps_reloaded_pilot(pilots):
+    first, second = KerasLinear(), KerasLinear()
+    reloadable = ReloadablePilot(first)
+    engine = InferenceEngine(concurrent=False)
+    engine.add_model('pilot', reloadable, ['pilot/angle', 'pilot/throttle'])
+    img = get_test_img(first)
+    assert engine.run(img) == approx(first.run(img), abs=TOLERANCE)
+    reloadable.put(second)
+    assert engine.run(img) == approx(second.run(img), abs=TOLERANCE)
+    assert reloadable.swaps == 1
+
+
+def test_engine_load_model(tmp_path):
+    from donkeycar.config import Config
+    cfg = Config()
+    cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH = 120, 160, 3
+    path = os.path.join(tmp_path, 'model.h5')
+    KerasLinear().interpreter.model.save(path)
+    engine = InferenceEngine(cfg).load_model('b', 'linear', path, cfg)
+    assert engine.outputs() == ['b/angle', 'b/throttle']
+    assert len(engine.run(np.zeros((120, 160, 3), dtype=np.uint8))) == 2
@@ -8,7 +8,7 @@ import os
 from donkeycar.parts.interpreter import keras_to_tflite, \
     saved_model_to_tensor_rt, TfLite, TensorRT
 from donkeycar.parts.keras import *
-from donkeycar.utils import get_test_img
+from donkeycar.utils import get_test_img, normalize_image
 
 TOLERANCE = 1e-4
 
@@ -90,3 +90,92 @@ def test_keras_vs_tflite_and_tensorrt(keras_pilot, tmp_dir):
 
 
 
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasCategorical,
+                                         KerasIMU, KerasBehavioral])
+def test_fold_normalization(keras_pilot, tmp_dir):
+    km = keras_pilot(interpreter=KerasInterpreter())
+    img = get_test_img(km)
+    args = (img, )
+    if keras_pilot is KerasIMU:
+        args = (img, np.random.rand(6).tolist())
+    elif keras_pilot is KerasBehavioral:
+        args = (img, [1.0, 0.0])
+    out1 = km.run(*args)
+
+    km.fold_normalization()
+    assert km.uint8_input
+    assert km.output_types()[0]['img_in'] == tf.uint8
+    assert km.run(*args) == approx(out1, rel=TOLERANCE, abs=TOLERANCE)
+
+    # uint8 input is detected when loading the keras and tflite models
+    model_path = os.path.join(tmp_dir, 'model.h5')
+    km.interpreter.model.save(model_path)
+    kk = keras_pilot(interpreter=KerasInterpreter())
+    kk.load(model_path)
+    assert kk.uint8_input
+    assert kk.run(*args) == approx(out1, rel=TOLERANCE, abs=TOLERANCE)
+    tflite_path = os.path.join(tmp_dir, 'model.tflite')
+    keras_to_tflite(km.interpreter.model, tflite_path)
+    kl = keras_pilot(interpreter=TfLite())
+    kl.load(tflite_path)
+    assert kl.uint8_input
+    assert kl.run(*args) == approx(out1, rel=TOLERANCE, abs=TOLERANCE)
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasCategorical,
+                                         KerasIMU, KerasLSTM])
+@pytest.mark.parametrize('num_threads, use_xnnpack', [(None, True),
+                                                      (2, False)])
+def test_tflite_normalises_images(keras_pilot, num_threads, use_xnnpack,
+                                  tmp_dir):
+    km = keras_pilot(interpreter=KerasInterpreter())
+    tflite_path = os.path.join(tmp_dir, 'model.tflite')
+    keras_to_tflite(km.interpreter.model, tflite_path)
+    kl = keras_pilot(interpreter=TfLite(num_threads, use_xnnpack))
+    kl.load(tflite_path)
+    # the uint8 image is normalised by the interpreter, not by the pilot
+    assert kl.raw_image_input and not kl.uint8_input
+    img = get_test_img(km)
+    assert kl.normalize(img) is img
+    args = (img, np.random.rand(6).tolist()) \
+        if keras_pilot is KerasIMU else (img, )
+    for _ in range(3):
+        out = kl.run(*args)
+        assert out == approx(km.run(*args), rel=TOLERANCE, abs=TOLERANCE)
+    if keras_pilot is not KerasLSTM:
+        # normalised images are taken as well
+        other = np.array(args[1]) if len(args) > 1 else None
+        assert kl.inference(normalize_image(img), other) \
+               == approx(out, rel=TOLERANCE, abs=TOLERANCE)
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasIMU])
+def test_tflite_full_integer(keras_pilot, tmp_dir):
+    km = keras_pilot(interpreter=KerasInterpreter())
+    img = get_test_img(km)
+    imu = np.random.rand(6).astype(np.float32)
+
+    def data_gen():
+        # random images cover [0, 1], the quantisation step becomes 1/255,
+        # the test image calibrates the range of the outputs
+        for i in range(10):
+            image = normalize_image(img) if i % 2 else \
+                np.random.rand(*img.shape).astype(np.float32)
+            inputs = {'img_in': image[np.newaxis]}
+            if keras_pilot is KerasIMU:
+                inputs['imu_in'] = imu[np.newaxis]
+            yield inputs
+
+    tflite_path = os.path.join(tmp_dir, 'model.tflite')
+    keras_to_tflite(km.interpreter.model, tflite_path, data_gen)
+    kl = keras_pilot(interpreter=TfLite())
+    kl.load(tflite_path)
+    # the quantised image input takes the uint8 image as it is
+    assert kl.uint8_input
+    assert TfLite.raw_image(kl.interpreter.input_details[0])
+    args = (img, imu.tolist()) if keras_pilot is KerasIMU else (img, )
+    out = kl.run(*args)
+    assert all(isinstance(o, np.floating) for o in out)
+    assert out == approx(km.run(*args), abs=0.05)
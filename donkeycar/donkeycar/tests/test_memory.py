@@ -66,3 +66,30 @@ class TestMemory(unittest.TestCase):
         mem.put(['myitem'], 888)
         
         assert dict(mem.items()) == {'myitem': 888}
+
+    def test_slots_are_interned(self):
+        mem = Memory()
+        slots = mem.slots(['myitem1', 'myitem2'])
+        assert mem.slots(['myitem2', 'myitem1']) == slots[::-1]
+        assert list(mem.keys()) == []
+        assert mem.get(['myitem1']) == [None]
+
+    def test_put_get_slots(self):
+        mem = Memory()
+        slots = mem.slots(['my1stitem', 'my2nditem'])
+        mem.put_slots(slots, (777, '999'))
+        assert mem.get_slots(slots) == [777, '999']
+        assert mem['my2nditem'] == '999'
+
+    def test_put_slots_raises_on_missing_value(self):
+        mem = Memory()
+        slots = mem.slots(['my1stitem', 'my2nditem'])
+        with pytest.raises(IndexError):
+            mem.put_slots(slots, [777])
+
+    def test_float_keys(self):
+        mem = Memory(float_keys=['user/angle'])
+        mem.put(['user/angle', 'user/mode'], [0.5, 'user'])
+        assert mem.get(['user/angle', 'user/mode']) == [0.5, 'user']
+        assert list(mem.float_buffer()) == [0.5]
+        assert dict(mem.items()) == {'user/angle': 0.5, 'user/mode': 'user'}
@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+
+import pytest
+
+from donkeycar.parts.async_pilot import AsyncPilot
+from donkeycar.parts.keras import KerasLinear, KerasIMU, KerasLSTM
+from donkeycar.parts.model_reloader import ModelReloader, ReloadablePilot, \
+    warm_up
+
+
+class FilePilot:
+    """ Pilot predicting the content of the model file it loaded """
+    input_shape = (12, 16, 3)
+
+    def __init__(self, load_delay=0.0):
+        self.load_delay = load_delay
+        self.version = None
+        self.warm = False
+
+    def load(self, path):
+        time.sleep(self.load_delay)
+        with open(path) as f:
+            self.version = int(f.read())
+
+    def run(self, img):
+        self.warm = True
+        return self.version, 0.0
+
+
+def write_model(path, version):
+    with open(path, 'w') as f:
+        f.write(str(version))
+    # make sure the modification time changes on coarse file systems
+    t = time.time() + version
+    os.utime(path, (t, t))
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    path = str(tmp_path / 'model.h5')
+    write_model(path, 1)
+    return path
+
+
+def create_reloader(model_path, load_delay=0.0):
+    first = FilePilot()
+    first.load(model_path)
+    pilot = ReloadablePilot(first)
+    reloader = ModelReloader(pilot, lambda: FilePilot(load_delay),
+                             lambda p, path: p.load(path), model_path,
+                             settle_time=0.0, poll_delay=0.01)
+    return pilot, reloader
+
+
+def test_reload_and_swap(model_path):
+    pilot, reloader = create_reloader(model_path)
+    assert reloader.run() == (None, None)
+    write_model(model_path, 2)
+    # the change is seen first, the file is loaded once it settled
+    assert reloader.run() == (None, None)
+    load_ms, loaded = reloader.run()
+    assert loaded and load_ms >= 0
+    # the new pilot is warmed up, but swapped in with the next prediction
+    assert pilot.next_pilot.warm
+    assert pilot.pilot.version == 1
+    assert pilot.run(None) == (2, 0.0)
+    assert pilot.swaps == 1 and pilot.next_pilot is None
+
+
+def test_failed_reload_keeps_pilot(model_path):
+    pilot, reloader = create_reloader(model_path)
+    with open(model_path, 'w') as f:
+        f.write('corrupt')
+    os.utime(model_path, (time.time() + 5, time.time() + 5))
+    reloader.run()
+    load_ms, loaded = reloader.run()
+    assert loaded is False and reloader.failures == 1
+    assert pilot.run(None) == (1, 0.0) and pilot.swaps == 0
+
+
+def test_reload_with_async_pilot(model_path):
+    # loading takes much longer than the loop period, the loop keeps going
+    # with the old model and switches without a gap
+    pilot, reloader = create_reloader(model_path, load_delay=0.3)
+    async_pilot = AsyncPilot(pilot, 2, poll_delay=0.01)
+    threads = [threading.Thread(target=part.update, daemon=True)
+               for part in (reloader, async_pilot)]
+    for thread in threads:
+        thread.start()
+    write_model(model_path, 2)
+    versions, periods = [], []
+    last = time.perf_counter()
+    for _ in range(150):
+        versions.append(async_pilot.run_threaded(None)[0])
+        time.sleep(0.005)
+        now = time.perf_counter()
+        periods.append(now - last)
+        last = now
+    for part in (reloader, async_pilot):
+        part.shutdown()
+    for thread in threads:
+        thread.join(1)
+    versions = [v for v in versions if v is not None]
+    assert versions[0] == 1 and versions[-1] == 2
+    assert versions == sorted(versions)
+    assert max(periods) < 0.1
+    assert reloader.run_threaded()[1] is True
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasIMU, KerasLSTM])
+def test_warm_up(keras_pilot):
+    warm_up(keras_pilot())
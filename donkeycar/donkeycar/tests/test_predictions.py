@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pytest
+
+from donkeycar.config import Config
+from donkeycar.parts.interpreter import keras_to_tflite
+from donkeycar.parts.keras import KerasLinear, KerasLSTM
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.predictions import Predictions, load_predictions, \
+    predict_tubs
+from donkeycar.pipeline.types import TubDataset
+
+TOLERANCE = 1e-4
+
+
+@pytest.fixture
+def config():
+    cfg = Config()
+    cfg.IMAGE_W, cfg.IMAGE_H, cfg.IMAGE_DEPTH = 160, 120, 3
+    cfg.DEFAULT_MODEL_TYPE = 'linear'
+    cfg.SEQUENCE_LENGTH = 3
+    cfg.PREDICT_BATCH_SIZE = 8
+    return cfg
+
+
+def _write(path, count):
+    tub = Tub(path, ['cam/image_array', 'user/angle', 'user/throttle'],
+              ['image_array', 'float', 'float'])
+    for _ in range(count):
+        img = np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+        tub.write_record({'cam/image_array': img, 'user/angle': 0.1,
+                          'user/throttle': 0.5})
+    tub.close()
+
+
+def _expected(model, config, tub_path):
+    """ Predictions record by record, like tubplot made them """
+    records = TubDataset(config, [tub_path]).get_records()
+    return np.array([model.inference_from_dict(
+        model.x_transform(r, model.normalize))[:2] for r in records])
+
+
+def test_predict_tub(config, tmp_path):
+    tub_path = str(tmp_path / 'tub')
+    _write(tub_path, 20)
+    model_path = str(tmp_path / 'pilot.h5')
+    kl = KerasLinear()
+    kl.interpreter.model.save(model_path)
+    assert load_predictions(tub_path, model_path, config) is None
+
+    predictions = predict_tubs(config, [tub_path], model_path)[tub_path]
+    assert len(predictions) == 20
+    np.testing.assert_array_equal(predictions.indexes, np.arange(20))
+    actual = np.stack([predictions.columns['pilot/angle'],
+                       predictions.columns['pilot/throttle']], axis=1)
+    np.testing.assert_allclose(actual, _expected(kl, config, tub_path),
+                               rtol=TOLERANCE, atol=TOLERANCE)
+    assert os.path.exists(Predictions.path(tub_path, model_path))
+    stored = load_predictions(tub_path, model_path, config)
+    assert stored.get(7) == predictions.get(7)
+
+    # new records are predicted, the stored predictions are kept
+    _write(tub_path, 5)
+    extended = predict_tubs(config, [tub_path], model_path)[tub_path]
+    assert len(extended) == 25
+    assert extended.get(7) == predictions.get(7)
+    # other transformations or a changed model invalidate the predictions
+    config.TRANSFORMATIONS = ['CROP']
+    config.ROI_CROP_TOP = 40
+    assert load_predictions(tub_path, model_path, config) is None
+    assert not stored.valid_for(config)
+    assert stored.valid_for(config, [], [])
+    config.TRANSFORMATIONS = []
+    assert stored.made_by(model_path, 'linear')
+    assert not stored.made_by(model_path, 'categorical')
+    t = os.path.getmtime(model_path) + 10
+    os.utime(model_path, (t, t))
+    assert load_predictions(tub_path, model_path, config) is None
+    assert not stored.made_by(model_path, 'linear')
+
+
+def test_predict_tflite(config, tmp_path):
+    tub_path = str(tmp_path / 'tub')
+    _write(tub_path, 10)
+    kl = KerasLinear()
+    model_path = str(tmp_path / 'pilot.tflite')
+    keras_to_tflite(kl.interpreter.model, model_path)
+    config.DEFAULT_MODEL_TYPE = 'tflite_linear'
+    predictions = predict_tubs(config, [tub_path], model_path)[tub_path]
+    angles = predictions.lookup(np.arange(10))['pilot/angle']
+    np.testing.assert_allclose(angles, _expected(kl, config, tub_path)[:, 0],
+                               rtol=TOLERANCE, atol=TOLERANCE)
+
+
+def test_predict_sequences(config, tmp_path):
+    tub_path = str(tmp_path / 'tub')
+    _write(tub_path, 10)
+    model_path = str(tmp_path / 'lstm.h5')
+    KerasLSTM(seq_length=3).interpreter.model.save(model_path)
+    predictions = predict_tubs(config, [tub_path], model_path,
+                               model_type='rnn', save=False)[tub_path]
+    # the prediction of a sequence belongs to its last record
+    np.testing.assert_array_equal(predictions.indexes, np.arange(2, 10))
+    assert predictions.get(0) is None
+    assert np.isnan(predictions.lookup([0, 5])['pilot/angle'][0])
+    assert not os.path.exists(Predictions.path(tub_path, model_path))
@@ -0,0 +1,74 @@
+import time
+
+import donkeycar as dk
+from donkeycar.parts.explode import ExplodeDict
+from donkeycar.parts.transform import Lambda
+
+
+class Sleeper:
+    def __init__(self, value, delay=0.05):
+        self.value = value
+        self.delay = delay
+
+    def run(self, *args):
+        time.sleep(self.delay)
+        return self.value
+
+
+def create_vehicle(max_workers):
+    v = dk.Vehicle(max_workers=max_workers)
+    v.add(Sleeper(1), outputs=['cam/image'])
+    v.add(Sleeper(2), inputs=['cam/image'], outputs=['seg/x'])
+    v.add(Sleeper(3), inputs=['cam/image'], outputs=['pilot/angle'])
+    v.add(Sleeper(4), inputs=['cam/image'], outputs=['stop/flag'])
+    v.add(Lambda(lambda a, b, c: a + b + c),
+          inputs=['seg/x', 'pilot/angle', 'stop/flag'], outputs=['sum'])
+    return v
+
+
+def test_stages_from_inputs_and_outputs():
+    v = create_vehicle(4)
+    v.compile_plan()
+    assert v.scheduler.stages == [[0], [1, 2, 3], [4]]
+
+
+def test_parallel_matches_serial():
+    serial = create_vehicle(0)
+    parallel = create_vehicle(4)
+    for v in (serial, parallel):
+        v.update_parts()
+    keys = ['cam/image', 'seg/x', 'pilot/angle', 'stop/flag', 'sum']
+    assert serial.mem.get(keys) == parallel.mem.get(keys) == [1, 2, 3, 4, 9]
+    parallel.stop()
+
+
+def test_parallel_stage_runs_concurrently():
+    v = create_vehicle(4)
+    v.update_parts()
+    start = time.perf_counter()
+    v.update_parts()
+    # three 50ms stages instead of four serial parts
+    assert time.perf_counter() - start < 0.19
+    assert len(v.scheduler.critical_path) == 3
+    v.stop()
+
+
+def test_write_after_read_keeps_order():
+    v = dk.Vehicle(max_workers=2)
+    v.add(Lambda(lambda x: x), inputs=['throttle'], outputs=['old'])
+    v.add(Sleeper(5), outputs=['throttle'])
+    v.compile_plan()
+    assert v.scheduler.stages == [[0], [1]]
+    v.stop()
+
+
+def test_part_holding_memory_is_barrier():
+    v = dk.Vehicle(max_workers=2)
+    v.add(Sleeper({'w1': True}), outputs=['web/buttons'])
+    v.add(ExplodeDict(v.mem, 'web/'), inputs=['web/buttons'])
+    v.add(Sleeper(1), outputs=['other'])
+    v.compile_plan()
+    assert v.scheduler.stages == [[0], [1], [2]]
+    v.update_parts()
+    assert v.mem['web/w1'] is True
+    v.stop()
@@ -121,3 +121,19 @@ def test_training_pipeline(config: Config, model_type: str, car_dir: str) \
     val_x, val_y = next(iter(data_module.val_dataloader()))
     output = model(val_x)
     assert(output.shape == (config.BATCH_SIZE, 2))
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_data_module_workers(config: Config, car_dir: str,
+                             num_workers: int) -> None:
+    """ Map-style datasets load the same data with and without workers """
+    config.TORCH_NUM_WORKERS = num_workers
+    tub_dir = os.path.join(car_dir, 'tub')
+    data_module = TorchTubDataModule(config, [tub_dir])
+    data_module.setup()
+    count = 0
+    for x, y in data_module.val_dataloader():
+        assert x.shape[1:] == (3, 224, 224)
+        assert y.shape[1:] == (2, )
+        count += len(x)
+    assert count == len(data_module.val_dataset)
@@ -177,8 +177,10 @@ model_types = ['linear', 'categorical', 'inferred', 'imu', 'behavior',
 
 @pytest.mark.parametrize('model_type', model_types)
 @pytest.mark.parametrize('train_filter', filters)
+@pytest.mark.parametrize('pipeline', BatchSequence.PIPELINES)
 def test_training_pipeline(config: Config, model_type: str,
-                           train_filter: Callable[[TubRecord], bool]) -> None:
+                           train_filter: Callable[[TubRecord], bool],
+                           pipeline: str) -> None:
     """
     Testing consistency of the model interfaces and data used in training
     pipeline.
@@ -186,6 +188,7 @@ def test_training_pipeline(config: Config, model_type: str,
     :param config:                  donkey config
     :param model_type:              test specification of model type
     :param train_filter:            filter for records
+    :param pipeline:                tf.data pipeline type
     :return:                        None
     """
     kl = get_model_by_type(model_type, config)
@@ -198,7 +201,8 @@ def test_training_pipeline(config: Config, model_type: str,
     training_records, validation_records = \
         train_test_split(dataset.get_records(), shuffle=False,
                          test_size=(1. - config.TRAIN_TEST_SPLIT))
-    seq = BatchSequence(kl, config, training_records, True)
+    config.TRAIN_PIPELINE = pipeline
+    seq = BatchSequence(kl, config, training_records, True, shuffle=False)
     data_train = seq.create_tf_data()
     num_whole_batches = len(training_records) // config.BATCH_SIZE
     # this takes all batches into one list
@@ -232,3 +236,28 @@ def test_training_pipeline(config: Config, model_type: str,
             for k, v in batch.items():
                 assert np.isclose(v, np_dict[k]).all()
 
+
+
+def test_dataset_cache_misses_are_transformed(config: Config, tmpdir) -> None:
+    """ Records missing in the dataset cache are transformed like records
+    without cache """
+    from donkeycar.pipeline.dataset_cache import CachedTubRecord, \
+        DatasetCache
+    cfg = copy(config)
+    add_transformation_to_config(cfg)
+    cfg.DATASET_CACHE_PATH = str(tmpdir)
+    kl = get_model_by_type('linear', cfg)
+    records = TubDataset(cfg, [cfg.DATA_PATH]).get_records()[:20]
+    cache = DatasetCache.ensure(cfg, [cfg.DATA_PATH])
+    # forget half of the images, like records added after building
+    for key in list(cache.rows)[::2]:
+        del cache.rows[key]
+    cached_seq = BatchSequence(kl, cfg, records, False, dataset_cache=cache)
+    wrapped = cached_seq.sequence.records
+    assert any(isinstance(r, CachedTubRecord) for r in wrapped)
+    assert not all(isinstance(r, CachedTubRecord) for r in wrapped)
+    seq = BatchSequence(kl, cfg, records, False)
+    for r, cached_r in zip(records, wrapped):
+        np.testing.assert_array_equal(
+            seq.pipeline.x_transform(r)['img_in'],
+            cached_seq.pipeline.x_transform(cached_r)['img_in'])
@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+import pytest
+
+from donkeycar.config import Config
+from donkeycar.parts.tub_index import TubIndex
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.types import Collator, TubDataset, find_tubs
+
+
+@pytest.fixture
+def tub_path(tmpdir):
+    tub = Tub(str(tmpdir), ['user/angle', 'user/throttle', 'user/mode',
+                            'behavior/one_hot'],
+              ['float', 'float', 'str', 'list'], max_catalog_len=10)
+    for i in range(25):
+        tub.write_record({'user/angle': i / 25, 'user/throttle': i % 5 - 2,
+                          'user/mode': 'user', 'behavior/one_hot': [i, 0.5]})
+    tub.delete_records([3, 12])
+    tub.close()
+    return str(tmpdir)
+
+
+def test_index_matches_tub(tub_path):
+    index = TubIndex.load(tub_path)
+    assert index.complete
+    assert len(index) == 25
+    records = list(Tub(tub_path, read_only=True))
+    assert list(index.records()) == [{k: r[k] for k in index.keys()}
+                                     for r in records]
+    df = index.dataframe()
+    assert list(df['behavior/one_hot_0']) == \
+        [r['behavior/one_hot'][0] for r in records]
+
+
+def _add_record(tub_path):
+    tub = Tub(tub_path, ['user/angle', 'user/throttle', 'user/mode',
+                         'behavior/one_hot'],
+              ['float', 'float', 'str', 'list'])
+    tub.write_record({'user/angle': 1.0, 'user/throttle': 0.5})
+    tub.close()
+
+
+def test_index_update(tub_path):
+    index = TubIndex.load(tub_path)
+    _add_record(tub_path)
+    updated = TubIndex.load(tub_path)
+    assert len(updated) == len(index) + 1
+    # mode is missing in the new record
+    assert not updated.has_value('user/mode')[-1]
+    assert 'user/mode' not in list(updated.records())[-1]
+    np.testing.assert_array_equal(updated.column('_index'), np.arange(26))
+
+
+def test_interrupted_index_write(tub_path, monkeypatch):
+    TubIndex.load(tub_path)
+    _add_record(tub_path)
+    save = np.save
+    saved = []
+
+    def interrupted_save(name, arr):
+        if saved:
+            raise OSError('No space left on device')
+        saved.append(name)
+        save(name, arr)
+
+    # the first column of the updated index is written, then the write fails
+    monkeypatch.setattr(np, 'save', interrupted_save)
+    TubIndex.load(tub_path)
+    monkeypatch.setattr(np, 'save', save)
+    index = TubIndex.load(tub_path)
+    assert len(index) == 26
+    np.testing.assert_array_equal(index.column('_index'), np.arange(26))
+
+
+def test_index_with_wrong_column_length(tub_path):
+    TubIndex.load(tub_path)
+    path = os.path.join(TubIndex.path(tub_path), '_index.npy')
+    np.save(path, np.arange(30))
+    index = TubIndex.load(tub_path)
+    np.testing.assert_array_equal(index.column('_index'), np.arange(25))
+
+
+def test_vectorized_filter(tub_path):
+    index = TubIndex.load(tub_path)
+    mask = index.mask(lambda rec: rec.underlying['user/throttle'] > 0)
+    assert mask is not None
+    # falls back to per record filtering
+    assert index.mask(lambda rec: rec.underlying['user/throttle'] > 0
+                      and rec.underlying['user/angle'] > 0) is None
+
+    cfg = Config()
+    cfg.TRAIN_FILTER = lambda rec: rec.underlying['user/throttle'] > 0
+    vectorized = TubDataset(cfg, [tub_path]).get_records()
+    cfg.TRAIN_FILTER = lambda rec: rec.underlying['user/throttle'] > 0 \
+        and True
+    per_record = TubDataset(cfg, [tub_path]).get_records()
+    assert len(vectorized) == mask.sum() == 9
+    assert [r.underlying for r in vectorized] == \
+        [r.underlying for r in per_record]
+
+
+def test_lazy_records(tub_path, tmpdir_factory):
+    # index of the second tub is not complete because of the variable
+    # length vectors
+    other_path = str(tmpdir_factory.mktemp('other'))
+    tub = Tub(other_path, ['user/angle', 'user/throttle', 'path'],
+              ['float', 'float', 'list'])
+    for i in range(6):
+        tub.write_record({'user/angle': 0.1, 'user/throttle': 0.2,
+                          'path': [0.5] * (i + 1)})
+    tub.close()
+    assert not TubIndex.load(other_path).complete
+
+    records = TubDataset(Config(), [tub_path, other_path]).get_records()
+    underlyings = list(Tub(tub_path, read_only=True)) \
+        + list(Tub(other_path, read_only=True))
+    assert len(records) == len(underlyings) == 29
+    assert [dict(r.underlying) for r in records] == underlyings
+    assert records[-1].base_path == other_path
+    assert len(records[-1].underlying['path']) == 6
+    assert isinstance(records[0].underlying['behavior/one_hot'], list)
+    np.testing.assert_array_equal(records.column('_index'),
+                                  [u['_index'] for u in underlyings])
+    subset = records.subset([28, 0, 5])
+    assert [r.underlying['_index'] for r in subset] == [5, 0, 6]
+    assert [r.underlying['_index'] for r in subset.subset([0])] == [5]
+    assert list(subset.sessions()) == \
+        [f'{p}:{u["_session_id"]}' for p, u in
+         ((other_path, underlyings[28]), (tub_path, underlyings[0]),
+          (tub_path, underlyings[5]))]
+
+    seq = TubDataset(Config(), [tub_path, other_path],
+                     seq_size=3).get_records()
+    listed = Collator(3, list(records))
+    np.testing.assert_array_equal(seq.starts, listed.starts)
+    assert [[dict(r.underlying) for r in w] for w in seq] == \
+        [[dict(r.underlying) for r in w] for w in listed]
+
+
+def test_parallel_loading(tmpdir):
+    data = tmpdir.mkdir('data')
+    for t in (10, 2, 1):
+        tub = Tub(str(data.join(f'tub_{t}')), ['user/angle'], ['float'])
+        for i in range(t):
+            tub.write_record({'user/angle': t + i / 10})
+        tub.close()
+    data.mkdir('models')
+    paths = [str(data.join(f'tub_{t}')) for t in (1, 2, 10)]
+    assert find_tubs([str(data)]) == paths
+
+    cfg = Config()
+    loaded = {}
+    for workers in (0, 4):
+        cfg.TUB_LOAD_WORKERS = workers
+        dataset = TubDataset(cfg, [str(data)])
+        assert dataset.tub_paths == paths
+        loaded[workers] = [(r.base_path, dict(r.underlying))
+                           for r in dataset.get_records()]
+    assert len(loaded[0]) == 13
+    assert loaded[0] == loaded[4]
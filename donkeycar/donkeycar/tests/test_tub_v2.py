@@ -1,7 +1,13 @@
+import os
 import shutil
 import tempfile
+import threading
 import unittest
 
+import numpy as np
+import pytest
+
+from donkeycar.parts.image_codec import get_codec
 from donkeycar.parts.tub_v2 import Tub
 from donkeycar.pipeline.types import TubRecord, Collator
 from donkeycar.config import Config
@@ -58,6 +64,25 @@ class TestTub(unittest.TestCase):
                             for rec_1, rec_2 in zip(it1, it2))), \
                     'Non continuous records found'
 
+    def test_sequence_windows(self):
+        cfg = Config()
+        records = [TubRecord(cfg, self.tub.base_path, underlying) for
+                   underlying in self.tub]
+        for seq_len in (1, 2, 3, 4, 5):
+            seq = Collator(seq_len, records)
+            expected = [i for i in range(len(records) - seq_len + 1)
+                        if all(Collator.is_continuous(records[j],
+                                                      records[j + 1])
+                               for j in range(i, i + seq_len - 1))]
+            self.assertEqual(list(seq.starts), expected)
+            self.assertEqual(len(seq), len(expected))
+            if expected:
+                self.assertEqual(seq[-1], records[expected[-1]:
+                                                  expected[-1] + seq_len])
+                self.assertEqual(list(seq.windows[0]), [expected[0], seq_len])
+                self.assertEqual(list(seq.subset([len(seq) - 1])),
+                                 [seq[-1]])
+
     def test_delete_last_n_records(self):
         start_len = len(self.tub)
         self.tub.delete_last_n_records(2)
@@ -72,5 +97,66 @@ class TestTub(unittest.TestCase):
         shutil.rmtree(cls._path)
 
 
+@pytest.mark.parametrize('codec', ['pil', 'cv2', 'raw'])
+def test_image_codecs(tmpdir, codec):
+    if codec == 'cv2':
+        pytest.importorskip('cv2')
+    from donkeycar.utils import load_image_sized
+    tub = Tub(str(tmpdir), ['cam/image_array'], ['image_array'],
+              image_codec=get_codec(codec), encoder_workers=2)
+    images = [np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+              for _ in range(8)]
+    for img in images:
+        tub.write_record({'cam/image_array': img})
+    tub.close()
+    records = list(Tub(str(tmpdir), read_only=True))
+    assert len(records) == len(images)
+    for img, record in zip(images, records):
+        path = os.path.join(str(tmpdir), Tub.images(),
+                            record['cam/image_array'])
+        loaded = load_image_sized(path, 160, 120, 3)
+        assert loaded.shape == img.shape
+        if codec == 'raw':
+            np.testing.assert_array_equal(loaded, img)
+    assert not any(f.endswith('.tmp')
+                   for f in os.listdir(os.path.join(str(tmpdir), 'images')))
+
+
+class GatedCodec:
+    """ Raw codec which waits for the gate and fails on white images """
+    def __init__(self):
+        self.codec = get_codec('raw')
+        self.extension = self.codec.extension
+        self.gate = threading.Event()
+
+    def encode(self, img):
+        self.gate.wait(5)
+        if img.min() == 255:
+            raise ValueError('Could not encode')
+        return self.codec.encode(img)
+
+
+def test_catalog_waits_for_encoded_images(tmpdir):
+    codec = GatedCodec()
+    tub = Tub(str(tmpdir), ['cam/image_array', 'user/angle'],
+              ['image_array', 'float'], image_codec=codec, encoder_workers=2)
+    images = [np.full((12, 16, 3), i, dtype=np.uint8) for i in (1, 255, 3)]
+    for i, img in enumerate(images):
+        tub.write_record({'cam/image_array': img, 'user/angle': i})
+    # no catalog line points at an image which is not written yet
+    assert tub.manifest.current_index == 0
+    assert tub.current_index == 3
+    codec.gate.set()
+    tub.flush()
+    assert tub.manifest.current_index == 3
+    tub.close()
+    # the record whose image failed is deleted
+    records = list(Tub(str(tmpdir), read_only=True))
+    assert [r['user/angle'] for r in records] == [0, 2]
+    for record in records:
+        assert os.path.exists(os.path.join(str(tmpdir), Tub.images(),
+                                           record['cam/image_array']))
+
+
 if __name__ == '__main__':
     unittest.main()
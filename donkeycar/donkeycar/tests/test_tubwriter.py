@@ -1,9 +1,10 @@
 import shutil
 import tempfile
+import time
 import unittest
 from random import randint
 
-from donkeycar.parts.tub_v2 import Tub, TubWriter
+from donkeycar.parts.tub_v2 import Tub, TubWriter, AsyncTubWriter
 
 
 class TestTub(unittest.TestCase):
@@ -35,6 +36,107 @@ class TestTub(unittest.TestCase):
                 id += 1
                 write_counts.pop(0)
 
+    def test_async_tubwriter_writes_all_records_on_close(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'], policy='block',
+                                    queue_size=5)
+        for i in range(50):
+            num_records, depth, latency = tub_writer.run(i)
+            self.assertEqual(i + 1, num_records)
+            self.assertLessEqual(depth, 5)
+        tub_writer.close()
+        tub = Tub(self._path, read_only=True)
+        self.assertEqual(list(range(50)), [r['input'] for r in tub])
+        self.assertEqual(list(range(50)), [r['_index'] for r in tub])
+
+    def test_async_tubwriter_drops_oldest(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'], queue_size=2)
+        # keep the writer thread busy, so records queue up
+        with tub_writer.tub.lock:
+            time.sleep(0.2)
+            for i in range(10):
+                num_records, depth, _ = tub_writer.run(i)
+        tub_writer.close()
+        written = [r['input'] for r in Tub(self._path, read_only=True)]
+        self.assertEqual(num_records, len(written))
+        self.assertEqual(written[-2:], [8, 9])
+        self.assertGreater(tub_writer.num_dropped, 0)
+
+    def test_async_tubwriter_survives_flush_errors(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'], policy='block')
+        flush = tub_writer.tub.flush
+        failures = []
+
+        def failing_flush(sync):
+            if not failures:
+                failures.append(sync)
+                raise OSError('No space left on device')
+            flush(sync)
+
+        tub_writer.tub.flush = failing_flush
+        tub_writer.run(0)
+        time.sleep(0.3)
+        self.assertEqual(failures, [True])
+        self.assertTrue(tub_writer.thread.is_alive())
+        for i in range(1, 5):
+            tub_writer.run(i)
+        tub_writer.close()
+        written = [r['input'] for r in Tub(self._path, read_only=True)]
+        self.assertEqual(list(range(5)), written)
+
+    def test_async_tubwriter_dead_writer_does_not_block(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'], policy='block',
+                                    queue_size=1)
+        # stop the writer thread, as if it had died
+        tub_writer.running = False
+        tub_writer.thread.join()
+        for i in range(5):
+            tub_writer.run(i)
+        self.assertEqual(tub_writer.num_dropped, 5)
+        tub_writer.close()
+
+    def test_async_tubwriter_deletes_queued_records(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'], policy='block',
+                                    queue_size=10)
+        for i in range(5):
+            tub_writer.run(i)
+        time.sleep(0.3)
+        # keep the writer thread busy, so the next records stay queued
+        with tub_writer.tub.lock:
+            for i in range(5, 10):
+                tub_writer.run(i)
+            tub_writer.delete_last_n_records(3)
+            num_records, _, _ = tub_writer.run(10)
+        self.assertEqual(num_records, 8)
+        tub_writer.delete_last_n_records(4)
+        tub_writer.close()
+        alive = [r['input'] for r in Tub(self._path, read_only=True)]
+        self.assertEqual(alive, [0, 1, 2, 3])
+
+    def test_async_tubwriter_counts_failed_writes(self):
+        tub_writer = AsyncTubWriter(self._path, inputs=['input'],
+                                    types=['int'], policy='block')
+        write_record = tub_writer.tub.write_record
+
+        def failing_write(record, **kwargs):
+            if record['input'] == 1:
+                raise OSError('No space left on device')
+            write_record(record, **kwargs)
+
+        tub_writer.tub.write_record = failing_write
+        for i in range(3):
+            tub_writer.run(i)
+        time.sleep(0.3)
+        num_records, _, _ = tub_writer.run(3)
+        tub_writer.close()
+        written = [r['input'] for r in Tub(self._path, read_only=True)]
+        self.assertEqual(written, [0, 2, 3])
+        self.assertEqual(num_records, len(written))
+
     def tearDown(self):
         shutil.rmtree(self._path)
 
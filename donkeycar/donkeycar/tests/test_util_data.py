@@ -158,3 +158,35 @@ def test_train_test_split():
     print(val_set)
     assert(len(train_set)==8)
     assert(len(val_set)==2)
+
+
+def test_train_test_split_keeps_list():
+    data_set = list(range(1000))
+    train_set, val_set = train_test_split(data_set, test_size=0.2, seed=0)
+    assert len(data_set) == 1000
+    assert len(train_set) == 800
+    assert sorted(train_set + val_set) == data_set
+    train_set, val_set = train_test_split(data_set, shuffle=False)
+    assert train_set == data_set[:800] and val_set == data_set[800:]
+
+
+@pytest.mark.parametrize('strategy', ['session', 'block'])
+def test_split_indexes_by_group(strategy):
+    # 10 sessions of 100 records
+    groups = np.repeat([f's{i}' for i in range(10)], 100)
+    train, val = split_indexes(1000, test_size=0.2, strategy=strategy,
+                               groups=groups, block_size=30, seed=1)
+    assert len(train) + len(val) == 1000
+    assert len(np.intersect1d(train, val)) == 0
+    assert 150 <= len(val) <= 250
+    if strategy == 'session':
+        assert not set(groups[train]) & set(groups[val])
+    else:
+        # blocks of 30 within sessions: 0-29, 30-59, 60-89, 90-99, 100-129..
+        blocks = np.arange(1000) % 100 // 30 + np.arange(1000) // 100 * 4
+        assert not set(blocks[train]) & set(blocks[val])
+    # without shuffle the last groups are used for validation
+    train, val = split_indexes(1000, test_size=0.2, shuffle=False,
+                               strategy=strategy, groups=groups,
+                               block_size=30)
+    assert val.min() > train.max()
@@ -1,5 +1,8 @@
+import time
+
 import pytest
 import donkeycar as dk
+from donkeycar.vehicle import PartProfiler
 from donkeycar.parts.transform import Lambda
 
 
@@ -54,4 +57,84 @@ def test_should_raise_assertion_on_non_boolean_threaded_for_add_part():
     threaded = 'non_boolean'
     with pytest.raises(AssertionError):
         vehicle.add(_get_sample_lambda(), threaded=threaded)
-        pytest.fail("threaded is not a boolean: %r" % threaded)
\ No newline at end of file
+        pytest.fail("threaded is not a boolean: %r" % threaded)
+
+def test_plan_rebuilt_on_add_and_remove():
+    v = dk.Vehicle()
+    part = _get_sample_lambda()
+    v.add(part, outputs=['test_out'])
+    v.update_parts()
+    assert len(v._plan) == 1
+    v.add(Lambda(lambda x: x + 1), inputs=['test_out'], outputs=['test_out2'])
+    assert v._plan is None
+    v.update_parts()
+    assert v.mem.get(['test_out2']) == [2]
+    v.remove(part)
+    assert v._plan is None
+    v.update_parts()
+    assert len(v.parts) == 1 and len(v._plan) == 1
+
+
+def test_plan_respects_run_condition():
+    v = dk.Vehicle()
+    v.mem['run'] = False
+    v.add(_get_sample_lambda(), outputs=['test_out'], run_condition='run')
+    v.update_parts()
+    assert v.mem.get(['test_out']) == [None]
+    v.mem['run'] = True
+    v.update_parts()
+    assert v.mem.get(['test_out']) == [1]
+
+
+def test_loop_timing_is_recorded(vehicle):
+    vehicle.start(rate_hz=50, max_loop_count=5)
+    assert vehicle.loop_period.count == 4
+    assert vehicle.loop_lateness.count == 5
+    assert vehicle.mem['loop/period_hist'] is vehicle.loop_period
+    # the period is scheduled against absolute deadlines
+    assert 15000 < vehicle.loop_period.percentile(50) < 30000
+    assert vehicle.mem['loop/period_ms'] > 0
+
+
+def test_should_raise_assertion_on_unknown_overrun_policy(vehicle):
+    with pytest.raises(AssertionError):
+        vehicle.start(rate_hz=20, max_loop_count=2, overrun_policy='any')
+
+
+def test_overrun_skips_optional_parts():
+    v = dk.Vehicle()
+    calls = []
+    v.add(Lambda(lambda: time.sleep(0.02)))
+    v.add(Lambda(lambda: calls.append(1)), optional=True)
+    v.start(rate_hz=100, max_loop_count=5, overrun_policy='skip_optional')
+    # only the first loop runs the optional part
+    assert len(calls) == 1
+    v = dk.Vehicle()
+    calls.clear()
+    v.add(Lambda(lambda: time.sleep(0.02)))
+    v.add(Lambda(lambda: calls.append(1)), optional=True)
+    v.start(rate_hz=100, max_loop_count=5)
+    assert len(calls) == 5
+
+
+def test_profiler_memory_is_bounded():
+    profiler = PartProfiler(capacity=10)
+    part = _get_sample_lambda()
+    profiler.profile_part(part)
+    for _ in range(25):
+        profiler.on_part_start(part)
+        profiler.on_part_finished(part)
+    record = profiler.records[part]
+    assert record.ring.shape == (10,)
+    snapshot = profiler.snapshot()
+    assert snapshot['Lambda']['count'] == 24
+    assert set(snapshot['Lambda']) == {'count', 'max', 'min', 'avg', 'p50',
+                                       'p90', 'p99', 'p99.9'}
+    assert 0 <= snapshot['Lambda']['min'] <= snapshot['Lambda']['max']
+
+
+def test_profiler_names_duplicate_parts(vehicle):
+    vehicle.add(_get_sample_lambda(), outputs=['test_out2'])
+    vehicle.start(rate_hz=100, max_loop_count=3)
+    assert set(vehicle.profiler.snapshot()) == {'Lambda', 'Lambda_1'}
+    assert vehicle.mem['loop/profiler'] is vehicle.profiler
@@ -0,0 +1,95 @@
+class Histogram:
+    """
+    Fixed memory histogram of non-negative integer values with log-linear
+    buckets, in the style of an HDR histogram. Values below
+    2**precision_bits are counted exactly, larger values fall into buckets
+    whose width is a constant fraction (1 / 2**(precision_bits - 1)) of
+    their value. Recording a value is O(1) and percentiles can be queried
+    at any time without keeping the recorded values around.
+    """
+    def __init__(self, max_value:int=60_000_000, precision_bits:int=6) -> None:
+        if precision_bits < 1:
+            raise ValueError("precision_bits must be greater than zero")
+        self.precision_bits = precision_bits
+        self.max_value = max_value
+        self.counts:list = [0] * (self._index(max_value) + 1)
+        self.reset()
+
+    def reset(self) -> None:
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count:int = 0
+        self.total:int = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value:int) -> int:
+        p = self.precision_bits
+        if value < (1 << p):
+            return value
+        shift = value.bit_length() - p
+        return (1 << p) + (shift - 1) * (1 << (p - 1)) \
+            + (value >> shift) - (1 << (p - 1))
+
+    def _value(self, index:int) -> int:
+        """ highest value that is counted in the bucket with given index """
+        p = self.precision_bits
+        if index < (1 << p):
+            return index
+        shift, sub = divmod(index - (1 << p), 1 << (p - 1))
+        shift += 1
+        return (((1 << (p - 1)) + sub + 1) << shift) - 1
+
+    def record(self, value) -> None:
+        """
+        Count a value, values are truncated to integers and clamped to
+        the range [0, max_value]
+        """
+        value = int(value)
+        if value < 0:
+            value = 0
+        elif value > self.max_value:
+            value = self.max_value
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentiles(self, pctiles) -> list:
+        """
+        Return the values at the given percentiles (0..100) in a single
+        pass over the buckets. The result is the upper bound of the bucket
+        the percentile falls into, capped by the recorded maximum.
+        """
+        if not self.count:
+            return [0 for _ in pctiles]
+        targets = sorted((max(1, -(-self.count * q // 100)), i)
+                         for i, q in enumerate(pctiles))
+        result = [0] * len(targets)
+        t = 0
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            while t < len(targets) and seen >= targets[t][0]:
+                result[targets[t][1]] = min(self._value(index), self.max)
+                t += 1
+            if t == len(targets):
+                break
+        return result
+
+    def percentile(self, pctile) -> int:
+        return self.percentiles([pctile])[0]
+
+    def snapshot(self, pctiles=(50, 90, 99, 99.9)) -> dict:
+        """ Summary of the histogram as a plain dictionary """
+        summary = {'count': self.count, 'min': self.min or 0,
+                   'max': self.max or 0, 'mean': self.mean()}
+        for q, v in zip(pctiles, self.percentiles(pctiles)):
+            summary[f'p{q}'] = v
+        return summary
@@ -13,7 +13,6 @@ import sys
 import itertools
 import subprocess
 import math
-import random
 import time
 import signal
 import logging
@@ -142,13 +141,16 @@ def img_crop(img_arr, top, bottom):
     return img_arr[top:end, ...]
 
 
-def normalize_image(img_arr_uint):
+def normalize_image(img_arr_uint, out=None):
     """
     Convert uint8 numpy image array into [0,1] float image array
     :param img_arr_uint:    [0,255]uint8 numpy image array
+    :param out:             optional preallocated float32 array of the same
+                            shape to write the result into
     :return:                [0,1] float32 numpy image array
     """
-    return img_arr_uint.astype(np.float64) * ONE_BYTE_SCALE
+    return np.multiply(img_arr_uint, np.float32(ONE_BYTE_SCALE), out=out,
+                       dtype=np.float32)
 
 
 def denormalize_image(img_arr_float):
@@ -497,7 +499,9 @@ def get_model_by_type(model_type: str, cfg: 'Config') -> Union['KerasPilot', 'Fa
     logger.info(f'get_model_by_type: model type is: {model_type}')
     input_shape = (cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
     if 'tflite_' in model_type:
-        interpreter = TfLite()
+        interpreter = TfLite(
+            num_threads=getattr(cfg, 'TFLITE_NUM_THREADS', None),
+            use_xnnpack=getattr(cfg, 'TFLITE_XNNPACK', True))
         used_model_type = model_type.replace('tflite_', '')
     elif 'tensorrt_' in model_type:
         interpreter = TensorRT()
@@ -549,6 +553,9 @@ def get_model_by_type(model_type: str, cfg: 'Config') -> Union['KerasPilot', 'Fa
                  for u in used_model_type.mem]
         raise ValueError(f"Unknown model type {model_type}, supported types are"
                          f" { ', '.join(known)}")
+    if getattr(cfg, 'MODEL_UINT8_INPUT', False) \
+            and isinstance(interpreter, KerasInterpreter):
+        kl.fold_normalization()
     return kl
 
 
@@ -570,33 +577,119 @@ def get_test_img(keras_pilot):
     return img.astype(np.uint8)
 
 
-def train_test_split(data_list: List[Any],
-                     shuffle: bool = True,
-                     test_size: float = 0.2) -> Tuple[List[Any], List[Any]]:
-    '''
-    take a list, split it into two sets while selecting a
-    random element in order to shuffle the results.
-    use the test_size to choose the split percent.
-    shuffle is always True, left there to be backwards compatible
-    '''
-    target_train_size = int(len(data_list) * (1. - test_size))
+SPLIT_STRATEGIES = ('random', 'session', 'block')
 
-    if shuffle:
-        train_data = []
-        i_sample = 0
-        while i_sample < target_train_size and len(data_list) > 1:
-            i_choice = random.randint(0, len(data_list) - 1)
-            train_data.append(data_list.pop(i_choice))
-            i_sample += 1
 
-        # remainder of the original list is the validation set
-        val_data = data_list
+def _group_numbers(groups) -> np.ndarray:
+    """ Number the groups of each row in the order they first appear """
+    _, first, inverse = np.unique(np.asarray(groups), return_index=True,
+                                  return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[inverse.reshape(-1)]
 
+
+def _block_numbers(n: int, block_size: int, groups=None) -> np.ndarray:
+    """
+    Number contiguous blocks of block_size rows, blocks don't extend over
+    the boundaries of the groups.
+    """
+    rows = np.arange(n)
+    if groups is None:
+        return rows // block_size
+    group_numbers = _group_numbers(groups)
+    run_start = np.ones(n, dtype=bool)
+    run_start[1:] = group_numbers[1:] != group_numbers[:-1]
+    first_row = np.maximum.accumulate(np.where(run_start, rows, 0))
+    new_block = run_start | ((rows - first_row) % block_size == 0)
+    return np.cumsum(new_block) - 1
+
+
+def _split_groups(group_numbers: np.ndarray, val_size: int,
+                  rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Mask of the validation rows, which are made of whole groups. The groups
+    are picked at random, or from the end if no rng is given, until their
+    size is closest to val_size.
+    """
+    sizes = np.bincount(group_numbers)
+    num_groups = len(sizes)
+    order = rng.permutation(num_groups) if rng is not None \
+        else np.arange(num_groups)[::-1]
+    cum_sizes = np.concatenate([[0], np.cumsum(sizes[order])])
+    k = int(np.argmin(np.abs(cum_sizes - val_size)))
+    if val_size > 0 and num_groups > 1:
+        # keep at least one group on each side
+        k = min(max(k, 1), num_groups - 1)
+    val_groups = np.zeros(num_groups, dtype=bool)
+    val_groups[order[:k]] = True
+    return val_groups[group_numbers]
+
+
+def split_indexes(n: int,
+                  test_size: float = 0.2,
+                  shuffle: bool = True,
+                  strategy: str = 'random',
+                  groups=None,
+                  block_size: int = 200,
+                  seed: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split the indexes 0..n-1 into training and validation indexes in linear
+    time.
+
+    :param n:           number of samples
+    :param test_size:   fraction of the samples used for validation
+    :param shuffle:     pick the validation samples at random, otherwise
+                        the last ones are used for validation
+    :param strategy:    'random' splits single samples, 'session' keeps the
+                        samples of each group on one side and 'block' does
+                        the same for contiguous blocks of block_size samples
+                        within each group, so near identical consecutive
+                        frames don't end up in training and validation
+    :param groups:      sequence of n group ids, like tub session ids,
+                        required for 'session', optional for 'block'
+    :param block_size:  number of samples per block
+    :param seed:        seed of the random generator
+    :return:            tuple of training indexes, shuffled if shuffle is
+                        set, and sorted validation indexes
+    """
+    if strategy not in SPLIT_STRATEGIES:
+        raise ValueError(f'Unknown split strategy {strategy}, supported are '
+                         f'{", ".join(SPLIT_STRATEGIES)}')
+    rng = np.random.default_rng(seed) if shuffle else None
+    train_size = int(n * (1. - test_size))
+    if strategy == 'random':
+        rows = rng.permutation(n) if shuffle else np.arange(n)
+        return rows[:train_size], np.sort(rows[train_size:])
+
+    if strategy == 'session':
+        if groups is None:
+            raise ValueError('Splitting by session requires the groups')
+        group_numbers = _group_numbers(groups)
     else:
-        train_data = data_list[:target_train_size]
-        val_data = data_list[target_train_size:]
+        group_numbers = _block_numbers(n, block_size, groups)
+    val_mask = _split_groups(group_numbers, n - train_size, rng) \
+        if n else np.zeros(0, dtype=bool)
+    train = np.flatnonzero(~val_mask)
+    if shuffle:
+        rng.shuffle(train)
+    return train, np.flatnonzero(val_mask)
+
 
-    return train_data, val_data
+def train_test_split(data_list: List[Any],
+                     shuffle: bool = True,
+                     test_size: float = 0.2,
+                     strategy: str = 'random',
+                     groups=None,
+                     block_size: int = 200,
+                     seed: int = None) -> Tuple[List[Any], List[Any]]:
+    """
+    Split a list into training and validation lists, see split_indexes for
+    the parameters. The list is not changed.
+    """
+    train, val = split_indexes(len(data_list), test_size, shuffle, strategy,
+                               groups, block_size, seed)
+    return [data_list[i] for i in train], [data_list[i] for i in val]
 
 
 """
@@ -11,56 +11,115 @@ import numpy as np
 import logging
 from threading import Thread
 from .memory import Memory
+from .scheduler import StageScheduler
+from .utilities.histogram import Histogram
 from prettytable import PrettyTable
 import traceback
 
 logger = logging.getLogger(__name__)
 
+# What to do when the drive loop can not keep its rate:
+#   None            keep going at full rate
+#   'skip_optional' skip parts added with optional=True
+#   'half_rate'     run the loop at half the rate
+# Both policies return to normal after the loop kept up for one second.
+OVERRUN_POLICIES = (None, 'skip_optional', 'half_rate')
+
+
+class PartRecord:
+    """
+    Timing record of a single part, the latest durations in nanoseconds
+    are kept in a fixed size ring buffer.
+    """
+    __slots__ = ('name', 'start', 'ring', 'count')
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.start = 0
+        self.ring = np.zeros(capacity, dtype=np.int64)
+        self.count = 0
+
 
 class PartProfiler:
-    def __init__(self):
+    """
+    Records how long each part takes to run. Only the latest capacity runs
+    of each part are kept, so recording is O(1) and memory is constant on
+    long runs. snapshot() can be polled from other threads while the
+    vehicle loop is running.
+    """
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
         self.records = {}
+        self.name_counts = {}
 
     def profile_part(self, p):
-        self.records[p] = { "times" : [] }
+        name = p.__class__.__name__
+        count = self.name_counts.get(name, 0)
+        self.name_counts[name] = count + 1
+        if count:
+            name = f'{name}_{count}'
+        self.records[p] = PartRecord(name, self.capacity)
 
     def on_part_start(self, p):
-        self.records[p]['times'].append(time.time())
+        self.records[p].start = time.perf_counter_ns()
 
     def on_part_finished(self, p):
-        now = time.time()
-        prev = self.records[p]['times'][-1]
-        delta = now - prev
-        thresh = 0.000001
-        if delta < thresh or delta > 100000.0:
-            delta = thresh
-        self.records[p]['times'][-1] = delta
+        rec = self.records[p]
+        delta = time.perf_counter_ns() - rec.start
+        # skip the first run, there could be one-off time spent in
+        # initialisations
+        if rec.count:
+            rec.ring[(rec.count - 1) % self.capacity] = delta
+        rec.count += 1
+
+    def snapshot(self, pctile=(50, 90, 99, 99.9)):
+        """
+        Statistics over the latest runs of each part in ms. Safe to call
+        from another thread, values are copied out of the ring buffers.
+
+        :return: dictionary of part name to dictionary of statistics
+        """
+        result = {}
+        for rec in list(self.records.values()):
+            n = min(rec.count - 1, self.capacity)
+            if n <= 0:
+                continue
+            arr = rec.ring[:n].copy() / 1e6
+            stats = {'count': rec.count - 1,
+                     'max': float(arr.max()),
+                     'min': float(arr.min()),
+                     'avg': float(arr.mean())}
+            for q, v in zip(pctile, np.percentile(arr, pctile)):
+                stats[f'p{q}'] = float(v)
+            result[rec.name] = stats
+        return result
 
     def report(self):
-        logger.info("Part Profile Summary: (times in ms)")
+        logger.info("Part Profile Summary: (times in ms, last %d runs)"
+                    % self.capacity)
         pt = PrettyTable()
         field_names = ["part", "max", "min", "avg"]
         pctile = [50, 90, 99, 99.9]
         pt.field_names = field_names + [str(p) + '%' for p in pctile]
-        for p, val in self.records.items():
-            # remove first and last entry because you there could be one-off
-            # time spent in initialisations, and the latest diff could be
-            # incomplete because of user keyboard interrupt
-            arr = val['times'][1:-1]
-            if len(arr) == 0:
-                continue
-            row = [p.__class__.__name__,
-                   "%.2f" % (max(arr) * 1000),
-                   "%.2f" % (min(arr) * 1000),
-                   "%.2f" % (sum(arr) / len(arr) * 1000)]
-            row += ["%.2f" % (np.percentile(arr, p) * 1000) for p in pctile]
+        for name, stats in self.snapshot(pctile).items():
+            row = [name] + ["%.2f" % stats[k] for k in ("max", "min", "avg")]
+            row += ["%.2f" % stats[f'p{p}'] for p in pctile]
             pt.add_row(row)
         logger.info('\n' + str(pt))
 
 
 class Vehicle:
-    def __init__(self, mem=None):
-
+    def __init__(self, mem=None, max_workers=0):
+        """
+        Parameters
+        ----------
+            mem : Memory
+                vehicle memory, a new one is created if not given
+            max_workers : int
+                if positive, independent parts of the drive loop are run
+                concurrently on a pool with that many threads, see
+                donkeycar.scheduler.StageScheduler
+        """
         if not mem:
             mem = Memory()
         self.mem = mem
@@ -68,9 +127,18 @@ class Vehicle:
         self.on = True
         self.threads = []
         self.profiler = PartProfiler()
+        self.scheduler = StageScheduler(max_workers) if max_workers > 0 \
+            else None
+        # flat execution plan compiled from self.parts, rebuilt lazily
+        # whenever a part is added or removed
+        self._plan = None
+        # always-on loop timing statistics in microseconds, also published
+        # to memory as 'loop/period_hist' and 'loop/lateness_hist'
+        self.loop_period = Histogram()
+        self.loop_lateness = Histogram()
 
     def add(self, part, inputs=[], outputs=[],
-            threaded=False, run_condition=None):
+            threaded=False, run_condition=None, optional=False):
         """
         Method to add a part to the vehicle drive loop.
 
@@ -86,10 +154,14 @@ class Vehicle:
                 If a part should be run in a separate thread.
             run_condition : str
                 If a part should be run or not
+            optional : boolean
+                If the part can be skipped when the loop overruns, see
+                the overrun_policy of start()
         """
         assert type(inputs) is list, "inputs is not a list: %r" % inputs
         assert type(outputs) is list, "outputs is not a list: %r" % outputs
         assert type(threaded) is bool, "threaded is not a boolean: %r" % threaded
+        assert type(optional) is bool, "optional is not a boolean: %r" % optional
 
         p = part
         logger.info('Adding part {}.'.format(p.__class__.__name__))
@@ -98,6 +170,11 @@ class Vehicle:
         entry['inputs'] = inputs
         entry['outputs'] = outputs
         entry['run_condition'] = run_condition
+        entry['optional'] = optional
+        # intern the channels so the memory slots exist before the loop
+        self.mem.slots(inputs + outputs)
+        if run_condition:
+            self.mem.slot(run_condition)
 
         if threaded:
             t = Thread(target=part.update, args=())
@@ -106,14 +183,52 @@ class Vehicle:
 
         self.parts.append(entry)
         self.profiler.profile_part(part)
+        self._plan = None
 
     def remove(self, part):
         """
         remove part form list
-        """
-        self.parts.remove(part)
 
-    def start(self, rate_hz=10, max_loop_count=None, verbose=False):
+        Parameters
+        ----------
+            part: dict or class
+                either the entry stored in self.parts or the part itself
+        """
+        if part in self.parts:
+            self.parts.remove(part)
+        else:
+            entry = next((e for e in self.parts if e['part'] is part), None)
+            if entry is None:
+                raise ValueError(f'Part {part} is not part of the vehicle')
+            self.parts.remove(entry)
+        self._plan = None
+
+    def compile_plan(self):
+        """
+        Compile the list of parts into a flat execution plan. Every step
+        is a tuple of (part, bound run callable, input slots, output slots,
+        run condition slot, optional flag) so that update_parts() does not
+        need to inspect the part entries or hash channel names on every
+        loop. The plan is rebuilt automatically after add() or remove().
+        """
+        plan = []
+        for entry in self.parts:
+            p = entry['part']
+            run = p.run_threaded if entry.get('thread') else p.run
+            inputs = self.mem.slots(entry['inputs'])
+            outputs = self.mem.slots(entry['outputs'])
+            run_condition = entry.get('run_condition')
+            run_condition = [self.mem.slot(run_condition)] \
+                if run_condition else None
+            plan.append((p, run, inputs, outputs, run_condition,
+                         entry.get('optional', False)))
+        self._plan = plan
+        if self.scheduler:
+            self.scheduler.compile(plan, self.mem)
+        return plan
+
+    def start(self, rate_hz=10, max_loop_count=None, verbose=False,
+              overrun_policy=None):
         """
         Start vehicle's main drive loop.
 
@@ -132,8 +247,20 @@ class Vehicle:
             used for testing that all the parts of the vehicle work.
         verbose: bool
             If debug output should be printed into shell
+        overrun_policy: str
+            One of OVERRUN_POLICIES, what to do when a loop takes longer
+            than 1 / rate_hz.
+
+        Loops are scheduled against absolute deadlines on the monotonic
+        clock, so the rate does not drift. After an overrun the schedule
+        restarts from the current time instead of trying to catch up.
+        Each loop records its period and its lateness against the deadline
+        in the histograms loop_period and loop_lateness, the last values
+        are written to 'loop/period_ms' and 'loop/lateness_ms'.
         """
-
+        assert overrun_policy in OVERRUN_POLICIES, \
+            "overrun_policy is not one of %r: %r" % (OVERRUN_POLICIES,
+                                                     overrun_policy)
         try:
 
             self.on = True
@@ -143,33 +270,75 @@ class Vehicle:
                     # start the update thread
                     entry.get('thread').start()
 
+            self.compile_plan()
+
             # wait until the parts warm up.
             logger.info('Starting vehicle at {} Hz'.format(rate_hz))
 
+            self.mem.put(['loop/period_hist', 'loop/lateness_hist',
+                          'loop/profiler'],
+                         [self.loop_period, self.loop_lateness, self.profiler])
+            timing_slots = self.mem.slots(['loop/period_ms',
+                                           'loop/lateness_ms'])
+            period = 1.0 / rate_hz
+            interval = period
+            skip_optional = False
+            overrun = False
+            on_time = 0
+            last_start_time = None
+
             loop_start_time = time.time()
+            deadline = time.perf_counter()
             loop_count = 0
             while self.on:
-                start_time = time.time()
+                start_time = time.perf_counter()
+                lateness = max(0.0, start_time - deadline)
+                self.loop_lateness.record(lateness * 1e6)
+                if last_start_time is not None:
+                    self.loop_period.record(
+                        (start_time - last_start_time) * 1e6)
+                    self.mem.put_slots(timing_slots,
+                                       [(start_time - last_start_time) * 1000,
+                                        lateness * 1000])
+                last_start_time = start_time
+                if overrun:
+                    # restart the schedule instead of catching up
+                    deadline = start_time
                 loop_count += 1
 
-                self.update_parts()
+                self.update_parts(skip_optional)
 
                 # stop drive loop if loop_count exceeds max_loopcount
                 if max_loop_count and loop_count >= max_loop_count:
                     self.on = False
                 else:
-                    sleep_time = 1.0 / rate_hz - (time.time() - start_time)
-                    if sleep_time > 0.0:
+                    deadline += interval
+                    sleep_time = deadline - time.perf_counter()
+                    overrun = sleep_time <= 0.0
+                    if not overrun:
                         time.sleep(sleep_time)
+                        on_time += 1
+                        if on_time >= rate_hz and (skip_optional
+                                                   or interval != period):
+                            logger.info('Vehicle loop keeps up again, '
+                                        'back to normal operation')
+                            skip_optional = False
+                            interval = period
                     else:
+                        on_time = 0
                         # print a message when could not maintain loop rate.
                         if verbose:
                             logger.info('WARN::Vehicle: jitter violation in vehicle loop '
                                   'with {0:4.0f}ms'.format(abs(1000 * sleep_time)))
+                        if overrun_policy == 'skip_optional':
+                            skip_optional = True
+                        elif overrun_policy == 'half_rate':
+                            interval = 2 * period
 
                     if verbose and loop_count % 200 == 0:
                         self.profiler.report()
-
+                        if self.scheduler:
+                            self.scheduler.report()
 
             loop_total_time = time.time() - loop_start_time
             logger.info(f"Vehicle executed {loop_count} steps in {loop_total_time} seconds.")
@@ -183,36 +352,41 @@ class Vehicle:
         finally:
             self.stop()
 
-    def update_parts(self):
+    def update_parts(self, skip_optional=False):
         '''
-        loop over all parts
+        loop over all parts, parts added as optional are not run if
+        skip_optional is set
         '''
-        for entry in self.parts:
-
-            run = True
+        plan = self._plan
+        if plan is None:
+            plan = self.compile_plan()
+        if self.scheduler:
+            self.scheduler.run(plan, self.mem, self.profiler, skip_optional)
+            return
+
+        mem_get = self.mem.get_slots
+        mem_put = self.mem.put_slots
+        on_part_start = self.profiler.on_part_start
+        on_part_finished = self.profiler.on_part_finished
+
+        for p, run, inputs, outputs, run_condition, optional in plan:
+            if skip_optional and optional:
+                continue
             # check run condition, if it exists
-            if entry.get('run_condition'):
-                run_condition = entry.get('run_condition')
-                run = self.mem.get([run_condition])[0]
-            
-            if run:
-                # get part
-                p = entry['part']
-                # start timing part run
-                self.profiler.on_part_start(p)
-                # get inputs from memory
-                inputs = self.mem.get(entry['inputs'])
-                # run the part
-                if entry.get('thread'):
-                    outputs = p.run_threaded(*inputs)
-                else:
-                    outputs = p.run(*inputs)
-
-                # save the output to memory
-                if outputs is not None:
-                    self.mem.put(entry['outputs'], outputs)
-                # finish timing part run
-                self.profiler.on_part_finished(p)
+            if run_condition is not None and not mem_get(run_condition)[0]:
+                continue
+            # start timing part run
+            on_part_start(p)
+            # get inputs from memory and run the part
+            if inputs:
+                result = run(*mem_get(inputs))
+            else:
+                result = run()
+            # save the output to memory
+            if result is not None:
+                mem_put(outputs, result)
+            # finish timing part run
+            on_part_finished(p)
 
     def stop(self):        
         logger.info('Shutting down vehicle and its parts...')
@@ -226,3 +400,15 @@ class Vehicle:
                 logger.error(e)
 
         self.profiler.report()
+        if self.scheduler:
+            self.scheduler.report()
+            self.scheduler.shutdown()
+        if self.loop_period.count:
+            period = self.loop_period.snapshot()
+            lateness = self.loop_lateness.snapshot()
+            logger.info('Loop period (ms): ' + ', '.join(
+                f'{k} {v / 1000:.2f}' for k, v in period.items()
+                if k != 'count'))
+            logger.info('Loop lateness (ms): ' + ', '.join(
+                f'{k} {v / 1000:.2f}' for k, v in lateness.items()
+                if k != 'count'))